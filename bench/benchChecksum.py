@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of file checksums (CHECKSUM FILEREPO). Writes files of random
+bytes, and times hashing them (fileChecksum.checksumFiles) for each given
+number of threads, reading into a buffer and memory-mapping, in MB/s, e.g.:
+
+  ./bench/benchChecksum.py -n 50 -s 64 -w 1,2,4 -a sha1,md5
+
+Run it on the storage holding the repository (-d); files written just before
+are likely in the page cache, so the first run measures hashing, not reading.
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+
+from lsst.dax.metaserv.fileChecksum import BUFFER_SIZE, checksumFiles
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="nFiles", type="int", default=20)
+    parser.add_option("-s", dest="sizeMB", type="int", default=32,
+                      help="size of each file, in MB")
+    parser.add_option("-w", dest="workers", default="1,2,4",
+                      help="comma-separated numbers of threads")
+    parser.add_option("-a", dest="algorithms", default="sha1",
+                      help="comma-separated hashlib algorithms")
+    parser.add_option("-b", dest="bufferKB", type="int",
+                      default=BUFFER_SIZE // 1024, help="read size, in KB")
+    parser.add_option("-d", dest="dir", default=None,
+                      help="directory for the files (default: temporary)")
+    (options, args) = parser.parse_args()
+
+    rootDir = options.dir or tempfile.mkdtemp(prefix="benchChecksum")
+    paths = [os.path.join(rootDir, "f%04d.fits" % i)
+             for i in range(options.nFiles)]
+    try:
+        chunk = os.urandom(1024 * 1024)
+        for path in paths:
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    for i in range(options.sizeMB):
+                        f.write(chunk)
+        tasks = list(enumerate(paths))
+        for algorithm in options.algorithms.split(","):
+            for workers in [int(w) for w in options.workers.split(",")]:
+                for useMmap in (False, True):
+                    start = time.time()
+                    nBytes = sum(r[2] for r in checksumFiles(
+                        tasks, algorithm, workers, options.bufferKB * 1024,
+                        useMmap))
+                    elapsed = time.time() - start
+                    print "%-6s %2d threads, %-4s: %.0f MB in %.2f s, " \
+                        "%.0f MB/s" % (algorithm, workers,
+                                       "mmap" if useMmap else "read",
+                                       nBytes / 1e6, elapsed,
+                                       nBytes / 1e6 / elapsed)
+    finally:
+        if not options.dir:
+            shutil.rmtree(rootDir)
+
+
+if __name__ == '__main__':
+    main()
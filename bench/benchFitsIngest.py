@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+
+"""
+Benchmark of file repository ingestion (ADD FILEREPO). Writes synthetic FITS
+files (a primary HDU with exposure keywords, and image extensions with
+pixels, one per amplifier), times listing them (fitsIngest.scanFitsFiles, the
+only work a rescan of an unchanged repository does on disk), and times header
+parsing for each given number of worker processes (fitsIngest.parseFitsFiles),
+in files per hour, e.g.:
+
+  ./bench/benchFitsIngest.py -n 2000 -e 16 -x 512 -w 1,2,4
+
+With -a, the files are also loaded through MetaAdminImpl.addFileRepo into a
+scratch metaserv database created (and at the end dropped) on the server
+described by the mysql auth file.
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+
+from lsst.dax.metaserv.fitsIngest import (findFitsFiles, parseFitsFiles,
+                                          scanFitsFiles)
+
+
+def card(key, value):
+    if isinstance(value, bool):
+        v = "%20s" % ("T" if value else "F")
+    elif isinstance(value, str):
+        v = "'%-8s'" % value
+    else:
+        v = "%20s" % value
+    return "%-80s" % ("%-8s= %s" % (key, v))
+
+
+def hdu(cards, dataSize):
+    header = "".join(cards) + "%-80s" % "END"
+    header += " " * (-len(header) % 2880)
+    return header + "\0" * (dataSize + (-dataSize % 2880))
+
+
+def writeFits(fName, i, nExt, nPix, nKeys):
+    """
+    Write synthetic FITS file number i, with nExt extensions of nPix x nPix
+    16-bit pixels, and nKeys extra keywords per HDU.
+    """
+    extra = [card("KEY%04d" % k, float(k) / 3) for k in range(nKeys)]
+    content = hdu([card("SIMPLE", True), card("BITPIX", 16), card("NAXIS", 0),
+                   card("EXTEND", True),
+                   card("DATE-OBS", "2015-%02d-%02dT01:02:03.5" %
+                        (i % 12 + 1, i % 28 + 1)),
+                   card("EXPTIME", 15.0 + i % 3 * 15),
+                   card("FILTER", "ugrizy"[i % 6]),
+                   card("AIRMASS", 1.0 + (i % 50) / 100.),
+                   card("VISIT", i)] + extra, 0)
+    for e in range(nExt):
+        content += hdu([card("XTENSION", "IMAGE"), card("BITPIX", 16),
+                        card("NAXIS", 2), card("NAXIS1", nPix),
+                        card("NAXIS2", nPix), card("PCOUNT", 0),
+                        card("GCOUNT", 1),
+                        card("RA", (i * 0.1 + e * 0.01) % 360),
+                        card("DEC", -30 + (i * 0.07) % 60),
+                        card("EXTNAME", "amp%02d" % e)] + extra,
+                       2 * nPix * nPix)
+    with open(fName, "wb") as f:
+        f.write(content)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="nFiles", type="int", default=1000)
+    parser.add_option("-e", dest="nExt", type="int", default=16,
+                      help="extensions per file")
+    parser.add_option("-x", dest="nPix", type="int", default=256,
+                      help="pixels per side of each extension")
+    parser.add_option("-k", dest="nKeys", type="int", default=50,
+                      help="extra keywords per HDU")
+    parser.add_option("-w", dest="workers", default="1",
+                      help="comma-separated numbers of worker processes")
+    parser.add_option("-d", dest="dir", default=None,
+                      help="directory for the files (default: temporary)")
+    parser.add_option("-a", dest="authF", default=None,
+                      help="mysql auth file, to time loading into metaserv")
+    parser.add_option("-b", dest="batchSize", type="int", default=1000)
+    (options, args) = parser.parse_args()
+
+    rootDir = options.dir or tempfile.mkdtemp(prefix="benchFitsIngest")
+    try:
+        if not findFitsFiles(rootDir):
+            start = time.time()
+            for i in range(options.nFiles):
+                writeFits(os.path.join(rootDir, "f%06d.fits" % i), i,
+                          options.nExt, options.nPix, options.nKeys)
+            print "wrote %d files in %.1f s" % (options.nFiles,
+                                                time.time() - start)
+        start = time.time()
+        paths = sorted(scanFitsFiles(rootDir)[0])
+        elapsed = time.time() - start
+        print "scan: %d files in %.2f s, %.0f files/sec" % (
+            len(paths), elapsed, len(paths) / elapsed)
+        for workers in [int(w) for w in options.workers.split(",")]:
+            start = time.time()
+            nKeywords = 0
+            for (path, info, error) in parseFitsFiles(rootDir, paths, workers):
+                nKeywords += len(info.keywords)
+            elapsed = time.time() - start
+            print "parse, %2d workers: %d files, %d keywords in %.2f s, " \
+                "%.0f files/hour" % (workers, len(paths), nKeywords, elapsed,
+                                     3600 * len(paths) / elapsed)
+        if options.authF:
+            loadIntoMetaserv(options, rootDir)
+    finally:
+        if not options.dir:
+            shutil.rmtree(rootDir)
+
+
+def loadIntoMetaserv(options, rootDir):
+    from lsst.db.engineFactory import getEngineFromFile
+    from lsst.db import utils
+    from lsst.db.testHelper import loadSqlScript
+    from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl
+
+    dbName = "metaServ_benchFitsIngest"
+    conn = getEngineFromFile(options.authF).connect()
+    utils.dropDb(conn, dbName, mustExist=False)
+    utils.createDb(conn, dbName)
+    utils.useDb(conn, dbName)
+    try:
+        for script in ("userAuth", "repo", "dbRepo", "fileRepo"):
+            loadSqlScript(conn, "sql/%s.sql" % script)
+        conn.execute("INSERT INTO Institution(instName) VALUES('bench')")
+        conn.execute("INSERT INTO User(mysqlUserName, instId) VALUES('bench', 1)")
+        conn.execute("INSERT INTO Project(projectName) VALUES('LSST')")
+        impl = MetaAdminImpl(options.authF, batchSize=options.batchSize)
+        workers = int(options.workers.split(",")[-1])
+        # pin a connection using the scratch database
+        with impl._conns.pinned(options.authF) as msConn:
+            msConn.execute("USE %s" % dbName)
+            stats = impl.addFileRepo(rootDir, "dev", "bench", "bench", "public",
+                                     "LSST", workers)
+        print "load, %2d workers: %d files in %.2f s, %.0f files/hour" % (
+            workers, stats["added"], stats["seconds"],
+            3600 * stats["added"] / stats["seconds"])
+        impl.close()
+    finally:
+        utils.dropDb(conn, dbName)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of storing table/column descriptions in metaserv: one table at a
+time (MetaAdminImpl._storeTablesPerRow) versus bulk (_storeTablesBulk).
+
+It creates (and at the end drops) a scratch database on the server described
+by the mysql auth file, e.g.:
+
+  ./bench/benchIngest.py -a ~/.lsst/dbAuth-metaServ.ini -t 400 -c 30
+"""
+
+from optparse import OptionParser
+import time
+
+from lsst.db.engineFactory import getEngineFromFile
+from lsst.db import utils
+from lsst.db.testHelper import loadSqlScript
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl
+from lsst.dax.metaserv.schemaToMeta import SchemaColumn, SchemaTable
+
+
+def makeSchema(nTables, nColumns):
+    """
+    Return synthetic parsed schema (as produced by iterSchema, with ord_pos).
+    """
+    tables = []
+    for t in range(nTables):
+        table = SchemaTable("t%05d" % t)
+        table.description = "Synthetic table %d." % t
+        for c in range(nColumns):
+            column = SchemaColumn("c%03d" % c, c + 1, "DOUBLE", False)
+            column.ord_pos = c + 1
+            column.description = "Synthetic column %d of table %d." % (c, t)
+            column.ucd = "meta.id"
+            column.unit = "deg"
+            table.columns.append(column)
+        tables.append(table)
+    return tables
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-a", dest="authF", default='~/.lsst/dbAuth-metaServ.ini')
+    parser.add_option("-d", dest="dbName", default="metaServ_benchIngest")
+    parser.add_option("-t", dest="nTables", type="int", default=400)
+    parser.add_option("-c", dest="nColumns", type="int", default=30)
+    parser.add_option("-b", dest="batchSize", type="int", default=1000)
+    (options, args) = parser.parse_args()
+
+    conn = getEngineFromFile(options.authF).connect()
+    utils.dropDb(conn, options.dbName, mustExist=False)
+    utils.createDb(conn, options.dbName)
+    utils.useDb(conn, options.dbName)
+    conn.execute("SET foreign_key_checks = 0")
+    loadSqlScript(conn, "sql/repo.sql")
+    loadSqlScript(conn, "sql/dbRepo.sql")
+
+    tables = makeSchema(options.nTables, options.nColumns)
+    nRows = options.nTables * (options.nColumns + 1)
+    impl = MetaAdminImpl(options.authF, batchSize=options.batchSize)
+    try:
+        for (repoId, name, store) in ((1, "per row", impl._storeTablesPerRow),
+                                      (2, "bulk", impl._storeTablesBulk)):
+            conn.execute("INSERT INTO DbRepo(dbRepoId, dbName) VALUES(%s, %s)",
+                         (repoId, "db%d" % repoId))
+            start = time.time()
+            with conn.begin():
+                store(conn, repoId, tables)
+            elapsed = time.time() - start
+            print "%-8s: %d tables, %d rows in %.3f s, %.0f rows/sec" % (
+                name, options.nTables, nRows, elapsed, nRows / elapsed)
+    finally:
+        utils.dropDb(conn, options.dbName)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of keyword queries (keywordQuery, /image/<level>/<repo>/query) on a
+synthetic FitsUnstructuredMeta of -n rows: -k keywords per file, a few of them
+queried (FILTER, AIRMASS, EXPTIME, VISIT), the others filler. The composite
+indexes (fitsKey, value, fileId) are emulated by sorted numpy arrays, one per
+queried keyword (rows of other keywords are never read by a query, so they are
+not materialized), and keywordQuery.findFiles runs against them through a
+minimal engine answering its statements.
+
+For each query, printed are the elapsed time and the cost of the plan, in
+index entries read (a probe of one file costing keywordQuery.PROBE_COST), and
+the cost of a self-join driven by the predicates in the order written (all
+entries matching the first predicate, then one probe per file and further
+predicate), and the time and cost of a page of -l files from the middle of the
+matches, e.g.:
+
+  ./bench/benchKeywordQuery.py -n 100000000 -k 50
+"""
+
+from optparse import OptionParser
+import operator
+import re
+import time
+
+import numpy as np
+
+from lsst.dax.metaserv import keywordQuery
+
+QUERIES = ["FILTER='r' AND AIRMASS<1.2",
+           "AIRMASS<1.2 AND FILTER='r'",
+           "AIRMASS>1.1 AND EXPTIME=30 AND FILTER='u'",
+           "FILTER!='y' AND VISIT=123456",
+           "AIRMASS>=2.45 AND AIRMASS<2.5 AND FILTER='g'"]
+
+
+class IndexEngine(object):
+    """
+    Answers keywordQuery statements from emulated indexes, counting index
+    entries read.
+    """
+
+    _CONDITION = re.compile(r"fitsKey = :key AND (\w+) (\S+) :value"
+                            r"(?: AND fileId IN \(([\d, ]+)\))?")
+
+    def __init__(self, indexes, byFile):
+        self.indexes = indexes # key -> (sorted values, fileIds)
+        self.byFile = byFile   # key -> values, indexed by fileId
+        self.cost = 0
+
+    def execute(self, query, key, value, after=None, upTo=None, cap=None,
+                size=None):
+        m = self._CONDITION.search(str(query))
+        (column, op, inList) = m.groups()
+        (values, fileIds) = self.indexes.get(key, (np.array([]), np.array([])))
+        (begin, end) = _range(values, op, value)
+        if inList is not None:
+            probes = np.fromstring(inList, dtype=np.int64, sep=",")
+            self.cost += len(probes) * keywordQuery.PROBE_COST
+            return _Result(probes[_OPS[op](self.byFile[key][probes], value)])
+        matches = _select(values, fileIds, op, begin, end)
+        if op == "=":
+            # ids of an equality are in order in the index, bounds are seeks
+            matches = matches[np.searchsorted(matches, after or 0, "right"):
+                              len(matches) if upTo is None else
+                              np.searchsorted(matches, upTo, "right")]
+            read = len(matches)
+        else:
+            read = len(matches)
+            matches = matches[(matches > (after or 0)) &
+                              (matches <= (np.inf if upTo is None else upTo))]
+            matches.sort()
+        if cap is not None:
+            self.cost += min(read, cap)
+            return _Result(min(len(matches), cap))
+        if size is not None:
+            matches = matches[:size]
+            read = len(matches) if op == "=" else read
+        self.cost += read
+        return _Result(matches)
+
+
+_OPS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt,
+        "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class _Result(object):
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def fetchall(self):
+        return [(f,) for f in self.value.tolist()]
+
+
+def _range(values, op, value):
+    if op in ("=", "!="):
+        return (np.searchsorted(values, value, "left"),
+                np.searchsorted(values, value, "right"))
+    if op in ("<", ">="):
+        return (0, np.searchsorted(values, value, "left")) if op == "<" \
+            else (np.searchsorted(values, value, "left"), len(values))
+    return (0, np.searchsorted(values, value, "right")) if op == "<=" \
+        else (np.searchsorted(values, value, "right"), len(values))
+
+
+def _count(op, begin, end, n):
+    return n - (end - begin) if op == "!=" else end - begin
+
+
+def _select(values, fileIds, op, begin, end):
+    if op == "!=":
+        return np.concatenate((fileIds[:begin], fileIds[end:]))
+    return fileIds[begin:end]
+
+
+def makeIndexes(nFiles, rng):
+    """
+    Return (emulated indexes of the queried keywords, values of the queried
+    keywords indexed by fileId), strings as str arrays.
+    """
+    columns = {"FILTER": np.array(list("ugrizy"))[rng.randint(0, 6, nFiles)],
+               "AIRMASS": np.round(rng.uniform(1.0, 2.5, nFiles), 3),
+               "EXPTIME": rng.choice([15., 30., 60., 300.], nFiles,
+                                     p=[0.1, 0.8, 0.05, 0.05]),
+               "VISIT": np.arange(nFiles, dtype=np.float64) * 3}
+    fileIds = np.arange(1, nFiles + 1, dtype=np.int64)
+    indexes = {}
+    byFile = {}
+    for (key, values) in columns.items():
+        order = np.argsort(values, kind="mergesort")
+        indexes[key] = (values[order], fileIds[order])
+        byFile[key] = np.concatenate((values[:1], values)) # no fileId 0
+    return (indexes, byFile)
+
+
+def selfJoinCost(engine, predicates):
+    """
+    Return the cost of a self-join driven by predicates in order.
+    """
+    first = predicates[0]
+    (values, fileIds) = engine.indexes[first.key]
+    (begin, end) = _range(values, first.op, first.value)
+    fileIds = _select(values, fileIds, first.op, begin, end)
+    cost = len(fileIds)
+    for p in predicates[1:]:
+        cost += len(fileIds) * keywordQuery.PROBE_COST
+        (values, ids) = engine.indexes[p.key]
+        (begin, end) = _range(values, p.op, p.value)
+        fileIds = np.intersect1d(fileIds, _select(values, ids, p.op, begin, end))
+    return cost
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="nRows", type="int", default=100000000,
+                      help="rows of FitsUnstructuredMeta")
+    parser.add_option("-k", dest="nKeys", type="int", default=50,
+                      help="keywords per file")
+    parser.add_option("-r", dest="repeat", type="int", default=5,
+                      help="runs of each query")
+    parser.add_option("-l", dest="limit", type="int", default=100,
+                      help="files per page")
+    parser.add_option("-s", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args()
+
+    nFiles = options.nRows // options.nKeys
+    rng = np.random.RandomState(options.seed)
+    start = time.time()
+    engine = IndexEngine(*makeIndexes(nFiles, rng))
+    print "%d files, %d keyword rows, indexes built in %.1f s" % (
+        nFiles, nFiles * options.nKeys, time.time() - start)
+    for query in QUERIES:
+        predicates = keywordQuery.parseQuery(query)
+        engine.cost = 0
+        start = time.time()
+        for i in range(options.repeat):
+            found = keywordQuery.findFiles(engine, predicates)
+        elapsed = (time.time() - start) / options.repeat
+        cost = engine.cost // options.repeat
+        # a page from the middle of the matches
+        after = int(found[len(found) // 2]) if len(found) else None
+        engine.cost = 0
+        start = time.time()
+        for i in range(options.repeat):
+            keywordQuery.findFiles(engine, predicates, None, after,
+                                   options.limit + 1)
+        pageElapsed = (time.time() - start) / options.repeat
+        print "%-45s %8d files, %7.1f ms, cost %9d (self-join: %9d), " \
+            "page: %7.1f ms, cost %9d" % (
+                query, len(found), 1e3 * elapsed, cost,
+                selfJoinCost(engine, predicates), 1e3 * pageElapsed,
+                engine.cost // options.repeat)
+
+
+if __name__ == '__main__':
+    main()
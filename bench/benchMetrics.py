@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of the collection of request metrics (see metrics). Times
+recording one request (Metrics.observeRequest, with phases and size) over a
+number of routes, then the overhead of the request hooks of metaREST_v0, as
+the difference of the time taken by requests to /meta/v0/cache (which runs
+no query) with and without the hooks, e.g.:
+
+  ./bench/benchMetrics.py -n 200000 -r 20
+"""
+
+from optparse import OptionParser
+import time
+
+from flask import Flask
+import sqlalchemy
+
+from lsst.dax.metaserv import metaREST_v0
+from lsst.dax.metaserv.metrics import Metrics
+
+
+def _timeRequests(client, n):
+    start = time.time()
+    for i in xrange(n):
+        client.get("/meta/v0/cache")
+    return (time.time() - start) / n
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="n", type="int", default=100000,
+                      help="number of observations")
+    parser.add_option("-r", dest="routes", type="int", default=20,
+                      help="number of distinct routes")
+    parser.add_option("-q", dest="requests", type="int", default=5000,
+                      help="number of requests per run")
+    parser.add_option("-t", dest="runs", type="int", default=5,
+                      help="number of runs")
+    (options, args) = parser.parse_args()
+
+    m = Metrics()
+    routes = ["/meta/v0/route%d" % i for i in range(options.routes)]
+    start = time.time()
+    for i in xrange(options.n):
+        m.observeRequest(routes[i % len(routes)], "GET", 200, 0.003 * (i % 7),
+                         {"db": 0.002, "serialize": 0.0004}, 1000 + i % 5000)
+    elapsed = time.time() - start
+    print "observeRequest: %.2f us per request" % (elapsed / options.n * 1e6)
+    start = time.time()
+    text = m.render()
+    print "render: %.1f ms, %d bytes" % ((time.time() - start) * 1e3, len(text))
+
+    app = Flask(__name__)
+    app.config["default_engine"] = sqlalchemy.create_engine("sqlite://")
+    app.config["metaserv_cache_size"] = 0
+    app.register_blueprint(metaREST_v0.metaREST, url_prefix='/meta/v0')
+    client = app.test_client()
+    _timeRequests(client, 100) # warm up
+    hooks = [(funcs, funcs["metaREST"]) for funcs in (
+        app.before_request_funcs, app.after_request_funcs,
+        app.teardown_request_funcs)]
+    # runs alternate, the best of each is kept
+    (withHooks, withoutHooks) = ([], [])
+    for run in range(options.runs):
+        withHooks.append(_timeRequests(client, options.requests))
+        for (funcs, hook) in hooks:
+            del funcs["metaREST"]
+        withoutHooks.append(_timeRequests(client, options.requests))
+        for (funcs, hook) in hooks:
+            funcs["metaREST"] = hook
+    (withHooks, withoutHooks) = (min(withHooks), min(withoutHooks))
+    print "request: %.1f us with metrics hooks, %.1f us without, overhead " \
+        "%.1f us (phases are timed in both)" % (
+            withHooks * 1e6, withoutHooks * 1e6, (withHooks - withoutHooks) * 1e6)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of the schema parser (schemaToMeta.parseSchema): parses a synthetic
+schema file and reports throughput in lines per second. With -r, the
+reference (regex-per-line) parser from tests/ is timed as well, and both
+results are checked to be identical. With -w, the parallel parser
+(schemaToMeta.parseSchemaParallel) is timed for each given number of worker
+processes, to show how it scales, e.g.:
+
+  ./bench/benchSchemaParser.py -t 2000 -c 50 -r -w 1,2,4,8
+"""
+
+from optparse import OptionParser
+import os
+import sys
+import tempfile
+import time
+
+from lsst.dax.metaserv.schemaToMeta import parseSchema, parseSchemaParallel
+
+
+def writeSchema(f, nTables, nColumns):
+    """
+    Write synthetic schema with nTables tables of nColumns columns each,
+    return number of lines written.
+    """
+    nLines = 0
+    for t in range(nTables):
+        lines = ["CREATE TABLE t%05d" % t,
+                 "    -- <descr>Synthetic table %d, with a description" % t,
+                 "    -- spanning two lines.</descr>",
+                 "("]
+        for c in range(nColumns):
+            lines += ["    c%03d DOUBLE NOT NULL DEFAULT 0," % c,
+                      "        -- <descr>Synthetic column %d of table %d.</descr>"
+                      % (c, t),
+                      "        -- <ucd>pos.eq.ra</ucd>",
+                      "        -- <unit>deg</unit>"]
+        lines += ["    PRIMARY KEY (c000),",
+                  "    INDEX IDX_c001 (c001 ASC)",
+                  ") ENGINE=MyISAM;",
+                  ""]
+        f.write("\n".join(lines))
+        f.write("\n")
+        nLines += len(lines)
+    return nLines
+
+
+def timeIt(name, parse, fName, nLines, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = parse(fName)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print "%-10s: %d lines in %.3f s, %.0f lines/sec" % (
+        name, nLines, best, nLines / best)
+    return result
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-t", dest="nTables", type="int", default=1000)
+    parser.add_option("-c", dest="nColumns", type="int", default=30)
+    parser.add_option("-n", dest="repeat", type="int", default=3)
+    parser.add_option("-r", dest="reference", action="store_true", default=False,
+                      help="also time the reference parser from tests/")
+    parser.add_option("-w", dest="workers", default="",
+                      help="comma-separated numbers of worker processes to time "
+                      "the parallel parser with")
+    (options, args) = parser.parse_args()
+
+    (fd, fName) = tempfile.mkstemp(suffix=".sql")
+    try:
+        with os.fdopen(fd, "w") as f:
+            nLines = writeSchema(f, options.nTables, options.nColumns)
+        result = timeIt("parser", parseSchema, fName, nLines, options.repeat)
+        if options.reference:
+            sys.path.insert(0, os.path.join(os.path.dirname(
+                os.path.abspath(__file__)), os.pardir, "tests"))
+            import schemaToMetaReference
+            expected = timeIt("reference", schemaToMetaReference.parseSchema,
+                              fName, nLines, options.repeat)
+            if result != expected:
+                print "ERROR: parsers disagree"
+                sys.exit(1)
+        for workers in [int(w) for w in options.workers.split(",") if w]:
+            parse = lambda fName: parseSchemaParallel([fName], workers)
+            if timeIt("%d workers" % workers, parse, fName, nLines,
+                      options.repeat) != result:
+                print "ERROR: parallel parser disagrees"
+                sys.exit(1)
+    finally:
+        os.remove(fName)
+
+
+if __name__ == '__main__':
+    main()
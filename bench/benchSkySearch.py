@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmark of positional searches of images (/image/<level>/<repo>/search).
+Generates synthetic exposure positions, uniform on the sky, times computing
+their HEALPix index (healpix.ang2pix, done at ingest), and then, for cones of
+each given radius at random positions, compares:
+* the HEALPix index: healpix.coverCone, one range lookup per pixel range of
+  the cover, then exact filtering of the candidates,
+* a decl index (what IDX_fitsStructuredMeta_decl provides): one range lookup
+  on decl, then exact filtering of the candidates.
+Indexes are emulated by sorted numpy arrays, so the numbers of candidates
+read are what the database would read, e.g.:
+
+  ./bench/benchSkySearch.py -n 5000000 -q 200 -r 0.05,0.5,2
+
+With -t, exposures are also spread over -y years, and queries combine the cone
+with a time window of -t days ("what was observed in this field last week").
+Printed are, per query, the index entries examined and the rows read with the
+composite index (healpixId, fileId, hdu, obsStart, expTime), where the time
+filter is checked on index entries, against the rows read with an index on
+healpixId alone, and with an index on obsStart alone.
+"""
+
+from optparse import OptionParser
+import time
+
+import numpy as np
+
+from lsst.dax.metaserv import healpix
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="nRows", type="int", default=2000000,
+                      help="number of exposures")
+    parser.add_option("-q", dest="nQueries", type="int", default=100,
+                      help="number of queries per radius")
+    parser.add_option("-r", dest="radii", default="0.05,0.5,2",
+                      help="comma-separated radii, in degrees")
+    parser.add_option("-t", dest="days", type="float", default=None,
+                      help="time window of queries, in days")
+    parser.add_option("-y", dest="years", type="float", default=10,
+                      help="time span of the exposures, in years")
+    parser.add_option("-s", dest="seed", type="int", default=1)
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(options.seed)
+    ra = rng.uniform(0, 360, options.nRows)
+    decl = np.degrees(np.arcsin(rng.uniform(-1, 1, options.nRows)))
+
+    start = time.time()
+    pixels = healpix.ang2pix(healpix.ORDER, ra, decl)
+    elapsed = time.time() - start
+    print "ang2pix: %d positions in %.2f s, %.0f positions/sec" % (
+        options.nRows, elapsed, options.nRows / elapsed)
+
+    order = np.argsort(pixels)
+    byPixel = (pixels[order], ra[order], decl[order])
+    order = np.argsort(decl)
+    byDecl = (decl[order], ra[order])
+    del order
+
+    for radius in [float(r) for r in options.radii.split(",")]:
+        cRa = rng.uniform(0, 360, options.nQueries)
+        cDecl = np.degrees(np.arcsin(rng.uniform(-1, 1, options.nQueries)))
+        stats = {}
+        for (name, search) in (("healpix", searchHealpix),
+                               ("decl", searchDecl)):
+            index = byPixel if name == "healpix" else byDecl
+            candidates = found = 0
+            start = time.time()
+            for (r, d) in zip(cRa, cDecl):
+                (nCandidates, nFound) = search(index, r, d, radius)
+                candidates += nCandidates
+                found += nFound
+            elapsed = time.time() - start
+            stats[name] = found
+            print "radius %6.3f, %-7s: %.2f ms/query, %10.1f candidates, " \
+                "%8.1f found per query" % (
+                    radius, name, 1e3 * elapsed / options.nQueries,
+                    float(candidates) / options.nQueries,
+                    float(found) / options.nQueries)
+        if stats["healpix"] != stats["decl"]:
+            print "MISMATCH: %s" % stats
+    if options.days is not None:
+        benchTimeWindow(options, rng, byPixel)
+
+
+def benchTimeWindow(options, rng, byPixel):
+    """
+    Time searches combining a cone and a time window.
+    """
+    span = options.years * 365.25
+    obsStart = rng.uniform(0, span, options.nRows)
+    (pixels, pRa, pDecl) = byPixel
+    for radius in [float(r) for r in options.radii.split(",")]:
+        examined = read = found = 0
+        start = time.time()
+        for i in range(options.nQueries):
+            ra = rng.uniform(0, 360)
+            decl = np.degrees(np.arcsin(rng.uniform(-1, 1)))
+            tMax = rng.uniform(options.days, span)
+            rows = _coverRows(pixels, ra, decl, radius)
+            inWindow = rows[(obsStart[rows] >= tMax - options.days) &
+                            (obsStart[rows] <= tMax)]
+            distances = healpix.angularDistance(ra, decl, pRa[inWindow],
+                                                pDecl[inWindow])
+            examined += len(rows)
+            read += len(inWindow)
+            found += int((distances <= radius).sum())
+        elapsed = time.time() - start
+        n = float(options.nQueries)
+        print "radius %6.3f, %g days: %.2f ms/query, %.1f entries examined, " \
+            "%.1f rows read (%.1f with healpixId alone, %.0f with obsStart " \
+            "alone), %.1f found per query" % (
+                radius, options.days, 1e3 * elapsed / n, examined / n, read / n,
+                examined / n, options.nRows * options.days / span, found / n)
+
+
+def searchHealpix(index, ra, decl, radius):
+    (pixels, pRa, pDecl) = index
+    rows = _coverRows(pixels, ra, decl, radius)
+    distances = healpix.angularDistance(ra, decl, pRa[rows], pDecl[rows])
+    return (len(rows), int((distances <= radius).sum()))
+
+
+def _coverRows(pixels, ra, decl, radius):
+    """
+    Return positions in sorted array pixels of the candidates of a cone.
+    """
+    ranges = np.array(healpix.coverCone(ra, decl, radius))
+    begins = np.searchsorted(pixels, ranges[:, 0], side="left")
+    ends = np.searchsorted(pixels, ranges[:, 1], side="right")
+    return np.concatenate([np.arange(b, e) for (b, e) in zip(begins, ends)])
+
+
+def searchDecl(index, ra, decl, radius):
+    (pDecl, pRa) = index
+    begin = np.searchsorted(pDecl, decl - radius, side="left")
+    end = np.searchsorted(pDecl, decl + radius, side="right")
+    distances = healpix.angularDistance(ra, decl, pRa[begin:end],
+                                        pDecl[begin:end])
+    return (end - begin, int((distances <= radius).sum()))
+
+
+if __name__ == '__main__':
+    main()
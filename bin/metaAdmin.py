@@ -31,8 +31,10 @@ here is primarily responsible for parsing arguments.
 import logging as log
 from optparse import OptionParser
 import sys
+import time
 
 from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl
+from lsst.dax.metaserv.schemaCache import SchemaCache
 from lsst.dax.metaserv.metaBException import MetaBException
 
 
@@ -44,21 +46,27 @@ class CommandParser(object):
     Parse commands and calls appropriate function from MetaAdminImpl
     """
 
-    def __init__(self, msAuthFileName):
+    def __init__(self, msAuthFileName, schemaCacheDir=None):
         """
         Initialize shared metadata, including list of supported commands.
 
         @param msAuthFileName file name of the file containing metaserv
                               mysql authorization.
+        @param schemaCacheDir directory of the cache of parsed schema files,
+                              None to disable caching.
         """
         self._msAuthFileName = msAuthFileName
         self._funcMap = {
             'ADD':        self._parseAdd,
+            'CHECKSUM':   self._parseChecksum,
             'EXIT':       self._justExit,
             'HELP':       self._printHelp,
-            'QUIT':       self._justExit
+            'QUIT':       self._justExit,
+            'UPDATE':     self._parseUpdate,
+            'VALIDATE':   self._parseValidate
             }
-        self._impl = MetaAdminImpl(msAuthFileName)
+        schemaCache = SchemaCache(schemaCacheDir) if schemaCacheDir else None
+        self._impl = MetaAdminImpl(msAuthFileName, schemaCache=schemaCache)
         self._supportedCommands = """
   Supported commands:
 
@@ -74,7 +82,9 @@ class CommandParser(object):
      <schemaFile>
          Ascii file containing additional description of the schema. The
          description can include description of tables, columns, as well as
-         special tokens, such as units or ucds.
+         special tokens, such as units or ucds. It can be gzip or bz2
+         compressed (.gz or .bz2 extension), "-" reads it from the standard
+         input.
 
      <level>
          Supported values are: DC, L1, L2, L3, dev.
@@ -98,6 +108,34 @@ class CommandParser(object):
 
     --------------------------------------------------------------------------------
 
+    ADD DBDESCR MANIFEST <manifestFile> <workers>;
+
+    It adds all databases listed in <manifestFile>, as ADD DBDESCR does. The
+    manifest is a CSV file with a header line naming the columns: dbName,
+    schemaFile, level, dataRel, owner, accessibility, and optionally project
+    and mysqlAuthFile (same meaning and defaults as for ADD DBDESCR), or a YAML
+    file (.yaml or .yml) with a list of mappings with the same keys. Relative
+    schema file paths are relative to the directory of the manifest.
+    Up to <workers> databases (default: 4) are fetched and matched with their
+    schema files concurrently; they are written to metaserv one at a time,
+    each in its own transaction, also in batch mode (-s), where they are not
+    rolled back with the other commands of the group. The outcome is printed
+    for each database; a failure does not prevent adding the other databases.
+
+    --------------------------------------------------------------------------------
+
+    ADD FILEREPO <rootDir> <level> <dataRel> <owner> <accessibility> <project>
+                 <workers>;
+
+    It adds a file repository: all FITS files found under directory <rootDir>
+    (recursively), along with metadata read from their headers (structured
+    metadata such as position, exposure start and duration, and all other
+    keywords as key/value pairs). Only the headers are read. <level>, <dataRel>,
+    <owner>, <accessibility> and <project> are the same as for ADD DBDESCR.
+    Headers are parsed by <workers> processes (default: one per core).
+
+    --------------------------------------------------------------------------------
+
     ADD DB <dbName> <level> <dataRel> <owner> <accessibility> <project>
            <mysqlAuthFile>;
 
@@ -124,6 +162,46 @@ class CommandParser(object):
 
     --------------------------------------------------------------------------------
 
+    CHECKSUM FILEREPO <rootDir> <algorithm> <workers>;
+
+    It computes checksums of the files of a file repository added through ADD
+    FILEREPO that don't have one yet (new files, and files that changed, as
+    found by UPDATE FILEREPO). <algorithm> is a hashlib algorithm whose hex
+    digest fits in 128 characters, e.g. md5, sha1 (default), sha256, sha384.
+    Files are hashed by <workers> threads (default: 4); the throughput is
+    printed, to help tuning the number of threads to the storage.
+
+    --------------------------------------------------------------------------------
+
+    UPDATE DBDESCR <dbName> <schemaFile> <mysqlAuthFile>;
+
+    It updates description of a database added earlier through ADD DBDESCR, after
+    its schema, or <schemaFile>, changed. Only the differences are written;
+    tables that did not change are skipped. Parameters are the same as for
+    ADD DBDESCR.
+
+    --------------------------------------------------------------------------------
+
+    UPDATE FILEREPO <rootDir> <workers>;
+
+    It brings a file repository added earlier through ADD FILEREPO in sync with
+    the content of <rootDir>: new files are added, files whose size or
+    modification time changed are read again, files that disappeared are marked
+    as not on disk. Unchanged files are not read. <workers> is the same as for
+    ADD FILEREPO. Positions ingested before the spatial index existed
+    (sql/migrations/004_fitsHealpixId.sql) are indexed.
+
+    --------------------------------------------------------------------------------
+
+    VALIDATE DBDESCR <dbName> <schemaFile> <mysqlAuthFile>;
+
+    Dry run of ADD DBDESCR: compares <schemaFile> with the schema of the database,
+    and prints every difference found (missing or extra tables and columns,
+    ordinal position drift, type mismatches). Nothing is written to metaserv.
+    Parameters are the same as for ADD DBDESCR.
+
+    --------------------------------------------------------------------------------
+
     QUIT;
 
     --------------------------------------------------------------------------------
@@ -136,6 +214,12 @@ class CommandParser(object):
 
 """
 
+    def close(self):
+        """
+        Close connections to database servers.
+        """
+        self._impl.close()
+
     def receiveCommands(self):
         """
         Receive user commands. End of command is determined by ';'. Multiple
@@ -157,19 +241,130 @@ class CommandParser(object):
                     log.error("%s", e)
                 cmd = cmd[pos+1:]
 
+    def runScript(self, scriptFile, groupSize=1, continueOnError=False):
+        """
+        Run commands from a script, without prompting. The whole script is
+        parsed before anything runs, so that a syntax error anywhere in it
+        does not leave the work half done. Commands run over one pooled
+        connection to metaserv, in transactions of groupSize commands each. A
+        summary with the time taken by each command is printed at the end.
+
+        @param scriptFile       name of the script file, "-" for the standard
+                                input. Commands end with ';', lines starting
+                                with '#' are comments. EXIT or QUIT ends the
+                                script.
+        @param groupSize        number of commands per transaction, 0 to run
+                                the whole script in one transaction. If a
+                                command fails, its whole transaction is
+                                rolled back.
+        @param continueOnError  after a failed transaction, carry on with the
+                                next one instead of stopping
+
+        @return 0 if all commands succeeded, 1 otherwise
+        """
+        if scriptFile == "-":
+            text = sys.stdin.read()
+        else:
+            with open(scriptFile) as f:
+                text = f.read()
+        text = "\n".join(line for line in text.decode("utf-8").splitlines()
+                         if not line.lstrip().startswith('#'))
+        cmds = text.split(';')
+        if cmds[-1].strip():
+            log.error("Missing ';' at the end of: %s", cmds[-1].strip())
+            return 1
+
+        # Parse everything first
+        actions = []
+        nErrors = 0
+        for cmd in cmds[:-1]:
+            cmd = " ".join(cmd.split())
+            if not cmd:
+                continue
+            if cmd.split()[0].upper() in ('EXIT', 'QUIT'):
+                break
+            try:
+                actions.append((cmd, self._compile(cmd)))
+            except MetaBException as e:
+                log.error("%s: %s", cmd, e)
+                nErrors += 1
+        if nErrors:
+            log.error("%d errors in script, nothing was run.", nErrors)
+            return 1
+
+        # Then run, one transaction per group of commands
+        if groupSize <= 0:
+            groupSize = max(1, len(actions))
+        timings = [] # (command, seconds or None if not run, status)
+        failed = False
+        start = time.time()
+        for i in range(0, len(actions), groupSize):
+            group = actions[i:i+groupSize]
+            if failed and not continueOnError:
+                timings.extend((cmd, None, "skipped") for (cmd, action) in group)
+                continue
+            groupTimings = []
+            try:
+                with self._impl.transaction():
+                    for (cmd, action) in group:
+                        cmdStart = time.time()
+                        try:
+                            action()
+                        except Exception as e:
+                            log.error("%s: %s", cmd, e)
+                            groupTimings.append(
+                                (cmd, time.time() - cmdStart, "failed"))
+                            raise
+                        groupTimings.append((cmd, time.time() - cmdStart, "ok"))
+            except Exception:
+                failed = True
+                groupTimings = [(cmd, sec, "rolled back" if status == "ok"
+                                 else status)
+                                for (cmd, sec, status) in groupTimings]
+                groupTimings.extend((cmd, None, "skipped")
+                                    for (cmd, action) in group[len(groupTimings):])
+            timings.extend(groupTimings)
+        elapsed = time.time() - start
+
+        self._printSummary(timings, elapsed)
+        return 1 if failed else 0
+
+    def _printSummary(self, timings, elapsed):
+        """
+        Print time taken by each command run by runScript, and totals.
+        """
+        counts = {}
+        for (cmd, sec, status) in timings:
+            counts[status] = counts.get(status, 0) + 1
+            print "%9s  %-11s %s" % ("-" if sec is None else "%.3f s" % sec,
+                                     status, cmd)
+        print "%d commands (%s) in %.3f s, %.1f commands/sec" % (
+            len(timings),
+            ", ".join("%d %s" % (counts[k], k) for k in sorted(counts)),
+            elapsed, counts.get("ok", 0) / elapsed if elapsed else 0.)
+
     def _parse(self, cmd):
         """
-        Parse, and dispatch to subparsers based on first word. Raise exceptions on
+        Parse, and run command. Raise exceptions on errors.
+        """
+        action = self._compile(cmd)
+        if action is not None:
+            action()
+
+    def _compile(self, cmd):
+        """
+        Parse, and dispatch to subparsers based on first word. Return function
+        running the command, None if the command is empty. Raise exceptions on
         errors.
         """
         cmd = cmd.strip()
         # ignore empty commands, these can be generated by typing ;;
-        if len(cmd) == 0: return
+        if len(cmd) == 0: return None
         tokens = cmd.split()
         tokens = [t for t in tokens]
         t = tokens[0].upper()
         if t in self._funcMap:
-            self._funcMap[t](tokens[1:])
+            return self._funcMap[t](tokens[1:])
         else:
             raise MetaBException(MetaBException.NOT_IMPLEMENTED, cmd)
 
@@ -181,18 +376,22 @@ class CommandParser(object):
             raise MetaBException(MetaBException.BAD_CMD, "Missing tokens for ADD")
         t = tokens[0].upper()
         if t == 'DBDESCR':
-            self._parseAddDbDescr(tokens[1:])
+            return self._parseAddDbDescr(tokens[1:])
+        elif t == 'FILEREPO':
+            return self._parseAddFileRepo(tokens[1:])
         elif t == 'INSTITUTION':
-            self._parseAddInstitution(tokens[1:])
+            return self._parseAddInstitution(tokens[1:])
         elif t == 'PROJECT':
-            self._parseAddProject(tokens[1:])
+            return self._parseAddProject(tokens[1:])
         elif t == 'USER':
-            self._parseAddUser(tokens[1:])
+            return self._parseAddUser(tokens[1:])
         else:
             raise MetaBException(MetaBException.BAD_CMD)
 
     def _parseAddDbDescr(self, tokens):
         length = len(tokens)
+        if length in (2, 3) and tokens[0].upper() == 'MANIFEST':
+            return self._parseAddDbDescrManifest(tokens[1:])
         if length < 6 or length > 8:
             raise MetaBException(MetaBException.BAD_CMD,
                                  "Unexpected number of arguments.")
@@ -200,14 +399,157 @@ class CommandParser(object):
         (dbName, schemaFile, level, dataRel, owner, accessibility) = tokens[0:6]
         project = (tokens[6] if length > 6 else "LSST")
         dbMysqlAuthF = (tokens[7] if length > 7 else self._msAuthFileName)
-        self._impl.addDbDescr(dbName, schemaFile, level, dataRel, owner,
-                              accessibility, project, dbMysqlAuthF)
+        return lambda: self._impl.addDbDescr(dbName, schemaFile, level, dataRel,
+                                             owner, accessibility, project,
+                                             dbMysqlAuthF)
+
+    def _parseAddDbDescrManifest(self, tokens):
+        manifestFile = tokens[0]
+        try:
+            workers = (int(tokens[1]) if len(tokens) > 1 else 4)
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "<workers> must be a positive integer.")
+        def run():
+            results = self._impl.addDbDescrManifest(manifestFile, workers)
+            failed = [dbName for (dbName, error) in results if error is not None]
+            for (dbName, error) in results:
+                print "  %-30s %s" % (dbName, "ok" if error is None else error)
+            print "%d database(s) added, %d failed" % (len(results) - len(failed),
+                                                       len(failed))
+            if failed:
+                raise MetaBException(MetaBException.NOT_ALL_ADDED,
+                                     ", ".join(failed))
+        return run
+
+    def _parseAddFileRepo(self, tokens):
+        length = len(tokens)
+        if length < 5 or length > 7:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Unexpected number of arguments.")
+        (rootDir, level, dataRel, owner, accessibility) = tokens[0:5]
+        project = (tokens[5] if length > 5 else "LSST")
+        try:
+            workers = (int(tokens[6]) if length > 6 else None)
+        except ValueError:
+            workers = 0
+        if workers is not None and workers < 1:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "<workers> must be a positive integer.")
+        def run():
+            stats = self._impl.addFileRepo(rootDir, level, dataRel, owner,
+                                           accessibility, project, workers)
+            print ", ".join("%s: %d" % (k, stats[k]) for k in sorted(stats))
+            if stats["seconds"] > 0:
+                print "%.0f files/hour" % (3600 * stats["added"] /
+                                           stats["seconds"])
+        return run
+
+    def _parseChecksum(self, tokens):
+        """
+        Subparser - handles CHECKSUM requests.
+        """
+        if not tokens:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Missing tokens for CHECKSUM")
+        if tokens[0].upper() != 'FILEREPO':
+            raise MetaBException(MetaBException.BAD_CMD)
+        length = len(tokens)
+        if length < 2 or length > 4:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Unexpected number of arguments.")
+        rootDir = tokens[1]
+        algorithm = (tokens[2] if length > 2 else "sha1")
+        try:
+            workers = (int(tokens[3]) if length > 3 else 4)
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "<workers> must be a positive integer.")
+        def run():
+            stats = self._impl.checksumFileRepo(rootDir, algorithm, workers)
+            print "%d files hashed, %d skipped, %d failed, %.1f MB in %.1f s, " \
+                "%.1f MB/s" % (stats["hashed"], stats["skipped"],
+                               stats["failed"], stats["bytes"] / 1e6,
+                               stats["seconds"], stats["MBps"])
+        return run
+
+    def _parseUpdate(self, tokens):
+        """
+        Subparser - handles UPDATE requests.
+        """
+        if not tokens:
+            raise MetaBException(MetaBException.BAD_CMD, "Missing tokens for UPDATE")
+        t = tokens[0].upper()
+        if t == 'DBDESCR':
+            return self._parseUpdateDbDescr(tokens[1:])
+        elif t == 'FILEREPO':
+            return self._parseUpdateFileRepo(tokens[1:])
+        else:
+            raise MetaBException(MetaBException.BAD_CMD)
+
+    def _parseUpdateDbDescr(self, tokens):
+        length = len(tokens)
+        if length < 2 or length > 3:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Unexpected number of arguments.")
+        (dbName, schemaFile) = tokens[0:2]
+        dbMysqlAuthF = (tokens[2] if length > 2 else self._msAuthFileName)
+        def run():
+            stats = self._impl.updateDbDescr(dbName, schemaFile, dbMysqlAuthF)
+            print ", ".join("%s: %d" % (k, stats[k]) for k in sorted(stats))
+        return run
+
+    def _parseUpdateFileRepo(self, tokens):
+        length = len(tokens)
+        if length < 1 or length > 2:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Unexpected number of arguments.")
+        rootDir = tokens[0]
+        try:
+            workers = (int(tokens[1]) if length > 1 else None)
+        except ValueError:
+            workers = 0
+        if workers is not None and workers < 1:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "<workers> must be a positive integer.")
+        def run():
+            stats = self._impl.updateFileRepo(rootDir, workers)
+            print ", ".join("%s: %d" % (k, stats[k]) for k in sorted(stats))
+        return run
+
+    def _parseValidate(self, tokens):
+        """
+        Subparser - handles VALIDATE requests.
+        """
+        if not tokens:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Missing tokens for VALIDATE")
+        t = tokens[0].upper()
+        if t == 'DBDESCR':
+            return self._parseValidateDbDescr(tokens[1:])
+        else:
+            raise MetaBException(MetaBException.BAD_CMD)
+
+    def _parseValidateDbDescr(self, tokens):
+        length = len(tokens)
+        if length < 2 or length > 3:
+            raise MetaBException(MetaBException.BAD_CMD,
+                                 "Unexpected number of arguments.")
+        (dbName, schemaFile) = tokens[0:2]
+        dbMysqlAuthF = (tokens[2] if length > 2 else self._msAuthFileName)
+        def run():
+            print self._impl.validateDbDescr(dbName, schemaFile, dbMysqlAuthF)
+        return run
 
     def _parseAddInstitution(self, tokens):
         length = len(tokens)
         if length == 1:
             # tokens[0] = name
-            self._impl.addInstitution(tokens[0])
+            return lambda: self._impl.addInstitution(tokens[0])
         else:
             raise MetaBException(MetaBException.BAD_CMD,
                                  "Unexpected number of arguments.")
@@ -216,7 +558,7 @@ class CommandParser(object):
         length = len(tokens)
         if length == 1:
             # tokens[0] = name
-            self._impl.addProject(tokens[0])
+            return lambda: self._impl.addProject(tokens[0])
         else:
             raise MetaBException(MetaBException.BAD_CMD,
                                  "Unexpected number of arguments.")
@@ -225,19 +567,21 @@ class CommandParser(object):
         length = len(tokens)
         if length == 5:
             # tokens[0:5] = muName, fName, lName, affil, email
-            self._impl.addUser(*tokens[0:5])
+            return lambda: self._impl.addUser(*tokens[0:5])
         else:
             raise MetaBException(MetaBException.BAD_CMD,
                                  "Unexpected number of arguments.")
 
     def _justExit(self, tokens):
-        raise sys.exit()
+        return sys.exit
 
     def _printHelp(self, tokens):
         """
         Print available commands.
         """
-        print self._supportedCommands
+        def run():
+            print self._supportedCommands
+        return run
 
 ####################################################################################
 
@@ -250,6 +594,7 @@ NAME
 
 SYNOPSIS
         metaAdmin [OPTIONS]
+        metaAdmin [OPTIONS] -s <script> [-g <groupSize>] [--continue-on-error]
 
 OPTIONS
    -v
@@ -261,36 +606,70 @@ OPTIONS
    -a
         SQLAlchemy configuration file with connection information to metaserv and
         credentials for metaserv. It defaults to ~/.lsst/dbAuth-metaServ.ini.
+   -c
+        Directory of the cache of parsed schema files, so that a schema file
+        used for many databases is parsed once, e.g.
+        ~/.lsst/metaServ-schemaCache. A cached schema is loaded in memory at
+        once, while without the cache tables are parsed one at a time. The
+        cache is disabled by default.
+   -s
+        Run commands from a script file ("-" for the standard input) instead of
+        prompting for them, e.g. examples/quickTest. The whole script is
+        parsed before any command runs. A summary with the time taken by each
+        command is printed at the end. The exit status is 1 if any command
+        failed.
+   -g
+        Batch mode only: number of commands run in one transaction, 0 for the
+        whole script. A failed command rolls back its whole transaction.
+        It defaults to 1.
+   --continue-on-error
+        Batch mode only: after a failed transaction, carry on with the next
+        one. By default the remaining commands are skipped.
 """
 
     parser = OptionParser(usage=usage)
     parser.add_option("-v", dest="verbT", default=10) # default is DEBUG
     parser.add_option("-f", dest="logF", default=None)
     parser.add_option("-a", dest="authF", default='~/.lsst/dbAuth-metaServ.ini')
+    parser.add_option("-c", dest="cacheDir", default=None)
+    parser.add_option("-s", dest="script", default=None)
+    parser.add_option("-g", dest="groupSize", type="int", default=1)
+    parser.add_option("--continue-on-error", dest="continueOnError",
+                      action="store_true", default=False)
     (options, args) = parser.parse_args()
-    if int(options.verbT) > 50: options.verbT = 50
-    if int(options.verbT) <  0: options.verbT = 0
-    return (int(options.verbT), options.logF, options.authF)
+    options.verbT = min(max(int(options.verbT), 0), 50)
+    return options
 
 ####################################################################################
 if __name__ == '__main__':
-    (verbosity, logFileName, msAuthFileName) = getOptions()
+    options = getOptions()
 
     # configure logging
-    if logFileName:
+    if options.logF:
         log.basicConfig(
-            filename=logFileName,
+            filename=options.logF,
             format='%(asctime)s %(name)s %(levelname)s: %(message)s',
             datefmt='%m/%d/%Y %I:%M:%S',
-            level=verbosity)
+            level=options.verbT)
     else:
         log.basicConfig(
             format='%(asctime)s %(name)s %(levelname)s: %(message)s',
             datefmt='%m/%d/%Y %I:%M:%S',
-            level=verbosity)
+            level=options.verbT)
+
+    cmdParser = CommandParser(options.authF, options.cacheDir)
+    if options.script:
+        try:
+            status = cmdParser.runScript(options.script, options.groupSize,
+                                         options.continueOnError)
+        finally:
+            cmdParser.close()
+        sys.exit(status)
 
     # wait for commands and process
     try:
-        CommandParser(msAuthFileName).receiveCommands()
+        cmdParser.receiveCommands()
     except(KeyboardInterrupt, SystemExit, EOFError):
         print ""
+    finally:
+        cmdParser.close()
@@ -35,12 +35,16 @@ import os
 import sys
 
 import ConfigParser
+import functools
 import sqlalchemy
 from sqlalchemy.engine.url import URL
+from sqlalchemy.pool import QueuePool
 
 from lsst.dax.metaserv import metaREST_v0
+from lsst.dax.metaserv.metrics import Metrics, timedPool
 
 app = Flask(__name__)
+app.extensions["metaserv_metrics"] = metrics = Metrics()
 
 def initEngine():
     config = ConfigParser.ConfigParser()
@@ -52,7 +56,11 @@ def initEngine():
     del db_config["user"]
     # SQLAlchemy part
     url = URL("mysql", **db_config)
-    return sqlalchemy.create_engine(url)
+    # time checkouts of the default pool too, see /meta/v0/metrics
+    server = "%s:%s" % (url.host, url.port or 3306)
+    poolClass = timedPool(QueuePool,
+                          functools.partial(metrics.observePoolWait, server))
+    return sqlalchemy.create_engine(url, poolclass=poolClass)
 
 engine = initEngine()
 
@@ -0,0 +1,166 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Connections of the metaserv admin program (MetaAdminImpl) to database
+servers. An engine is created once per mysql auth file, and auth files that
+point to the same server with the same user and default database share one
+engine, so that a connection pool is kept per server rather than per call.
+Connections are checked out for the duration of a with block and returned to
+the pool at its end.
+"""
+
+from contextlib import contextmanager
+import logging as log
+import os
+import threading
+
+from lsst.db.engineFactory import getEngineFromFile
+
+
+class ConnectionManager(object):
+    """
+    Thread-safe cache of engines keyed by mysql auth file. A connection can be
+    pinned by the current thread, it is then returned by every connect() to the
+    same server made by that thread, which lets several operations run in one
+    transaction.
+    """
+
+    def __init__(self, getEngine=getEngineFromFile):
+        """
+        @param getEngine  function creating an engine from a mysql auth file
+        """
+        self._getEngine = getEngine
+        self._engines = {}  # auth file -> engine
+        self._servers = {}  # see _serverKey -> engine
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def engine(self, authFile):
+        """
+        Return engine for mysql auth file authFile, creating it if needed.
+        """
+        key = os.path.realpath(os.path.expanduser(authFile))
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                return engine
+        # read the auth file outside of the lock
+        engine = self._getEngine(authFile)
+        with self._lock:
+            if key in self._engines:
+                extra = engine
+                engine = self._engines[key]
+            else:
+                shared = self._servers.setdefault(_serverKey(engine.url), engine)
+                extra = (engine if shared is not engine else None)
+                engine = self._engines[key] = shared
+        if extra is not None:
+            extra.dispose()
+        log.debug("Using engine %s for %s", engine.url, authFile)
+        return engine
+
+    @contextmanager
+    def connect(self, authFile):
+        """
+        Context manager providing a connection to the server of mysql auth file
+        authFile: the one pinned by the current thread if any, otherwise a
+        connection from the pool, returned to it at the end of the block.
+        """
+        engine = self.engine(authFile)
+        conn = self._pinned().get(engine)
+        if conn is not None:
+            yield conn
+            return
+        conn = engine.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def pinned(self, authFile):
+        """
+        Context manager pinning a connection to the server of mysql auth file
+        authFile: connect() calls made by the current thread within the block
+        return it. Blocks can be nested.
+        """
+        with self.connect(authFile) as conn:
+            pins = self._pinned()
+            engine = self.engine(authFile)
+            outer = engine in pins
+            pins[engine] = conn
+            try:
+                yield conn
+            finally:
+                if not outer:
+                    del pins[engine]
+
+    @contextmanager
+    def unpinned(self):
+        """
+        Context manager suspending the connections pinned by the current
+        thread: connect() calls made within the block get connections of their
+        own, outside of any transaction of the pinned ones.
+        """
+        pins = self._pinned()
+        self._local.pins = {}
+        try:
+            yield
+        finally:
+            self._local.pins = pins
+
+    def _pinned(self):
+        try:
+            return self._local.pins
+        except AttributeError:
+            self._local.pins = {}
+            return self._local.pins
+
+    def close(self):
+        """
+        Dispose all engines, closing pooled connections. Connections checked out
+        are closed when they are returned.
+        """
+        with self._lock:
+            engines = set(self._servers.itervalues())
+            self._engines.clear()
+            self._servers.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def __len__(self):
+        return len(self._servers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _serverKey(url):
+    """
+    Return what identifies the server, user and default database of an engine
+    url. Metaserv queries rely on the default database, so it is part of the key.
+    """
+    query = tuple(sorted((url.query or {}).items()))
+    return (url.drivername, url.username, url.host, url.port, url.database,
+            query)
@@ -0,0 +1,147 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Manifest of databases to be added to metaserv in one go (see
+MetaAdminImpl.addDbDescrManifest). A manifest lists, for each database, the
+arguments of ADD DBDESCR. It is either a CSV file with a header line, e.g.:
+
+  # comment
+  dbName,schemaFile,level,dataRel,owner,accessibility,project,mysqlAuthFile
+  sdss_stripe82_00,schemas/stripe82.sql.gz,L2,DR1,becla,public,,
+  sdss_stripe82_01,schemas/stripe82.sql.gz,L2,DR1,becla,public,LSST,~/.lsst/s2.my.cnf
+
+or, if its name ends with .yaml or .yml, a YAML list of mappings with the same
+keys (optionally under a "databases" key). The project and mysqlAuthFile
+columns are optional. Relative schema file paths are relative to the
+directory of the manifest. YAML manifests require PyYAML.
+"""
+
+import csv
+import os
+
+from .metaBException import MetaBException
+
+REQUIRED_KEYS = ("dbName", "schemaFile", "level", "dataRel", "owner",
+                 "accessibility")
+OPTIONAL_KEYS = ("project", "mysqlAuthFile")
+
+
+def readManifest(fName, defaults=None):
+    """
+    Read manifest fName.
+
+    @param fName     name of the manifest file
+    @param defaults  dictionary of values of optional keys used when missing
+                     or empty in the manifest
+
+    @return list of dictionaries, one per database, in the manifest order,
+            with all REQUIRED_KEYS and OPTIONAL_KEYS (None if no default)
+
+    Raises MetaBException BAD_MANIFEST if the file can't be read, or if an
+    entry is invalid.
+    """
+    try:
+        with open(fName) as f:
+            if fName.endswith((".yaml", ".yml")):
+                rows = _readYaml(f, fName)
+            else:
+                rows = _readCsv(f, fName)
+    except (IOError, OSError) as e:
+        raise MetaBException(MetaBException.BAD_MANIFEST, fName, str(e))
+
+    baseDir = os.path.dirname(os.path.abspath(fName))
+    defaults = defaults or {}
+    entries = []
+    seen = set()
+    for (n, row) in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                                 "entry %d is not a mapping" % n)
+        unknown = set(row) - set(REQUIRED_KEYS) - set(OPTIONAL_KEYS)
+        if unknown:
+            raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                                 "entry %d: unknown keys %s" %
+                                 (n, ", ".join(sorted(unknown))))
+        entry = {}
+        for key in REQUIRED_KEYS:
+            value = row.get(key)
+            if value is None or str(value).strip() == "":
+                raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                                     "entry %d: missing %s" % (n, key))
+            entry[key] = str(value).strip()
+        for key in OPTIONAL_KEYS:
+            value = row.get(key)
+            if value is None or str(value).strip() == "":
+                entry[key] = defaults.get(key)
+            else:
+                entry[key] = str(value).strip()
+        if entry["dbName"] in seen:
+            raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                                 "entry %d: duplicate db %s" % (n, entry["dbName"]))
+        seen.add(entry["dbName"])
+        schemaFile = os.path.expanduser(entry["schemaFile"])
+        if schemaFile != "-":
+            schemaFile = os.path.join(baseDir, schemaFile)
+        entry["schemaFile"] = schemaFile
+        if entry["mysqlAuthFile"] is not None:
+            entry["mysqlAuthFile"] = os.path.expanduser(entry["mysqlAuthFile"])
+        entries.append(entry)
+    return entries
+
+
+def _readCsv(f, fName):
+    lines = [l for l in f if l.strip() and not l.lstrip().startswith("#")]
+    reader = csv.reader(lines, skipinitialspace=True)
+    try:
+        header = [h.strip() for h in next(reader)]
+    except StopIteration:
+        return []
+    unknown = set(header) - set(REQUIRED_KEYS) - set(OPTIONAL_KEYS)
+    if unknown:
+        raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                             "unknown columns %s" % ", ".join(sorted(unknown)))
+    rows = []
+    for (n, values) in enumerate(reader, 1):
+        if len(values) > len(header):
+            raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                                 "entry %d: too many values" % n)
+        rows.append(dict(zip(header, values)))
+    return rows
+
+
+def _readYaml(f, fName):
+    try:
+        import yaml
+    except ImportError:
+        raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                             "PyYAML is needed to read YAML manifests")
+    try:
+        doc = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise MetaBException(MetaBException.BAD_MANIFEST, fName, str(e))
+    if isinstance(doc, dict):
+        doc = doc.get("databases")
+    if doc is None:
+        return []
+    if not isinstance(doc, list):
+        raise MetaBException(MetaBException.BAD_MANIFEST, fName,
+                             "expected a list of databases")
+    return doc
@@ -0,0 +1,116 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Registry of pooled SQLAlchemy engines, one per database server. Databases
+registered in metaserv can live on different servers (see DbRepo.connHost and
+DbRepo.connPort); the registry lets the RESTful interface talk to the right
+server over warm connections.
+"""
+
+import copy
+import logging as log
+import threading
+import time
+
+import sqlalchemy
+
+
+class EngineRegistry(object):
+    """
+    Lazily creates engines keyed by (host, port), and disposes engines that
+    were not used for a while. Engines share credentials of a base url.
+    """
+
+    def __init__(self, baseUrl, poolSize=5, maxOverflow=10, poolRecycle=3600,
+                 prePing=True, maxIdle=600, timer=time.time,
+                 createEngine=sqlalchemy.create_engine):
+        """
+        @param baseUrl      SQLAlchemy url with credentials, host and port are
+                            replaced for each server
+        @param poolSize     number of connections kept open per server
+        @param maxOverflow  number of connections allowed above poolSize
+        @param poolRecycle  connections older than that are reopened, in
+                            seconds (-1 disables)
+        @param prePing      check connections for liveness on checkout
+        @param maxIdle      engines not used for that long are disposed,
+                            in seconds
+        @param timer        function returning current time in seconds
+        @param createEngine function creating an engine from url and options
+        """
+        self._baseUrl = baseUrl
+        self._engineArgs = {"pool_size": poolSize,
+                            "max_overflow": maxOverflow,
+                            "pool_recycle": poolRecycle,
+                            "pool_pre_ping": prePing}
+        self.maxIdle = maxIdle
+        self._timer = timer
+        self._createEngine = createEngine
+        self._engines = {} # (host, port) -> [engine, lastUsed]
+        self._lock = threading.Lock()
+
+    def get(self, host, port):
+        """
+        Return engine for server host:port, creating it if needed.
+        """
+        key = (host, port)
+        now = self._timer()
+        with self._lock:
+            entry = self._engines.get(key)
+            if entry is None:
+                url = copy.copy(self._baseUrl)
+                url.host = host
+                url.port = port
+                url.database = None # queries use fully qualified names
+                log.debug("Creating engine for %s:%s", host, port)
+                entry = self._engines[key] = [
+                    self._createEngine(url, **self._engineArgs), now]
+            entry[1] = now
+            idle = self._popIdle(now)
+        for engine in idle:
+            engine.dispose()
+        return entry[0]
+
+    def evictIdle(self):
+        """
+        Dispose engines that were not used for more than maxIdle seconds.
+        """
+        with self._lock:
+            idle = self._popIdle(self._timer())
+        for engine in idle:
+            engine.dispose()
+
+    def _popIdle(self, now):
+        idle = [k for (k, e) in self._engines.iteritems()
+                if now - e[1] > self.maxIdle]
+        return [self._engines.pop(k)[0] for k in idle]
+
+    def dispose(self):
+        """
+        Dispose all engines.
+        """
+        with self._lock:
+            engines = [e[0] for e in self._engines.itervalues()]
+            self._engines.clear()
+        for engine in engines:
+            engine.dispose()
+
+    def __len__(self):
+        return len(self._engines)
@@ -0,0 +1,141 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Checksums of the files of a file repository (File.checksum). Checksums are
+stored as "<algorithm>:<hex digest>", e.g. "sha1:da39a3ee...".
+
+Files are hashed by a pool of threads: hashlib releases the GIL while hashing
+large buffers, and reading releases it while waiting for the storage, so
+several files are hashed at once. Files are read in large chunks into a
+buffer reused across files, or memory-mapped.
+"""
+
+import hashlib
+import logging as log
+import mmap
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
+from .metaBException import MetaBException
+
+MAX_CHECKSUM = 128 # File.checksum is a VARCHAR(128)
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def checkAlgorithm(algorithm):
+    """
+    Check that algorithm is a hashlib algorithm whose checksums fit in
+    File.checksum (e.g. sha512 does not).
+
+    Raises MetaBException BAD_ALGORITHM otherwise.
+    """
+    try:
+        digestSize = hashlib.new(algorithm).digest_size
+    except (ValueError, TypeError):
+        raise MetaBException(MetaBException.BAD_ALGORITHM, algorithm)
+    if len(algorithm) + 1 + 2 * digestSize > MAX_CHECKSUM:
+        raise MetaBException(MetaBException.BAD_ALGORITHM, algorithm,
+                             "checksum longer than %d characters" % MAX_CHECKSUM)
+
+
+def checksumFile(path, algorithm="sha1", bufferSize=BUFFER_SIZE, useMmap=False,
+                 buf=None):
+    """
+    Return (checksum of file path as "<algorithm>:<hex digest>", number of
+    bytes hashed).
+
+    @param bufferSize  size of the chunks read
+    @param useMmap     memory-map the file instead of reading it
+    @param buf         bytearray of bufferSize bytes to read into, allocated
+                       if None
+    """
+    h = hashlib.new(algorithm)
+    nBytes = 0
+    with open(path, "rb") as f:
+        if useMmap:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for pos in xrange(0, size, bufferSize):
+                        h.update(mm[pos:pos+bufferSize])
+                finally:
+                    mm.close()
+            nBytes = size
+        else:
+            if buf is None:
+                buf = bytearray(bufferSize)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+                nBytes += n
+    return ("%s:%s" % (algorithm, h.hexdigest()), nBytes)
+
+
+def checksumFiles(tasks, algorithm="sha1", workers=4, bufferSize=BUFFER_SIZE,
+                  useMmap=False):
+    """
+    Hash files in a pool of threads.
+
+    @param tasks       iterable of (key, path)
+    @param workers     number of threads
+
+    @return iterator over (key, checksum or None, number of bytes hashed,
+            error message or None), in the order files complete
+    """
+    local = _BufferPerThread(bufferSize)
+    def run(task):
+        (key, path) = task
+        try:
+            (checksum, nBytes) = checksumFile(path, algorithm, bufferSize,
+                                              useMmap, local.get())
+            return (key, checksum, nBytes, None)
+        except (IOError, OSError) as e:
+            log.debug("Can't hash %s: %s", path, e)
+            return (key, None, 0, str(e))
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap_unordered(run, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _BufferPerThread(object):
+    """
+    Read buffers, one per thread, reused across files.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+
+    def get(self):
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            buf = self._local.buf = bytearray(self._size)
+        return buf
@@ -0,0 +1,319 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Minimal reader of FITS headers, used to ingest file repositories into
+metaserv (see sql/fileRepo.sql). The file is memory-mapped and only the
+header blocks are touched: the size of the data unit of each HDU is computed
+from its header and the data is skipped, so the pages holding pixels are
+never read.
+
+For each file it produces a FitsFileInfo with:
+* the number of HDUs,
+* structured metadata of every HDU that has a position and exposure time
+  (FitsStructuredMeta): ra, decl, equinox, rotAng, obsStart, expMidpt,
+  expTime; keywords missing from an extension HDU are taken from the primary
+  HDU,
+* all other keywords, typed (FitsUnstructuredMeta).
+"""
+
+from collections import namedtuple
+import datetime
+import mmap
+import os
+
+from .metaBException import MetaBException
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+MAX_HDUS = 127  # FitsMeta.hdus is a TINYINT
+MAX_STRING = 90 # FitsUnstructuredMeta.stringValue is a VARCHAR(90)
+
+# Keywords describing the layout of the file, not stored
+STRUCTURAL_KEYS = frozenset(["SIMPLE", "XTENSION", "BITPIX", "NAXIS", "EXTEND",
+                             "PCOUNT", "GCOUNT", "END", "COMMENT", "HISTORY",
+                             "CONTINUE", "HIERARCH", ""])
+
+# Structured metadata: column -> keywords it is read from, in order of preference
+RA_KEYS = ("RA_DEG", "RA")
+DECL_KEYS = ("DEC_DEG", "DEC", "DECL")
+EQUINOX_KEYS = ("EQUINOX", "EPOCH")
+ROTANG_KEYS = ("ROTANG", "ROTPA", "ROT_PA")
+EXPTIME_KEYS = ("EXPTIME", "EXPOSURE", "EXPTIM")
+DATEOBS_KEYS = ("DATE-OBS",)
+MJDOBS_KEYS = ("MJD-OBS",)
+
+_MJD_EPOCH = datetime.datetime(1858, 11, 17)
+_INT_MIN = -2**31
+_INT_MAX = 2**31 - 1
+
+# (path, size, mtime, hdus, structured, keywords), where
+# structured: list of (hdu, equinox, ra, decl, rotAng, obsStart, expMidpt,
+#             expTime), obsStart as 'YYYY-MM-DD HH:MM:SS.ffffff'
+# keywords: list of (fitsKey, hdu, stringValue, intValue, doubleValue)
+FitsFileInfo = namedtuple("FitsFileInfo", ["path", "size", "mtime", "hdus",
+                                           "structured", "keywords"])
+
+
+def readFitsFile(path):
+    """
+    Read headers of FITS file path.
+
+    @return FitsFileInfo
+
+    Raises MetaBException BAD_FITS if the file is not a valid FITS file, and
+    IOError/OSError if it can't be read.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size < BLOCK_SIZE:
+            raise MetaBException(MetaBException.BAD_FITS, path, "file too short")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            headers = readHeaders(mm, path)
+        finally:
+            mm.close()
+    (structured, keywords) = extractMeta(headers)
+    return FitsFileInfo(path, st.st_size, st.st_mtime, len(headers),
+                        structured, keywords)
+
+
+def readHeaders(buf, name="<buffer>"):
+    """
+    Read headers of all HDUs of a FITS file held in buf (a string or mmap).
+
+    @return list of headers, one per HDU, each a list of (keyword, value)
+
+    Raises MetaBException BAD_FITS if the content is not valid FITS.
+    """
+    size = len(buf)
+    if buf[:9] != "SIMPLE  =":
+        raise MetaBException(MetaBException.BAD_FITS, name, "not a FITS file")
+    headers = []
+    pos = 0
+    while pos + BLOCK_SIZE <= size:
+        if headers and buf[pos:pos+9] != "XTENSION=":
+            break # special records after the last extension
+        if len(headers) == MAX_HDUS:
+            raise MetaBException(MetaBException.BAD_FITS, name,
+                                 "more than %d HDUs" % MAX_HDUS)
+        (cards, pos) = _headerCards(buf, pos, name)
+        header = [parseCard(c) for c in cards]
+        headers.append(header)
+        pos += _paddedSize(_dataSize(header, name))
+    return headers
+
+
+def _headerCards(buf, pos, name):
+    """
+    Return (list of cards of the header starting at pos, position of the block
+    following the header).
+    """
+    size = len(buf)
+    cards = []
+    while pos + BLOCK_SIZE <= size:
+        block = buf[pos:pos+BLOCK_SIZE]
+        pos += BLOCK_SIZE
+        for i in xrange(0, BLOCK_SIZE, CARD_SIZE):
+            card = block[i:i+CARD_SIZE]
+            if card[:8] == "END     ":
+                return (cards, pos)
+            cards.append(card)
+    raise MetaBException(MetaBException.BAD_FITS, name, "missing END card")
+
+
+def _dataSize(header, name):
+    """
+    Return size in bytes of the data unit described by header.
+    """
+    keys = dict(header)
+    try:
+        naxis = keys.get("NAXIS", 0)
+        if not naxis:
+            return 0
+        nElements = 1
+        for i in range(1, naxis + 1):
+            nElements *= keys["NAXIS%d" % i]
+        bitpix = keys["BITPIX"]
+        return abs(bitpix) // 8 * keys.get("GCOUNT", 1) * \
+            (keys.get("PCOUNT", 0) + nElements)
+    except (KeyError, TypeError):
+        raise MetaBException(MetaBException.BAD_FITS, name,
+                             "invalid data unit description")
+
+
+def _paddedSize(nBytes):
+    return (nBytes + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+def parseCard(card):
+    """
+    Parse one 80-character card.
+
+    @return (keyword, value), value is a str, int, float, bool, or None if the
+            card has no value (e.g. COMMENT) or its value is undefined
+    """
+    key = card[:8].rstrip()
+    if card[8:10] != "= ":
+        return (key, None)
+    field = card[10:].lstrip()
+    if field.startswith("'"):
+        return (key, _parseString(field))
+    value = field.split("/", 1)[0].strip()
+    if not value:
+        return (key, None)
+    if value == "T":
+        return (key, True)
+    if value == "F":
+        return (key, False)
+    try:
+        return (key, int(value))
+    except ValueError:
+        pass
+    try:
+        return (key, float(value.replace("D", "E")))
+    except ValueError:
+        return (key, value) # e.g. complex value, kept as is
+
+
+def _parseString(field):
+    """
+    Return the value of a string field (starting with a quote), with doubled
+    quotes unescaped and trailing spaces removed.
+    """
+    parts = []
+    pos = 1
+    while True:
+        end = field.find("'", pos)
+        if end < 0:
+            parts.append(field[pos:]) # unterminated, be lenient
+            break
+        parts.append(field[pos:end])
+        if field[end+1:end+2] != "'":
+            break
+        parts.append("'")
+        pos = end + 2
+    return "".join(parts).rstrip()
+
+
+def extractMeta(headers):
+    """
+    Split keywords of headers into structured and unstructured metadata.
+
+    @param headers  list of headers, as returned by readHeaders
+
+    @return (structured, keywords), see FitsFileInfo
+    """
+    structured = []
+    keywords = []
+    primary = dict(headers[0]) if headers else {}
+    for (hdu, header) in enumerate(headers):
+        keys = dict(header)
+        if hdu:
+            inherited = primary.copy()
+            inherited.update(keys)
+            keys = inherited
+        (row, used) = _structured(hdu, keys)
+        if row is not None:
+            structured.append(row)
+        for (key, value) in header:
+            if key in STRUCTURAL_KEYS or key in used or value is None:
+                continue
+            if key.startswith("NAXIS") and key[5:].isdigit():
+                continue
+            keywords.append(_keyword(key, hdu, value))
+    return (structured, keywords)
+
+
+def _structured(hdu, keys):
+    """
+    Return (FitsStructuredMeta row of an HDU or None, keywords used for it).
+    The row needs a position, an exposure time, and a start time.
+    """
+    ra = _first(keys, RA_KEYS, float)
+    decl = _first(keys, DECL_KEYS, float)
+    expTime = _first(keys, EXPTIME_KEYS, float)
+    obsStart = _first(keys, DATEOBS_KEYS, _parseDate)
+    mjd = _first(keys, MJDOBS_KEYS, float)
+    if obsStart[1] is None and mjd[1] is not None:
+        obsStart = (None, _MJD_EPOCH + datetime.timedelta(days=mjd[1]))
+    if None in (ra[1], decl[1], expTime[1]) or obsStart[1] is None:
+        return (None, ())
+    if mjd[1] is None:
+        delta = obsStart[1] - _MJD_EPOCH
+        mjd = (None, delta.days + (delta.seconds +
+                                   delta.microseconds / 1e6) / 86400.)
+    equinox = _first(keys, EQUINOX_KEYS, float)
+    rotAng = _first(keys, ROTANG_KEYS, float)
+    used = set(k for (k, v) in (ra, decl, expTime, obsStart, mjd, equinox, rotAng)
+               if k is not None)
+    row = (hdu, equinox[1], ra[1], decl[1], rotAng[1],
+           obsStart[1].strftime("%Y-%m-%d %H:%M:%S.%f"),
+           mjd[1] + expTime[1] / 2. / 86400., expTime[1])
+    return (row, used)
+
+
+def _first(keys, candidates, convert):
+    """
+    Return (keyword, converted value) of the first candidate keyword present
+    with a value that converts, (None, None) if there is none.
+    """
+    for k in candidates:
+        v = keys.get(k)
+        if v is None or isinstance(v, bool):
+            continue
+        try:
+            return (k, convert(v))
+        except (TypeError, ValueError):
+            continue
+    return (None, None)
+
+
+def _parseDate(value):
+    """
+    Parse a FITS date: 'YYYY-MM-DD' or 'YYYY-MM-DDThh:mm:ss[.sss]'.
+    """
+    value = value.strip()
+    if len(value) == 10:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    if "." in value:
+        (value, frac) = value.split(".", 1)
+        micro = int((frac + "000000")[:6])
+    else:
+        micro = 0
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").replace(
+        microsecond=micro)
+
+
+def _keyword(key, hdu, value):
+    """
+    Return FitsUnstructuredMeta values (fitsKey, hdu, stringValue, intValue,
+    doubleValue) of a keyword. The string value is always set, so that every
+    keyword can be compared as a string.
+    """
+    if isinstance(value, bool):
+        return (key, hdu, "T" if value else "F", int(value), None)
+    if isinstance(value, (int, long)):
+        if _INT_MIN <= value <= _INT_MAX:
+            return (key, hdu, str(value), value, float(value))
+        return (key, hdu, str(value), None, float(value))
+    if isinstance(value, float):
+        return (key, hdu, repr(value), None, value)
+    return (key, hdu, value[:MAX_STRING], None, None)
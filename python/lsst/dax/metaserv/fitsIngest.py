@@ -0,0 +1,179 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Discovery and parsing of the FITS files of a file repository, the first
+stages of ADD FILEREPO and UPDATE FILEREPO (see MetaAdminImpl.addFileRepo).
+The directory tree is listed by a pool of threads, one directory at a time,
+collecting size and modification time of every file, so that a rescan can
+tell changed files without opening them. Headers are parsed (see fitsHeader)
+in a pool of worker processes, and results are streamed back in batches, so
+that loading into metaserv overlaps with parsing.
+"""
+
+import functools
+import itertools
+import logging as log
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from .fitsHeader import readFitsFile
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts", ".fz")
+
+
+def findFitsFiles(rootDir):
+    """
+    Return sorted list of paths of FITS files found under rootDir (recursively),
+    relative to rootDir. Compressed (.gz) files are not supported, as they
+    can't be memory-mapped.
+    """
+    return sorted(scanFitsFiles(rootDir)[0])
+
+
+def scanFitsFiles(rootDir, threads=8):
+    """
+    List FITS files found under rootDir (recursively, symbolic links to
+    directories are not followed), listing up to threads directories
+    concurrently. Uses scandir (from os, or the scandir package) if available.
+
+    @return (dictionary: path relative to rootDir -> (size, mtime), list of
+            relative paths of directories that could not be listed)
+    """
+    files = {}
+    failed = []
+    dirs = [""]
+    pool = ThreadPool(threads)
+    try:
+        while dirs:
+            subDirs = []
+            for (relDir, found, children) in pool.imap_unordered(
+                    functools.partial(_listDir, rootDir), dirs):
+                if found is None:
+                    failed.append(relDir)
+                    continue
+                files.update(found)
+                subDirs.extend(children)
+            dirs = subDirs
+    finally:
+        pool.close()
+        pool.join()
+    return (files, failed)
+
+
+def _listDir(rootDir, relDir):
+    """
+    Return (relDir, {relative path: (size, mtime)} of FITS files in relDir or
+    None if it can't be listed, list of relative paths of its subdirectories).
+    """
+    found = {}
+    children = []
+    path = os.path.join(rootDir, relDir)
+    try:
+        if scandir is not None:
+            entries = [(e.name, e) for e in scandir(path)]
+        else:
+            entries = [(name, None) for name in os.listdir(path)]
+    except OSError as e:
+        log.warning("Can't list %s: %s", path, e)
+        return (relDir, None, [])
+    for (name, entry) in entries:
+        relPath = os.path.join(relDir, name)
+        try:
+            if entry is not None:
+                if entry.is_dir(follow_symlinks=False):
+                    children.append(relPath)
+                elif name.lower().endswith(FITS_EXTENSIONS) and entry.is_file():
+                    st = entry.stat()
+                    found[relPath] = (st.st_size, st.st_mtime)
+                continue
+            st = os.lstat(os.path.join(path, name))
+            if stat.S_ISDIR(st.st_mode):
+                children.append(relPath)
+            elif name.lower().endswith(FITS_EXTENSIONS):
+                if stat.S_ISLNK(st.st_mode):
+                    st = os.stat(os.path.join(path, name))
+                if stat.S_ISREG(st.st_mode):
+                    found[relPath] = (st.st_size, st.st_mtime)
+        except OSError as e:
+            # removed since listed, or dangling link
+            log.debug("Can't stat %s: %s", relPath, e)
+    return (relDir, found, children)
+
+
+def parseFitsFiles(rootDir, paths, workers=None, chunkSize=16):
+    """
+    Parse FITS files, in parallel.
+
+    @param rootDir    directory paths are relative to
+    @param paths      relative paths of FITS files
+    @param workers    number of worker processes, defaults to the number of
+                      cores, 1 parses in the calling process
+    @param chunkSize  number of files sent to a worker at a time
+
+    @return iterator over (relative path, fitsHeader.FitsFileInfo or None,
+            error message or None), in the order of paths
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    tasks = ((rootDir, p) for p in paths)
+    if workers <= 1:
+        for result in itertools.imap(_parseOne, tasks):
+            yield result
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(_parseOne, tasks, chunkSize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _parseOne(task):
+    (rootDir, path) = task
+    try:
+        return (path, readFitsFile(os.path.join(rootDir, path)), None)
+    except Exception as e:
+        log.debug("Failed to parse %s: %s", path, e)
+        return (path, None, "%s: %s" % (type(e).__name__, e))
+
+
+def batches(iterable, batchSize):
+    """
+    Group items of iterable into lists of up to batchSize items.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, batchSize))
+        if not batch:
+            return
+        yield batch
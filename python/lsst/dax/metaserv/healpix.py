@@ -0,0 +1,258 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Spatial index of FitsStructuredMeta: HEALPix pixel numbers, nested scheme
+(Gorski et al. 2005, ApJ 622, 759), vectorized with numpy.
+
+In the nested scheme, the 4 children of pixel p at order k are pixels
+4p .. 4p+3 at order k+1, so any pixel at order k is a contiguous range of
+pixel numbers at a deeper order. A cone is covered by a handful of pixels of
+a few orders, i.e. by a few ranges of FitsStructuredMeta.healpixId (see
+coverCone), which a B-tree index answers directly, without the problems of
+separate ra and decl indexes near ra=0/360 and near the poles. Candidates are
+then filtered exactly (see angularDistance).
+"""
+
+import math
+
+import numpy as np
+
+# Order of FitsStructuredMeta.healpixId: 12 * 4**16 pixels of ~3.2 arcsec
+ORDER = 16
+MAX_ORDER = 29
+
+_JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4], dtype=np.int64)
+_JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7], dtype=np.int64)
+
+# Pixel radii are padded, pixel edges are not great circles
+_PIXRAD_PADDING = 1.1
+
+
+def ang2pix(order, ra, decl):
+    """
+    Return nested pixel numbers, at a given order, of positions.
+
+    @param ra    right ascension in degrees, scalar or array
+    @param decl  declination in degrees, scalar or array
+
+    @return int64 array (or scalar)
+    """
+    nside = 1 << order
+    ra = np.asarray(ra, dtype=np.float64)
+    decl = np.asarray(decl, dtype=np.float64)
+    z = np.sin(np.radians(decl))
+    za = np.abs(z)
+    tt = np.mod(np.radians(ra), 2 * math.pi) * (2 / math.pi)
+    tt = np.where(tt >= 4, tt - 4, tt)
+
+    # equatorial region
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * 0.75 * z
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    eqFace = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    eqX = jm & (nside - 1)
+    eqY = nside - (jp & (nside - 1)) - 1
+
+    # polar caps; sqrt(3 * (1 - |z|)), accurate close to the poles
+    ntt = np.minimum(3, tt.astype(np.int64))
+    tp = tt - ntt
+    tmp = nside * math.sqrt(6) * np.sin(np.radians(90 - np.abs(decl)) / 2)
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z >= 0
+    polarFace = np.where(north, ntt, ntt + 8)
+    polarX = np.where(north, nside - jm - 1, jp)
+    polarY = np.where(north, nside - jp - 1, jm)
+
+    equatorial = za <= 2. / 3
+    face = np.where(equatorial, eqFace, polarFace)
+    ix = np.where(equatorial, eqX, polarX)
+    iy = np.where(equatorial, eqY, polarY)
+    return (face << (2 * order)) + _spread(ix) + (_spread(iy) << 1)
+
+
+def pix2ang(order, pix):
+    """
+    Return (ra, decl) in degrees of the centers of nested pixels.
+    """
+    (x, y, z) = pix2vec(order, pix)
+    ra = np.degrees(np.arctan2(y, x)) % 360.
+    decl = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    return (ra, decl)
+
+
+def pix2vec(order, pix):
+    """
+    Return (x, y, z), unit vectors of the centers of nested pixels.
+    """
+    nside = 1 << order
+    pix = np.asarray(pix, dtype=np.int64)
+    face = pix >> (2 * order)
+    ipf = pix & ((1 << (2 * order)) - 1)
+    ix = _compact(ipf)
+    iy = _compact(ipf >> 1)
+    jr = (_JRLL[face] << order) - ix - iy - 1
+
+    north = jr < nside
+    south = jr > 3 * nside
+    nr = np.where(north, jr, np.where(south, 4 * nside - jr, nside))
+    # 1 - |z| in the polar caps
+    tmp = nr.astype(np.float64) ** 2 / (3. * nside * nside)
+    z = np.where(north, 1 - tmp, np.where(south, tmp - 1,
+                                          (2 * nside - jr) * (2. / 3 / nside)))
+    sth = np.where(north | south, np.sqrt(tmp * (2 - tmp)),
+                   np.sqrt(np.maximum(0., 1 - z * z)))
+    t = _JPLL[face] * nr + ix - iy
+    t = np.where(t < 0, t + 8 * nr, t)
+    phi = (math.pi / 4) * t / nr
+    return (sth * np.cos(phi), sth * np.sin(phi), z)
+
+
+def maxPixrad(order):
+    """
+    Return the maximum angular distance, in radians, between the center of a
+    pixel of a given order and its corners.
+    """
+    nside = 1 << order
+    a = _vector(2. / 3, math.pi / (4 * nside))
+    t1 = (1. - 1. / nside) ** 2
+    b = _vector(1 - t1 / 3, 0.)
+    return _angle(a, b)
+
+
+def coverCone(ra, decl, radius, order=ORDER, depth=None):
+    """
+    Return ranges of nested pixel numbers at order covering a cone: every
+    position within the cone falls in a pixel of one of the ranges (the
+    converse does not hold, candidates have to be filtered).
+
+    The sky is split hierarchically: starting from the 12 base pixels, pixels
+    entirely inside the cone are kept whole, pixels overlapping its edge are
+    split into their 4 children, down to depth, where they are kept whole.
+
+    @param ra      right ascension of the center in degrees
+    @param decl    declination of the center in degrees
+    @param radius  radius in degrees
+    @param depth   deepest order of the pixels of the cover, by default such
+                   that a few dozen pixels cover the edge of the cone
+
+    @return sorted list of disjoint (first, last) pixel numbers
+    """
+    if depth is None:
+        depth = coverDepth(radius, order)
+    center = _vector(math.sin(math.radians(decl)), math.radians(ra))
+    radius = math.radians(radius)
+    ranges = []
+    pixels = np.arange(12, dtype=np.int64)
+    for k in range(depth + 1):
+        (x, y, z) = pix2vec(k, pixels)
+        dist = np.arccos(np.clip(x * center[0] + y * center[1] + z * center[2],
+                                 -1., 1.))
+        pixrad = maxPixrad(k) * _PIXRAD_PADDING
+        inside = dist + pixrad <= radius
+        edge = ~inside & (dist <= radius + pixrad)
+        kept = pixels[inside | edge] if k == depth else pixels[inside]
+        shift = 2 * (order - k)
+        ranges.extend(zip((kept << shift).tolist(),
+                          (((kept + 1) << shift) - 1).tolist()))
+        pixels = (pixels[edge][:, np.newaxis] * 4 +
+                  np.arange(4, dtype=np.int64)).ravel()
+        if not len(pixels):
+            break
+    return _merged(ranges)
+
+
+def coverDepth(radius, order=ORDER):
+    """
+    Return the deepest order (up to order) whose pixels are not smaller than
+    a quarter of radius (in degrees).
+    """
+    radius = math.radians(radius)
+    depth = 0
+    while depth < order and maxPixrad(depth + 1) >= radius / 4:
+        depth += 1
+    return depth
+
+
+def angularDistance(ra1, decl1, ra2, decl2):
+    """
+    Return angular distances in degrees between positions (in degrees, scalars
+    or arrays), computed with the haversine formula, accurate at small
+    distances.
+    """
+    ra1 = np.radians(ra1)
+    decl1 = np.radians(decl1)
+    ra2 = np.radians(ra2)
+    decl2 = np.radians(decl2)
+    h = (np.sin((decl2 - decl1) / 2) ** 2 +
+         np.cos(decl1) * np.cos(decl2) * np.sin((ra2 - ra1) / 2) ** 2)
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(h, 0., 1.))))
+
+
+def _merged(ranges):
+    """
+    Sort ranges and merge adjacent ones.
+    """
+    merged = []
+    for (first, last) in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _vector(z, phi):
+    sth = math.sqrt(max(0., 1 - z * z))
+    return (sth * math.cos(phi), sth * math.sin(phi), z)
+
+
+def _angle(a, b):
+    cross = (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2],
+             a[0] * b[1] - a[1] * b[0])
+    return math.atan2(math.sqrt(sum(c * c for c in cross)),
+                      sum(x * y for (x, y) in zip(a, b)))
+
+
+def _spread(v):
+    """
+    Interleave bits of v (up to 32 bits) with zeros: bit i goes to bit 2i.
+    """
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+
+def _compact(v):
+    """
+    Inverse of _spread: collect even bits of v.
+    """
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    return (v | (v >> 16)) & 0x00000000FFFFFFFF
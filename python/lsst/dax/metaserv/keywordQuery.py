@@ -0,0 +1,291 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Queries of files by FITS keywords (FitsUnstructuredMeta), e.g.:
+
+  FILTER='r' AND AIRMASS<1.2
+
+A query is a conjunction of predicates <keyword> <op> <value>, op being one
+of = != < <= > >=, value a quoted string, a number, or T/F. A file matches a
+predicate if one of its HDUs has the keyword with a matching value. Strings
+and T/F are compared with stringValue, numbers with doubleValue (integer
+keywords have both intValue and doubleValue).
+
+Each predicate is answered by one range of an index on (fitsKey, stringValue,
+fileId) or (fitsKey, doubleValue, fileId), without reading rows. Rather than
+joining FitsUnstructuredMeta with itself once per predicate, predicates are
+evaluated one at a time, as sorted arrays of file ids that are intersected,
+the most selective predicate first: its number of matches is estimated by a
+count bounded by estimateCap. Once few files are left, the following
+predicates only check those files (probe) instead of reading all their
+matches: a predicate is probed if probing the files left costs less than
+reading its matches, a probe costing probeCost index entries read. When the
+first estimate is not enough to tell, matches are counted again, up to the
+cost of probing, so that a predicate never costs more than twice the cheaper
+of the two.
+
+A page of files (after, limit, in a repository) is read from the first
+matches of one predicate instead: in order of file id, within the repository
+(File is joined), and from after on. For an equality, these are the next
+entries of its index range; the file ids are read in batches, each filtered by
+the other predicates, until the page is full, so that a page costs about the
+page size divided by the fraction of files matching the other predicates.
+Other predicates are not read in order of file id, their matches are read at
+once, and they drive a page only if that costs less than probing a page of
+files with them. Estimates are bounded by that cost too.
+"""
+
+from collections import namedtuple
+import logging as log
+import re
+
+import numpy as np
+from sqlalchemy import text
+
+MAX_PREDICATES = 16
+ESTIMATE_CAP = 100000 # predicates are ordered by their number of matches, up to that
+PROBE_COST = 10       # cost of checking one file, in index entries read
+_CHUNK = 1000         # file ids per IN list
+
+# key: FITS keyword, op: SQL operator, value: str or float
+Predicate = namedtuple("Predicate", ["key", "op", "value"])
+
+_PREDICATE = re.compile(r"\s*([A-Za-z0-9_-]{1,8})\s*(<=|>=|!=|<>|=|<|>)\s*"
+                        r"('(?:[^']|'')*'|[^\s']+)")
+_AND = re.compile(r"\s+AND\s+", re.IGNORECASE)
+_END = re.compile(r"\s*$")
+
+
+def parseQuery(query):
+    """
+    Parse a keyword query.
+
+    @return list of Predicate
+
+    Raises ValueError if the query is not valid.
+    """
+    predicates = []
+    pos = 0
+    while True:
+        m = _PREDICATE.match(query, pos)
+        if m is None:
+            raise ValueError("Invalid keyword query at: '%s'" % query[pos:])
+        (key, op, value) = m.groups()
+        predicates.append(Predicate(key.upper(), "!=" if op == "<>" else op,
+                                    _parseValue(value)))
+        pos = m.end()
+        if _END.match(query, pos):
+            break
+        m = _AND.match(query, pos)
+        if m is None:
+            raise ValueError("Expected AND at: '%s'" % query[pos:])
+        pos = m.end()
+    if len(predicates) > MAX_PREDICATES:
+        raise ValueError("Too many predicates, the limit is %d" % MAX_PREDICATES)
+    return predicates
+
+
+def _parseValue(value):
+    """
+    Return a str (quoted string, unescaped and without trailing spaces, as
+    stored, or T/F), or a float.
+    """
+    if value.startswith("'"):
+        if len(value) < 2 or not value.endswith("'"):
+            raise ValueError("Unterminated string: %s" % value)
+        return value[1:-1].replace("''", "'").rstrip()
+    if value in ("T", "F"):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("Invalid value: %s" % value)
+
+
+def findFiles(engine, predicates, repoIds=None, after=None, limit=None,
+              estimateCap=ESTIMATE_CAP, probeCost=PROBE_COST):
+    """
+    Return ids of files matching all predicates.
+
+    @param engine       engine (or connection) to the metaserv database
+    @param predicates   list of Predicate
+    @param repoIds      ids of the repositories (File.fRepoId) of the files
+                        searched, all files if None
+    @param after        only file ids greater than after are returned, if
+                        not None
+    @param limit        at most limit ids are returned, the smallest ones,
+                        if not None
+    @param estimateCap  bound of the counts estimating selectivity
+    @param probeCost    cost of checking one file for a predicate, relative
+                        to reading one index entry
+
+    @return sorted numpy array of file ids
+    """
+    if not predicates or (repoIds is not None and not len(repoIds)):
+        return np.array([], dtype=np.int64)
+    scope = _Scope(repoIds, after, None)
+    if limit is None:
+        plan = sorted((_estimate(engine, p, estimateCap, scope), i, p)
+                      for (i, p) in enumerate(predicates))
+        (estimate, i, p) = plan[0]
+        # files left are in the repositories, others need not be joined
+        return _filter(engine, plan[1:], _matches(engine, p, scope),
+                       _Scope(None, after, None), estimateCap, probeCost)
+    # selectivity beyond the cost of probing a page does not matter, and
+    # estimates only count entries of one index range, so that they cost no
+    # more than their bound
+    estimateCap = min(estimateCap, limit * probeCost)
+    plan = sorted((_estimate(engine, p, estimateCap, _indexScope(p, scope)), i, p)
+                  for (i, p) in enumerate(predicates))
+    # only an equality is read in order of file id, a batch at a time; others
+    # are read at once, and drive only if that costs less than probing them
+    plan.sort(key=lambda (estimate, i, p):
+              (p.op != "=" and estimate >= estimateCap, estimate, i))
+    fileIds = []
+    for (batch, window) in _batches(engine, plan[0][2], scope, limit):
+        fileIds.extend(_filter(engine, plan[1:], batch, window, estimateCap,
+                               probeCost).tolist())
+        if len(fileIds) >= limit:
+            break
+    return np.array(fileIds[:limit], dtype=np.int64)
+
+
+# files a predicate is evaluated on: of the repositories repoIds, with ids in
+# (after, upTo], None meaning no restriction
+_Scope = namedtuple("_Scope", ["repoIds", "after", "upTo"])
+_ALL = _Scope(None, None, None)
+
+
+def _indexScope(p, scope):
+    """
+    Return the part of scope that bounds the range of the index of p: file
+    ids are in order within an equality only, and repositories need a join.
+    """
+    if p.op != "=":
+        return _ALL
+    return _Scope(None, scope.after, scope.upTo)
+
+
+def _filter(engine, plan, fileIds, scope, estimateCap, probeCost):
+    """
+    Return sorted array of the ids of fileIds (sorted array, in scope)
+    matching the predicates of plan, list of (estimate, i, Predicate).
+    """
+    for (estimate, i, p) in plan:
+        if not len(fileIds):
+            break
+        cost = len(fileIds) * probeCost
+        # matches in a window of file ids are read from the index range of an
+        # equality only, others would be read in whole: they are probed
+        windowed = scope.upTo is not None and p.op != "="
+        if not windowed and estimate >= estimateCap and cost > estimateCap:
+            estimate = _estimate(engine, p, cost, scope)
+        if windowed or cost <= estimate:
+            fileIds = _probe(engine, p, fileIds)
+        else:
+            fileIds = np.intersect1d(fileIds, _matches(engine, p, scope),
+                                     assume_unique=True)
+        log.debug("%s %s %r (estimate %d): %d files left", p.key, p.op,
+                  p.value, estimate, len(fileIds))
+    return fileIds
+
+
+def _source(p, scope):
+    """
+    Return the FROM and WHERE clauses of the keyword rows matching p in scope.
+    """
+    column = "stringValue" if isinstance(p.value, basestring) else "doubleValue"
+    tables = "FitsUnstructuredMeta"
+    where = "fitsKey = :key AND %s %s :value" % (column, p.op)
+    if scope.repoIds is not None:
+        tables += " JOIN File USING (fileId)"
+        where += " AND fRepoId IN (%s)" % ", ".join(str(r) for r in scope.repoIds)
+    if scope.after is not None:
+        where += " AND fileId > :after"
+    if scope.upTo is not None:
+        where += " AND fileId <= :upTo"
+    return "FROM %s WHERE %s" % (tables, where)
+
+
+def _estimate(engine, p, cap, scope):
+    """
+    Return the number of keyword rows matching p in scope, up to cap.
+    """
+    query = text("SELECT COUNT(*) FROM (SELECT 1 %s LIMIT :cap) AS matches" %
+                 _source(p, scope))
+    return engine.execute(query, key=p.key, value=p.value, after=scope.after,
+                          upTo=scope.upTo, cap=cap).scalar()
+
+
+def _matches(engine, p, scope):
+    """
+    Return sorted array of ids of files matching p in scope.
+    """
+    query = text("SELECT fileId %s" % _source(p, scope))
+    rows = engine.execute(query, key=p.key, value=p.value, after=scope.after,
+                          upTo=scope.upTo).fetchall()
+    return np.unique(np.array([r[0] for r in rows], dtype=np.int64))
+
+
+def _batches(engine, p, scope, size):
+    """
+    Yield (sorted array of ids of files matching p in scope, scope of these
+    ids), in order of file id, the first batch of about size ids, each next
+    one twice as large. An equality is read from its index range in order of
+    file id, up to the batch; another predicate is read at once.
+    """
+    if p.op != "=":
+        fileIds = _matches(engine, p, scope)
+        (start, after) = (0, scope.after)
+        while start < len(fileIds):
+            batch = fileIds[start:start + size]
+            yield (batch, _Scope(None, after, int(batch[-1])))
+            (start, after, size) = (start + size, int(batch[-1]), size * 2)
+        return
+    after = scope.after
+    while True:
+        query = text("SELECT fileId %s ORDER BY fileId LIMIT :size" %
+                     _source(p, _Scope(scope.repoIds, after, None)))
+        rows = engine.execute(query, key=p.key, value=p.value, after=after,
+                              upTo=None, size=size).fetchall()
+        if not rows:
+            return
+        # the last file may have more matching HDUs, next rows start after it
+        batch = np.unique(np.array([r[0] for r in rows], dtype=np.int64))
+        yield (batch, _Scope(None, after, int(batch[-1])))
+        if len(rows) < size:
+            return
+        (after, size) = (int(batch[-1]), size * 2)
+
+
+def _probe(engine, p, fileIds):
+    """
+    Return sorted array of the ids of fileIds (sorted array) matching p.
+    """
+    found = []
+    for i in range(0, len(fileIds), _CHUNK):
+        # ids are integers, they are inlined rather than bound one by one
+        query = text("SELECT fileId %s AND fileId IN (%s)" % (
+            _source(p, _ALL), ", ".join(
+                str(f) for f in fileIds[i:i + _CHUNK].tolist())))
+        found.extend(r[0] for r in engine.execute(query, key=p.key,
+                                                  value=p.value).fetchall())
+    return np.unique(np.array(found, dtype=np.int64))
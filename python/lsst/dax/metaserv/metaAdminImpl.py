@@ -27,14 +27,31 @@ LSST Metadata Server.
 @author  Jacek Becla, SLAC
 """
 
+from collections import namedtuple
+from contextlib import contextmanager
+import datetime
+import hashlib
 import logging as log
+from multiprocessing.pool import ThreadPool
+import os
 # import pprint
 import re
+import time
 
-from lsst.db.engineFactory import getEngineFromFile
 from lsst.db import utils
-from .schemaToMeta import parseSchema
+from .connectionManager import ConnectionManager
+from .dbManifest import readManifest
+from .fileChecksum import checkAlgorithm, checksumFiles
+from .fitsIngest import batches, parseFitsFiles, scanFitsFiles
+from . import healpix
+from .schemaReconciler import SchemaReconciler
+from .schemaToMeta import iterSchema, openSchema
 from .metaBException import MetaBException
+from .resultCache import invalidateAll
+
+# What addDbDescr needs to know about a database, fetched from its server.
+_SourceDb = namedtuple("_SourceDb", ["dbName", "dbColumns", "schemaVersion",
+                                     "schemaDescr", "host", "port"])
 
 
 class MetaAdminImpl(object):
@@ -42,27 +59,71 @@ class MetaAdminImpl(object):
     Implements the guts of the metaserver admin program."
     """
 
-    def __init__(self, msMysqlAuthF):
+    def __init__(self, msMysqlAuthF, batchSize=1000, schemaCache=None):
         """
         @param msMysqlAuthF  mysql auth file for metaserv db and metaserv user
+        @param batchSize     max number of rows inserted per statement in bulk
+                             mode
+        @param schemaCache   schemaCache.SchemaCache of parsed schema files,
+                             None to parse schema files every time
         """
         self._msMysqlAuthF = msMysqlAuthF
+        self._batchSize = batchSize
+        self._schemaCache = schemaCache
         self._log = log.getLogger("lsst.metaserv.admin")
+        self._conns = ConnectionManager()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run all calls made within the block over one connection to metaserv,
+        in one transaction: committed at the end of the block, rolled back if
+        the block raises. Calls that talk to the database being described run
+        in the transaction too if it is on the metaserv server (same server,
+        user and default database, see connectionManager.ConnectionManager).
+        Databases added by addDbDescrManifest are committed each on its own.
+        """
+        with self._conns.pinned(self._msMysqlAuthF) as conn, conn.begin():
+            yield
+
+    def _msConnect(self):
+        """
+        Context manager providing a connection to metaserv: the one of the
+        current transaction() block, or one from the pool.
+        """
+        return self._conns.connect(self._msMysqlAuthF)
+
+    def close(self):
+        """
+        Close all connections. The object can still be used, connections are
+        reopened when needed.
+        """
+        self._conns.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def addDbDescr(self, dbName, schemaFile, level, dataRel, owner,
-                   accessibility, projectName, dbMysqlAuthF):
+                   accessibility, projectName, dbMysqlAuthF, bulk=True):
         """
         Add a database along with additional schema description provided through
         @schemaFile.
 
         @param dbName        database name
-        @param schemaFile    ascii file containing schema with description
+        @param schemaFile    ascii file containing schema with description, "-"
+                             for the standard input, can be gzip or bz2
+                             compressed (see schemaToMeta.openSchema)
         @param level         level (e.g., L1, L2, L3)
         @param dataRel       data release
         @param owner         owner of the database
         @param accessibility accessibility of the database (pending/public/private)
         @param projectName   name of the project the db is associated with
         @param dbMysqlAuthF  mysql auth file for the db that we are adding
+        @param bulk          insert tables and columns in batches (see
+                             _storeTablesBulk), instead of one table at a time
 
         The function connects to two database servers:
         a) one that has the database that is being loaded
@@ -71,10 +132,7 @@ class MetaAdminImpl(object):
 
         The course of action:
         * connect to the server that has database that is being loaded
-        * parse the ascii schema file
         * fetch schema information from the information_schema
-        * do the matching, add info fetched from information_schema to the
-          in memory structure produced by parsing ascii schema file
         * fetch schema description and version (which is kept as data inside
           a special table in the database that is being loaded). Ignore if it
           does not exist.
@@ -82,8 +140,13 @@ class MetaAdminImpl(object):
         * connect to the metaserv database
         * validate owner, project (these must be loaded into metaserv prior to
         calling this function)
-        * load all the information into metaserv in various tables (Repo,
-          DDT_Table, DDT_Column)
+        * in one transaction: add the database to Repo and DbRepo, then parse
+          the ascii schema file one table at a time, match each table with the
+          information_schema (adding ordinal positions of columns), and load it
+          into DDT_Table and DDT_Column. Parsing is pipelined with loading, so
+          memory use does not grow with the size of the schema. A mismatch
+          found along the way rolls the transaction back. If a schema cache
+          is configured, the parsed file is loaded from it instead.
 
         It raises following MetaBEXceptions:
         * DB_DOES_NOT_EXISTS if database dbName does not exist
@@ -95,123 +158,408 @@ class MetaAdminImpl(object):
         * COL_NOT_IN_FL if the column is in the database schema, but not in ascii
                         schema
         * Db object can throw various DbException and MySQL exceptions
+        IOError is raised if the ascii schema file can't be read.
         """
 
-        # Connect to the server that has database that is being added
-        conn = getEngineFromFile(dbMysqlAuthF).connect()
-        if not utils.dbExists(conn, dbName):
-            self._log.error("Db '%s' not found.", dbName)
-            raise MetaBException(MetaBException.DB_DOES_NOT_EXIST, dbName)
+        source = self._describeSource(dbName, dbMysqlAuthF)
+        with openSchema(schemaFile) as schemaF:
+            tables = self._matchTables(self._schemaTables(schemaF),
+                                       source.dbColumns)
+            self._registerDb(source, tables, level, dataRel, owner,
+                             accessibility, projectName, bulk)
 
-        # Parse the ascii schema file
-        theTable = parseSchema(schemaFile)
+    def addDbDescrManifest(self, manifestFile, workers=4, bulk=True):
+        """
+        Add the databases listed in a manifest, as addDbDescr does for one
+        database. The preparation of each database (information_schema and
+        schema description queries, parsing and matching of the ascii schema
+        file) runs concurrently in a pool of worker threads; the writes to
+        metaserv are done one database at a time, each in its own transaction,
+        in the order of the manifest, while the next databases are prepared.
+        A failure only affects the database it concerns: databases are
+        committed on their own connection even within a transaction() block,
+        whose rollback does not undo them.
 
-        # Fetch the schema information from the database
-        ret = conn.execute(
-            "SELECT table_name, column_name, ordinal_position "
-            "FROM information_schema.COLUMNS WHERE "
-            "TABLE_SCHEMA = %s ORDER BY table_name", (dbName,))
-
-        # Count the number of columns in the ascii file
-        nColumns = sum(len(t["columns"]) for t in theTable.values())
-
-        # Check if the number of columns matches
-        if nColumns != ret.rowcount:
-            self._log.error("Number of columns in ascii file "
-                    "(%d) != number of columns in db (%d)", nColumns, ret.rowcount)
-            raise MetaBException(MetaBException.NOT_MATCHING)
-
-        rows = ret.fetchall()
-
-        # Fetch ordinal_positions from information_schema and add it to "theTable"
-        for (tName, cName, ordP) in rows:
-            t = theTable.get(tName, None)
-            if not t:
-                self._log.error(
-                    "Table '%s' not found in db, present in ascii file.", tName)
-                raise MetaBException(MetaBException.TB_NOT_IN_DB, tName)
-            foundColumn = False
-            for c in t["columns"]:
-                if c["name"] == cName:
-                    foundColumn = True
-                    c["ord_pos"] = int(ordP)
-                    break
-        if not foundColumn:
-            self._log.error(
-                "Column '%s.%s' not found in db, present in ascii file.",
-                tName, cName)
-            raise MetaBException(MetaBException.COL_NOT_IN_TB, cName, tName)
-
-        # Check if we covered all columns
-        for t in theTable:
-            for c in theTable[t]["columns"]:
-                if "ord_pos" not in c:
-                    self._log.error(
-                        "Column '%s.%s' not found in ascii file, present in db.",
-                        t, c)
-                    raise MetaBException(MetaBException.COL_NOT_IN_FL, str(c), str(t))
-
-        # Get schema description and version, it is ok if it is missing
-        ret = conn.execute(
-            "SELECT version, descr FROM %s.ZZZ_Schema_Description" % dbName)
-        if ret.rowcount != 1:
-            self._log.error(
-                "Db '%s' does not contain schema version/description", dbName)
-            schemaVersion = "unknown"
-            schemaDescr = ""
-        else:
-            (schemaVersion, schemaDescr) = ret.first()
+        @param manifestFile  manifest file, see dbManifest.readManifest
+        @param workers       number of worker threads preparing databases
+        @param bulk          see addDbDescr
+
+        @return list of (dbName, exception) in the order of the manifest,
+                exception is None for databases successfully added
+
+        Raises MetaBException BAD_MANIFEST if the manifest is invalid.
+        """
+        entries = readManifest(manifestFile, {"project": "LSST",
+                                              "mysqlAuthFile": self._msMysqlAuthF})
+
+        def prepare(entry):
+            try:
+                source = self._describeSource(entry["dbName"],
+                                              entry["mysqlAuthFile"])
+                with openSchema(entry["schemaFile"]) as schemaF:
+                    tables = list(self._matchTables(self._schemaTables(schemaF),
+                                                    source.dbColumns))
+                return (source, tables, None)
+            except Exception as e:
+                return (None, None, e)
+
+        results = []
+        pool = ThreadPool(max(1, min(workers, len(entries))))
+        try:
+            for (entry, (source, tables, error)) in \
+                    zip(entries, pool.imap(prepare, entries)):
+                if error is None:
+                    try:
+                        with self._conns.unpinned():
+                            self._registerDb(source, tables, entry["level"],
+                                             entry["dataRel"], entry["owner"],
+                                             entry["accessibility"],
+                                             entry["project"], bulk)
+                    except Exception as e:
+                        error = e
+                if error is None:
+                    self._log.info("Added db '%s'.", entry["dbName"])
+                else:
+                    self._log.error("Failed to add db '%s': %s",
+                                    entry["dbName"], error)
+                results.append((entry["dbName"], error))
+        finally:
+            pool.close()
+            pool.join()
+        return results
 
-        # This can be sometimes handy for debugging. (uncomment import too)
-        # pp = pprint.PrettyPrinter(indent=2)
-        # pp.pprint(theTable)
+    def _describeSource(self, dbName, dbMysqlAuthF):
+        """
+        Fetch what is needed to add database dbName from the server that has it:
+        its schema (see _dbColumns), schema version and description, and the
+        host/port of the server.
 
-        # Get host/port from engine
-        host = conn.engine.url.host
-        port = conn.egine.url.port
+        @return _SourceDb
+        """
+        with self._connectDb(dbName, dbMysqlAuthF) as conn:
+            dbColumns = self._dbColumns(conn, dbName)
+            (schemaVersion, schemaDescr) = self._schemaDescr(conn, dbName)
+            return _SourceDb(dbName, dbColumns, schemaVersion, schemaDescr,
+                             conn.engine.url.host, conn.engine.url.port)
 
-        # Now, we will be talking to the metaserv database, so change
-        # connection as needed
-        if self._msMysqlAuthF != dbMysqlAuthF:
-            conn = getEngineFromFile(self._msMysqlAuthF).connect()
+    def _registerDb(self, source, tables, level, dataRel, owner, accessibility,
+                    projectName, bulk):
+        """
+        Validate owner and project, and add database to metaserv, with tables,
+        in one transaction. See addDbDescr.
 
-        # get ownerId, this serves as validation that this is a valid owner name
+        @param source  _SourceDb, as returned by _describeSource
+        @param tables  iterable of schemaToMeta.SchemaTable matched with the db
+                       schema (see _matchTables), can be a generator
+        """
+        dbName = source.dbName
+        with self._msConnect() as conn:
+            (ownerId, projectId) = self._ownerAndProject(conn, owner, projectName)
+
+            # Finally, save things in the MetaServ database
+            with conn.begin():
+                cmd = "INSERT INTO Repo(url, projectId, repoType, lsstLevel, dataRelease, "
+                cmd += "version, shortName, description, ownerId, accessibility) "
+                cmd += "VALUES('/dummy',%s,'db',%s,%s,%s,%s,%s,%s,%s) "
+                opts = (projectId, level, dataRel, source.schemaVersion, dbName,
+                        source.schemaDescr, ownerId, accessibility)
+                results = conn.execute(cmd, opts)
+                repoId = results.lastrowid
+                cmd = "INSERT INTO DbRepo(dbRepoId, dbName, connHost, connPort) "
+                cmd += "VALUES(%s,%s,%s,%s)"
+                conn.execute(cmd, (repoId, dbName, source.host, source.port))
+                if bulk:
+                    self._storeTablesBulk(conn, repoId, tables)
+                else:
+                    self._storeTablesPerRow(conn, repoId, tables)
+
+            self._catalogChanged(conn, dbName)
+
+    def _ownerAndProject(self, conn, owner, projectName):
+        """
+        Return (ownerId, projectId), this serves as validation that owner and
+        projectName are known.
+
+        Raises MetaBException OWNER_NOT_FOUND or PROJECT_NOT_FOUND.
+        """
         ret = conn.execute("SELECT userId FROM User WHERE mysqlUserName = %s",
                            (owner,))
-
         if ret.rowcount != 1:
             self._log.error("Owner '%s' not found.", owner)
             raise MetaBException(MetaBException.OWNER_NOT_FOUND, owner)
         ownerId = ret.scalar()
 
-        # get projectId, this serves as validation that this is a valid project name
         ret = conn.execute("SELECT projectId FROM Project WHERE projectName =%s",
                            (projectName,))
         if ret.rowcount != 1:
-            self._log.error("Project '%s' not found.", owner)
+            self._log.error("Project '%s' not found.", projectName)
             raise MetaBException(MetaBException.PROJECT_NOT_FOUND, projectName)
-        projectId = ret.scalar()
-
-        # Finally, save things in the MetaServ database
-        cmd = "INSERT INTO Repo(url, projectId, repoType, lsstLevel, dataRelease, "
-        cmd += "version, shortName, description, ownerId, accessibility) "
-        cmd += "VALUES('/dummy',%s,'db',%s,%s,%s,%s,%s,%s,%s) "
-        opts = (projectId, level, dataRel, schemaVersion, dbName, schemaDescr,
-                ownerId, accessibility)
-        results = conn.execute(cmd, opts)
-        repoId = results.lastrowid
-        cmd = "INSERT INTO DbRepo(dbRepoId, dbName, connHost, connPort) "
-        cmd += "VALUES(%s,%s,%s,%s)"
-        conn.execute(cmd, (repoId, dbName, host, port))
-
-        for t in theTable:
-            cmd = 'INSERT INTO DDT_Table(dbRepoId, tableName, descr) '
-            cmd += 'VALUES(%s, %s, %s)'
-            results = conn.execute(cmd, (repoId, t,
-                                         theTable[t].get("description", "")))
+        return (ownerId, ret.scalar())
+
+    def updateDbDescr(self, dbName, schemaFile, dbMysqlAuthF):
+        """
+        Update description of a database added earlier through addDbDescr, after
+        its schema, or the ascii file describing it, changed. The parsed schema
+        (matched with the information_schema, as in addDbDescr) is compared with
+        what metaserv stores, and only the differences are written, in one
+        transaction. Tables whose content hash did not change are skipped
+        without looking at their columns. If nothing changed, nothing is
+        written, and the catalog generation is kept.
+
+        @param dbName        database name
+        @param schemaFile    ascii file containing schema with description, see
+                             addDbDescr
+        @param dbMysqlAuthF  mysql auth file for the db that we are updating
+
+        @return dictionary with the number of tables and columns added, updated
+                and deleted, and the number of unchanged tables
+
+        It raises the same MetaBExceptions as addDbDescr, and DB_NOT_REGISTERED
+        if database dbName was not added to metaserv.
+        """
+        source = self._describeSource(dbName, dbMysqlAuthF)
+        with openSchema(schemaFile) as schemaF:
+            theTable = dict((t.name, t) for t in
+                            self._matchTables(self._schemaTables(schemaF),
+                                              source.dbColumns))
+
+        with self._msConnect() as conn:
+            stats = self._updateTables(conn, dbName, source, theTable)
+        self._log.info("Updated db '%s': %s", dbName, stats)
+        return stats
+
+    def _updateTables(self, conn, dbName, source, theTable):
+        """
+        Body of updateDbDescr, see there.
+
+        @param conn      connection to the metaserv database
+        @param source    _SourceDb, as returned by _describeSource
+        @param theTable  dictionary: table name -> schemaToMeta.SchemaTable
+                         matched with the db schema
+        """
+        row = conn.execute("SELECT dbRepoId, version, description, connHost, "
+                           "connPort FROM DbRepo JOIN Repo ON (repoId = dbRepoId) "
+                           "WHERE dbName = %s", (dbName,)).first()
+        if row is None:
+            self._log.error("Db '%s' not registered.", dbName)
+            raise MetaBException(MetaBException.DB_NOT_REGISTERED, dbName)
+        repoId = row[0]
+
+        stats = dict.fromkeys(("tablesAdded", "tablesUpdated", "tablesDeleted",
+                               "tablesUnchanged", "columnsAdded",
+                               "columnsUpdated", "columnsDeleted"), 0)
+        with conn.begin():
+            repoChanged = (row[1], row[2] or "") != \
+                (source.schemaVersion, source.schemaDescr or "")
+            if repoChanged:
+                conn.execute("UPDATE Repo SET version = %s, description = %s "
+                             "WHERE repoId = %s",
+                             (source.schemaVersion, source.schemaDescr, repoId))
+            if tuple(row[3:]) != (source.host, source.port):
+                repoChanged = True
+                conn.execute("UPDATE DbRepo SET connHost = %s, connPort = %s "
+                             "WHERE dbRepoId = %s", (source.host, source.port, repoId))
+
+            # Classify tables: new, changed, unchanged, deleted (left in stored)
+            stored = dict((name, (tableId, contentHash)) for
+                          (tableId, name, contentHash) in conn.execute(
+                "SELECT tableId, tableName, contentHash FROM DDT_Table "
+                "WHERE dbRepoId = %s", (repoId,)))
+            newTables = {}
+            changed = {} # tableId -> (tableName, new content hash)
+            for (name, t) in theTable.iteritems():
+                if name not in stored:
+                    newTables[name] = t
+                    continue
+                (tableId, contentHash) = stored.pop(name)
+                newHash = _tableHash(t)
+                if contentHash == newHash:
+                    stats["tablesUnchanged"] += 1
+                else:
+                    changed[tableId] = (name, newHash)
+
+            if stored:
+                tableIds = [tableId for (tableId, h) in stored.itervalues()]
+                stats["columnsDeleted"] += self._deleteIn(
+                    conn, "DDT_Column", "tableId", tableIds)
+                stats["tablesDeleted"] = self._deleteIn(
+                    conn, "DDT_Table", "tableId", tableIds)
+
+            if newTables:
+                self._storeTablesBulk(conn, repoId, newTables.itervalues())
+                stats["tablesAdded"] = len(newTables)
+                stats["columnsAdded"] += sum(len(t.columns)
+                                             for t in newTables.itervalues())
+
+            if changed:
+                # tableId -> {columnName: (columnId, ordinalPosition, descr,
+                #                          ucd, units)}
+                storedColumns = {}
+                for ids in self._chunks(changed.keys()):
+                    for row in conn.execute(
+                            "SELECT tableId, columnName, columnId, "
+                            "ordinalPosition, descr, ucd, units FROM DDT_Column "
+                            "WHERE tableId IN (%s)" % ", ".join(["%s"] * len(ids)),
+                            ids):
+                        storedColumns.setdefault(row[0], {})[row[1]] = \
+                            (row[2], int(row[3])) + tuple(v or "" for v in row[4:])
+                toInsert = []
+                toUpdate = []
+                toDelete = []
+                for (tableId, (name, newHash)) in changed.iteritems():
+                    t = theTable[name]
+                    conn.execute("UPDATE DDT_Table SET descr = %s, contentHash = %s "
+                                 "WHERE tableId = %s",
+                                 (t.description or "", newHash, tableId))
+                    columns = storedColumns.get(tableId, {})
+                    for c in t.columns:
+                        values = _columnValues(c)
+                        old = columns.pop(c.name, None)
+                        if old is None:
+                            toInsert.append((c.name, tableId) + values)
+                        elif old[1:] != values:
+                            toUpdate.append(values + (old[0],))
+                    toDelete.extend(old[0] for old in columns.itervalues())
+                self._executeBatches(conn, _INSERT_COLUMN, toInsert)
+                self._executeBatches(
+                    conn, "UPDATE DDT_Column SET ordinalPosition = %s, descr = %s, "
+                    "ucd = %s, units = %s WHERE columnId = %s", toUpdate)
+                self._deleteIn(conn, "DDT_Column", "columnId", toDelete)
+                stats["tablesUpdated"] = len(changed)
+                stats["columnsAdded"] += len(toInsert)
+                stats["columnsUpdated"] = len(toUpdate)
+                stats["columnsDeleted"] += len(toDelete)
+
+        # a re-run over an unchanged database keeps ETags and cached responses
+        if repoChanged or stats["tablesAdded"] or stats["tablesUpdated"] or \
+                stats["tablesDeleted"]:
+            self._catalogChanged(conn, dbName)
+        return stats
+
+    @contextmanager
+    def _connectDb(self, dbName, dbMysqlAuthF):
+        """
+        Context manager providing a connection to the server that has database
+        dbName. It is the metaserv connection if both are on the same server
+        (see connectionManager.ConnectionManager).
+
+        Raises MetaBException DB_DOES_NOT_EXIST if dbName does not exist.
+        """
+        with self._conns.connect(dbMysqlAuthF) as conn:
+            if not utils.dbExists(conn, dbName):
+                self._log.error("Db '%s' not found.", dbName)
+                raise MetaBException(MetaBException.DB_DOES_NOT_EXIST, dbName)
+            yield conn
+
+    def _dbColumns(self, conn, dbName):
+        """
+        Fetch the schema of database dbName from the information_schema.
+
+        @return dictionary: table name -> {column name: (ordinal position,
+                column type)}, see schemaReconciler.SchemaReconciler
+        """
+        dbColumns = {}
+        for (tName, cName, ordP, cType) in conn.execute(
+                "SELECT table_name, column_name, ordinal_position, column_type "
+                "FROM information_schema.COLUMNS WHERE "
+                "TABLE_SCHEMA = %s", (dbName,)):
+            dbColumns.setdefault(tName, {})[cName] = (int(ordP), cType)
+        return dbColumns
+
+    def _schemaDescr(self, conn, dbName):
+        """
+        Get schema version and description of database dbName, it is ok if they
+        are missing.
+
+        @return (schemaVersion, schemaDescr)
+        """
+        ret = conn.execute(
+            "SELECT version, descr FROM %s.ZZZ_Schema_Description" % dbName)
+        if ret.rowcount != 1:
+            self._log.error(
+                "Db '%s' does not contain schema version/description", dbName)
+            return ("unknown", "")
+        return tuple(ret.first())
+
+    def _schemaTables(self, schemaF):
+        """
+        Return iterable of schemaToMeta.SchemaTable parsed from schemaF: the
+        tables are parsed as they are consumed, or loaded at once from the
+        schema cache.
+        """
+        if self._schemaCache is None:
+            return iterSchema(schemaF)
+        return self._schemaCache.tables(schemaF)
+
+    def _matchTables(self, tables, dbColumns):
+        """
+        Match tables parsed from the ascii schema file with the database schema,
+        one table at a time: set ord_pos of each column, and yield the table.
+        After the first mismatch, the remaining tables are only checked, so that
+        all mismatches are logged, then the MetaBException describing the first
+        one is raised. Ordinal drift and type mismatches are logged as warnings.
+
+        @param tables     iterable of schemaToMeta.SchemaTable
+        @param dbColumns  database schema, as returned by _dbColumns
+
+        Raises MetaBException NOT_MATCHING, TB_NOT_IN_DB, COL_NOT_IN_TB or
+        COL_NOT_IN_FL, see addDbDescr.
+        """
+        reconciler = SchemaReconciler(dbColumns)
+        tables = iter(tables)
+        for t in tables:
+            if not reconciler.check(t):
+                for t in tables:
+                    reconciler.check(t)
+                break
+            yield t
+        report = reconciler.finish()
+        if not report.matches():
+            self._log.error("Ascii schema does not match db schema. %s", report)
+            raise report.error()
+        if report.ordinalDrift or report.typeMismatches:
+            self._log.warning("Ascii schema differs from db schema. %s", report)
+
+    def validateDbDescr(self, dbName, schemaFile, dbMysqlAuthF):
+        """
+        Dry run of addDbDescr: reconcile the ascii schema file with the schema
+        of database dbName, without touching metaserv.
+
+        @param dbName        database name
+        @param schemaFile    ascii file containing schema with description, see
+                             addDbDescr
+        @param dbMysqlAuthF  mysql auth file for the db that we are checking
+
+        @return schemaReconciler.SchemaReport listing all differences
+
+        Raises MetaBException DB_DOES_NOT_EXIST if database dbName does not
+        exist.
+        """
+        with self._connectDb(dbName, dbMysqlAuthF) as conn:
+            reconciler = SchemaReconciler(self._dbColumns(conn, dbName))
+        with openSchema(schemaFile) as schemaF:
+            for t in self._schemaTables(schemaF):
+                reconciler.check(t)
+        return reconciler.finish()
+
+    def _storeTablesPerRow(self, conn, repoId, tables):
+        """
+        Insert DDT_Table rows one at a time, each followed by one insert of all
+        its DDT_Column rows.
+
+        @param conn      connection to the metaserv database
+        @param repoId    id of the repo the tables belong to
+        @param tables    iterable of schemaToMeta.SchemaTable, with ord_pos set
+                         for each column
+        """
+        for t in tables:
+            cmd = 'INSERT INTO DDT_Table(dbRepoId, tableName, descr, contentHash) '
+            cmd += 'VALUES(%s, %s, %s, %s)'
+            results = conn.execute(cmd, (repoId, t.name, t.description or "",
+                                         _tableHash(t)))
             tableId = results.lastrowid
             isFirst = True
-            for c in theTable[t]["columns"]:
+            for c in t.columns:
                 if isFirst:
                     cmd = 'INSERT INTO DDT_Column(columnName, tableId, '
                     cmd += 'ordinalPosition, descr, ucd, units) VALUES '
@@ -220,10 +568,492 @@ class MetaAdminImpl(object):
                 else:
                     cmd += ', '
                 cmd += '(%s, %s, %s, %s, %s, %s)'
-                opts += (c["name"], tableId, c["ord_pos"],
-                         c.get("description", ""), c.get("ucd", ""),
-                         c.get("unit", ""))
-            conn.execute(cmd, opts)
+                opts += (c.name, tableId) + _columnValues(c)
+            if not isFirst:
+                conn.execute(cmd, opts)
+
+    def _storeTablesBulk(self, conn, repoId, tables):
+        """
+        Insert DDT_Table rows, then DDT_Column rows, through executemany, for
+        groups of tables having up to about batchSize columns. Ids of the new
+        tables are resolved with one query per group. Tables are consumed as
+        they come, so tables can be a generator. Parameters are the same as for
+        _storeTablesPerRow.
+        """
+        cmd = 'INSERT INTO DDT_Table(dbRepoId, tableName, descr, contentHash) '
+        cmd += 'VALUES(%s, %s, %s, %s)'
+        for batch in self._tableBatches(tables):
+            self._executeBatches(conn, cmd,
+                                 ((repoId, t.name, t.description or "",
+                                   _tableHash(t)) for t in batch))
+            names = [t.name for t in batch]
+            tableIds = dict(conn.execute(
+                "SELECT tableName, tableId FROM DDT_Table WHERE dbRepoId = %%s "
+                "AND tableName IN (%s)" % ", ".join(["%s"] * len(names)),
+                [repoId] + names).fetchall())
+            self._executeBatches(conn, _INSERT_COLUMN,
+                                 ((c.name, tableIds[t.name]) + _columnValues(c)
+                                  for t in batch for c in t.columns))
+
+    def _tableBatches(self, tables):
+        """
+        Group tables into lists of consecutive tables having up to batchSize
+        rows (one per table and one per column) in total, or one table if it
+        alone has more rows.
+        """
+        batch = []
+        nRows = 0
+        for t in tables:
+            n = 1 + len(t.columns)
+            if batch and nRows + n > self._batchSize:
+                yield batch
+                batch = []
+                nRows = 0
+            batch.append(t)
+            nRows += n
+        if batch:
+            yield batch
+
+    def _deleteIn(self, conn, tableName, columnName, values):
+        """
+        Delete rows of tableName where columnName is one of values, in batches.
+
+        @return number of deleted rows
+        """
+        nRows = 0
+        for chunk in self._chunks(values):
+            nRows += conn.execute(
+                "DELETE FROM %s WHERE %s IN (%s)" %
+                (tableName, columnName, ", ".join(["%s"] * len(chunk))),
+                chunk).rowcount
+        return nRows
+
+    def _updateIn(self, conn, tableName, assignment, columnName, values):
+        """
+        Update rows of tableName where columnName is one of values, in batches.
+
+        @param assignment  SET clause, e.g. "onDisk = 0"
+        """
+        for chunk in self._chunks(values):
+            conn.execute("UPDATE %s SET %s WHERE %s IN (%s)" %
+                         (tableName, assignment, columnName,
+                          ", ".join(["%s"] * len(chunk))), chunk)
+
+    def _chunks(self, values):
+        """
+        Split list of values into lists of up to batchSize values.
+        """
+        values = list(values)
+        return [values[i:i+self._batchSize]
+                for i in range(0, len(values), self._batchSize)]
+
+    def _executeBatches(self, conn, cmd, rows):
+        """
+        Execute cmd for every row (a tuple of parameters), through executemany,
+        up to batchSize rows at a time.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self._batchSize:
+                conn.execute(cmd, batch)
+                batch = []
+        if batch:
+            conn.execute(cmd, batch)
+
+    def addFileRepo(self, rootDir, level, dataRel, owner, accessibility,
+                    projectName, workers=None, filesPerBatch=500):
+        """
+        Add a file repository: all FITS files found under directory rootDir,
+        with the metadata read from their headers.
+
+        @param rootDir        directory with the files
+        @param level          see addDbDescr
+        @param dataRel        see addDbDescr
+        @param owner          see addDbDescr
+        @param accessibility  see addDbDescr
+        @param projectName    see addDbDescr
+        @param workers        number of processes parsing headers, see
+                              fitsIngest.parseFitsFiles
+        @param filesPerBatch  number of files loaded per transaction
+
+        The course of action:
+        * validate owner and project, add the repo to Repo, FileRepo and
+          FileRepoTypes
+        * list the files (see fitsIngest.scanFitsFiles)
+        * parse headers of the files in a pool of processes (only the header
+          blocks are read, see fitsHeader)
+        * as parsed files come back, load them by batches of filesPerBatch
+          files, each batch in one transaction: one multi-row insert into
+          File (ids are then resolved with one query), and multi-row inserts
+          of up to batchSize rows into FitsMeta, FitsStructuredMeta and
+          FitsUnstructuredMeta. FileRepoTypes.fileCount is updated with each
+          batch.
+        Files that can't be parsed are logged and skipped.
+
+        @return dictionary with counts of files (see _syncFileRepo), and the
+                elapsed time
+
+        Raises MetaBException DIR_NOT_FOUND if rootDir is not a directory,
+        FILEREPO_EXISTS if it was already added, OWNER_NOT_FOUND,
+        PROJECT_NOT_FOUND.
+        """
+        start = time.time()
+        rootDir = os.path.abspath(rootDir)
+        if not os.path.isdir(rootDir):
+            raise MetaBException(MetaBException.DIR_NOT_FOUND, rootDir)
+        with self._msConnect() as conn:
+            (ownerId, projectId) = self._ownerAndProject(conn, owner, projectName)
+            if conn.execute("SELECT repoId FROM Repo WHERE repoType = 'file' "
+                            "AND url = %s", (rootDir,)).scalar() is not None:
+                raise MetaBException(MetaBException.FILEREPO_EXISTS, rootDir)
+            with conn.begin():
+                cmd = "INSERT INTO Repo(url, projectId, repoType, lsstLevel, "
+                cmd += "dataRelease, shortName, description, ownerId, "
+                cmd += "accessibility, ingestTime) "
+                cmd += "VALUES(%s,%s,'file',%s,%s,%s,'',%s,%s,NOW())"
+                repoId = conn.execute(cmd, (rootDir, projectId, level, dataRel,
+                                            os.path.basename(rootDir), ownerId,
+                                            accessibility)).lastrowid
+                conn.execute("INSERT INTO FileRepo(fRepoId) VALUES(%s)", (repoId,))
+                conn.execute("INSERT INTO FileRepoTypes(fRepoId, fileType, "
+                             "fileCount) VALUES(%s, 'fits', 0)", (repoId,))
+            stats = self._syncFileRepo(conn, repoId, rootDir, accessibility,
+                                       workers, filesPerBatch)
+            self._catalogChanged(conn)
+        stats["seconds"] = time.time() - start
+        self._log.info("Added file repo '%s': %s", rootDir, stats)
+        return stats
+
+    def updateFileRepo(self, rootDir, workers=None, filesPerBatch=500):
+        """
+        Bring a file repository added earlier through addFileRepo in sync with
+        the content of its directory. Only the differences are written: new
+        files are added, files whose size or modification time changed are
+        parsed again (their checksum is reset), files that disappeared are
+        marked as not on disk (onDisk = 0), and files that reappeared as on
+        disk again. Unchanged files are neither opened nor written.
+
+        @param rootDir        directory of the repository (Repo.url)
+        @param workers        see addFileRepo
+        @param filesPerBatch  see addFileRepo
+
+        @return dictionary with counts of files (see _syncFileRepo), and the
+                elapsed time
+
+        Raises MetaBException DIR_NOT_FOUND if rootDir is not a directory,
+        FILEREPO_UNKNOWN if it was not added.
+        """
+        start = time.time()
+        rootDir = os.path.abspath(rootDir)
+        if not os.path.isdir(rootDir):
+            raise MetaBException(MetaBException.DIR_NOT_FOUND, rootDir)
+        with self._msConnect() as conn:
+            (repoId, accessibility) = self._fileRepo(conn, rootDir)
+            stats = self._syncFileRepo(conn, repoId, rootDir, accessibility,
+                                       workers, filesPerBatch)
+            if stats["added"] or stats["updated"] or stats["missing"] or \
+                    stats["restored"] or stats["indexed"]:
+                self._catalogChanged(conn)
+        stats["seconds"] = time.time() - start
+        self._log.info("Updated file repo '%s': %s", rootDir, stats)
+        return stats
+
+    def checksumFileRepo(self, rootDir, algorithm="sha1", workers=4,
+                         force=False, useMmap=False):
+        """
+        Compute checksums (File.checksum, "<algorithm>:<hex digest>") of the
+        files of a file repository that are on disk and have no checksum yet:
+        files added or changed since the last run (updateFileRepo resets the
+        checksum of changed files). Files are hashed in a pool of threads (see
+        fileChecksum), and checksums are written in batches of batchSize rows,
+        one transaction per batch. A file whose size or modification time no
+        longer matches its File row is skipped: it changed since the last scan,
+        and its checksum will be computed after the next updateFileRepo.
+
+        @param rootDir    directory of the repository (Repo.url)
+        @param algorithm  hashlib algorithm, see fileChecksum.checkAlgorithm
+        @param workers    number of threads hashing files
+        @param force      recompute checksums of all files on disk
+        @param useMmap    memory-map files instead of reading them
+
+        @return dictionary with the number of files hashed, skipped and failed,
+                the number of bytes hashed, the elapsed time, and the
+                throughput in MB/s
+
+        Raises MetaBException BAD_ALGORITHM, FILEREPO_UNKNOWN.
+        """
+        checkAlgorithm(algorithm)
+        start = time.time()
+        rootDir = os.path.abspath(rootDir)
+        stats = dict.fromkeys(("hashed", "skipped", "failed", "bytes"), 0)
+        with self._msConnect() as conn:
+            (repoId, accessibility) = self._fileRepo(conn, rootDir)
+            cmd = "SELECT fileId, fileName, size, modTime FROM File "
+            cmd += "WHERE fRepoId = %s AND onDisk != 0"
+            if not force:
+                cmd += " AND checksum IS NULL"
+            files = dict((row[0], row[1:]) for row in
+                         conn.execute(cmd, (repoId,)))
+            self._log.info("Hashing %d files of %s", len(files), rootDir)
+            tasks = [(fileId, os.path.join(rootDir, name))
+                     for (fileId, (name, size, modTime)) in files.iteritems()]
+            batch = []
+            for (fileId, checksum, nBytes, error) in checksumFiles(
+                    tasks, algorithm, workers, useMmap=useMmap):
+                (name, size, modTime) = files[fileId]
+                if checksum is None:
+                    self._log.warning("Can't hash %s: %s", name, error)
+                    stats["failed"] += 1
+                    continue
+                try:
+                    st = os.stat(os.path.join(rootDir, name))
+                    current = (st.st_size == size and
+                               (modTime is None or st.st_mtime == modTime))
+                except OSError:
+                    current = False
+                if not current:
+                    self._log.info("Skipping %s: changed since last scan", name)
+                    stats["skipped"] += 1
+                    continue
+                stats["hashed"] += 1
+                stats["bytes"] += nBytes
+                batch.append((checksum, fileId))
+                if len(batch) >= self._batchSize:
+                    self._storeChecksums(conn, batch)
+                    batch = []
+            self._storeChecksums(conn, batch)
+            if stats["hashed"]:
+                self._catalogChanged(conn)
+        stats["seconds"] = time.time() - start
+        stats["MBps"] = (stats["bytes"] / 1e6 / stats["seconds"]
+                         if stats["seconds"] else 0.)
+        self._log.info("Checksums of file repo '%s': %s", rootDir, stats)
+        return stats
+
+    def _storeChecksums(self, conn, checksums):
+        """
+        Set File.checksum, in one transaction.
+
+        @param checksums  list of (checksum, fileId)
+        """
+        if checksums:
+            with conn.begin():
+                self._executeBatches(
+                    conn, "UPDATE File SET checksum = %s WHERE fileId = %s",
+                    checksums)
+
+    def _fileRepo(self, conn, rootDir):
+        """
+        Return (repoId, accessibility) of the file repository in rootDir
+        (an absolute path).
+
+        Raises MetaBException FILEREPO_UNKNOWN if it was not added.
+        """
+        row = conn.execute("SELECT repoId, accessibility FROM Repo WHERE "
+                           "repoType = 'file' AND url = %s", (rootDir,)).first()
+        if row is None:
+            raise MetaBException(MetaBException.FILEREPO_UNKNOWN, rootDir)
+        return tuple(row)
+
+    def _syncFileRepo(self, conn, repoId, rootDir, accessibility, workers,
+                      filesPerBatch):
+        """
+        Compare files found under rootDir with the File rows of repo repoId,
+        and write the differences, see updateFileRepo. Files under directories
+        that can't be listed are left alone.
+
+        @return dictionary with the number of files added, updated (changed),
+                restored (on disk again), missing (no longer on disk),
+                unchanged, and failed (could not be parsed), the number of
+                HDUs, structured metadata rows and keywords loaded, and the
+                number of structured metadata rows indexed (see
+                _indexFitsMeta)
+        """
+        (found, failedDirs) = scanFitsFiles(rootDir)
+        stats = dict.fromkeys(("added", "updated", "restored", "missing",
+                               "unchanged", "failed", "hdus", "structured",
+                               "keywords"), 0)
+        stored = {} # fileName -> (fileId, size, modTime, onDisk)
+        for row in conn.execute("SELECT fileName, fileId, size, modTime, onDisk "
+                                "FROM File WHERE fRepoId = %s", (repoId,)):
+            stored[row[0]] = row[1:]
+
+        toParse = []
+        changed = {} # fileName -> (fileId, onDisk)
+        restored = []
+        backfill = [] # (modTime, fileId) of files stored without modTime
+        for (path, (size, mTime)) in found.iteritems():
+            old = stored.pop(path, None)
+            if old is None:
+                toParse.append(path)
+                continue
+            (fileId, oldSize, oldTime, onDisk) = old
+            if oldSize != size or (oldTime is not None and oldTime != mTime):
+                toParse.append(path)
+                changed[path] = (fileId, onDisk)
+                continue
+            if oldTime is None:
+                backfill.append((mTime, fileId))
+            if onDisk:
+                stats["unchanged"] += 1
+            else:
+                restored.append(fileId)
+        failedDirs = tuple(d + os.sep for d in failedDirs)
+        missing = [fileId for (name, (fileId, size, modTime, onDisk))
+                   in stored.iteritems()
+                   if onDisk and not (failedDirs and name.startswith(failedDirs))]
+        stats["restored"] = len(restored)
+        stats["missing"] = len(missing)
+
+        if restored or missing or backfill:
+            with conn.begin():
+                self._updateIn(conn, "File", "onDisk = %d" % ON_DISK, "fileId",
+                               restored)
+                self._updateIn(conn, "File", "onDisk = 0", "fileId", missing)
+                self._executeBatches(
+                    conn, "UPDATE File SET modTime = %s WHERE fileId = %s",
+                    backfill)
+                self._updateFileCount(conn, repoId, len(restored) - len(missing))
+
+        toParse.sort()
+        fileAccess = (accessibility if accessibility in ("public", "private")
+                      else "private")
+        for batch in batches(parseFitsFiles(rootDir, toParse, workers),
+                             filesPerBatch):
+            added = []
+            updated = []
+            nBack = 0 # changed files that were not on disk
+            for (path, info, error) in batch:
+                if info is None or len(path) > _MAX_FILE_NAME:
+                    self._log.warning("Skipping %s: %s", path,
+                                      error or "path too long")
+                    stats["failed"] += 1
+                elif path in changed:
+                    (fileId, onDisk) = changed[path]
+                    updated.append((fileId, info))
+                    nBack += (0 if onDisk else 1)
+                else:
+                    added.append((path, info))
+            with conn.begin():
+                self._storeFitsFiles(conn, repoId, added, fileAccess)
+                self._updateFitsFiles(conn, updated)
+                self._updateFileCount(conn, repoId, len(added) + nBack)
+            stats["added"] += len(added)
+            stats["updated"] += len(updated)
+            for (x, info) in added + updated:
+                stats["hdus"] += info.hdus
+                stats["structured"] += len(info.structured)
+                stats["keywords"] += len(info.keywords)
+            self._log.debug("Loaded %d files", stats["added"] + stats["updated"])
+        stats["indexed"] = self._indexFitsMeta(conn, repoId)
+        return stats
+
+    def _indexFitsMeta(self, conn, repoId):
+        """
+        Compute FitsStructuredMeta.healpixId of rows of repo repoId ingested
+        before it existed (see sql/migrations/004_fitsHealpixId.sql).
+
+        @return number of rows updated
+        """
+        rows = conn.execute(
+            "SELECT fileId, hdu, ra, decl FROM FitsStructuredMeta "
+            "JOIN File USING (fileId) WHERE fRepoId = %s AND healpixId IS NULL",
+            (repoId,)).fetchall()
+        if not rows:
+            return 0
+        pixels = healpix.ang2pix(healpix.ORDER, [r[2] for r in rows],
+                                 [r[3] for r in rows]).tolist()
+        with conn.begin():
+            self._executeBatches(
+                conn, "UPDATE FitsStructuredMeta SET healpixId = %s "
+                "WHERE fileId = %s AND hdu = %s",
+                [(pixel, r[0], r[1]) for (r, pixel) in zip(rows, pixels)])
+        return len(rows)
+
+    def _updateFileCount(self, conn, repoId, delta):
+        if delta:
+            conn.execute("UPDATE FileRepoTypes SET fileCount = fileCount + %s "
+                         "WHERE fRepoId = %s AND fileType = 'fits'",
+                         (delta, repoId))
+
+    def _storeFitsFiles(self, conn, repoId, files, accessibility):
+        """
+        Insert File rows of files through one executemany, resolve their ids
+        with one query per batchSize files, then insert their FITS metadata
+        (see _storeFitsMeta).
+
+        @param conn           connection to the metaserv database
+        @param repoId         id of the file repo the files belong to
+        @param files          list of (path relative to the repo root,
+                              fitsHeader.FitsFileInfo)
+        @param accessibility  accessibility of the files (public/private)
+        """
+        if not files:
+            return
+        now = _datetime(time.time())
+        cmd = "INSERT INTO File(fRepoId, fileName, url, createTime, ingestTime, "
+        cmd += "modTime, size, availability, accessibility, onDisk) "
+        cmd += "VALUES(%s, %s, %s, %s, %s, %s, %s, 'published', %s, %s)"
+        conn.execute(cmd, [
+            (repoId, path, info.path, _datetime(info.mtime), now, info.mtime,
+             info.size, accessibility, ON_DISK) for (path, info) in files])
+        fileIds = {}
+        for names in self._chunks(path for (path, info) in files):
+            fileIds.update(conn.execute(
+                "SELECT fileName, fileId FROM File WHERE fRepoId = %%s "
+                "AND fileName IN (%s)" % ", ".join(["%s"] * len(names)),
+                [repoId] + names).fetchall())
+        self._storeFitsMeta(conn, [(fileIds[path], info) for (path, info) in files])
+
+    def _updateFitsFiles(self, conn, files):
+        """
+        Update File rows of files that changed on disk (the checksum is reset),
+        and replace their FITS metadata.
+
+        @param files  list of (fileId, fitsHeader.FitsFileInfo)
+        """
+        if not files:
+            return
+        fileIds = [fileId for (fileId, info) in files]
+        for table in ("FitsMeta", "FitsStructuredMeta", "FitsUnstructuredMeta"):
+            self._deleteIn(conn, table, "fileId", fileIds)
+        now = _datetime(time.time())
+        self._executeBatches(
+            conn, "UPDATE File SET createTime = %s, ingestTime = %s, "
+            "modTime = %s, size = %s, checksum = NULL, onDisk = %s "
+            "WHERE fileId = %s",
+            [(_datetime(info.mtime), now, info.mtime, info.size, ON_DISK, fileId)
+             for (fileId, info) in files])
+        self._storeFitsMeta(conn, files)
+
+    def _storeFitsMeta(self, conn, files):
+        """
+        Insert FitsMeta, FitsStructuredMeta and FitsUnstructuredMeta rows of
+        files, through executemany. FitsStructuredMeta.healpixId is computed
+        for all rows at once.
+
+        @param files  list of (fileId, fitsHeader.FitsFileInfo)
+        """
+        self._executeBatches(
+            conn, "INSERT INTO FitsMeta(fileId, hdus) VALUES(%s, %s)",
+            [(fileId, info.hdus) for (fileId, info) in files])
+        structured = [(fileId,) + row for (fileId, info) in files
+                      for row in info.structured]
+        if structured:
+            pixels = healpix.ang2pix(healpix.ORDER, [r[3] for r in structured],
+                                     [r[4] for r in structured]).tolist()
+            self._executeBatches(
+                conn, "INSERT INTO FitsStructuredMeta(fileId, hdu, equinox, ra, "
+                "decl, rotAng, obsStart, expMidpt, expTime, healpixId) "
+                "VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (row + (pixel,) for (row, pixel) in zip(structured, pixels)))
+        self._executeBatches(
+            conn, "INSERT INTO FitsUnstructuredMeta(fileId, fitsKey, hdu, "
+            "stringValue, intValue, doubleValue) "
+            "VALUES(%s, %s, %s, %s, %s, %s)",
+            ((fileId,) + row for (fileId, info) in files
+             for row in info.keywords))
 
     def addUser(self, muName, fName, lName, affil, email):
         """
@@ -235,14 +1065,38 @@ class MetaAdminImpl(object):
         @param affil  short name of the affilliation (home institution)
         @param email  email address
         """
-        conn = getEngineFromFile(self._msMysqlAuthF).connect()
-        cmd = "SELECT instId FROM Institution WHERE instName = %s"
-        instId = conn.execute(cmd, (affil,)).scalar()
-        if instId is None:
-            raise MetaBException(MetaBException.INST_NOT_FOUND, affil)
-        cmd = "INSERT INTO User(mysqlUserName, firstName, lastName, email, instId) "
-        cmd += "VALUES(%s, %s, %s, %s, %s)"
-        conn.execute(cmd, (muName, fName, lName, email, instId))
+        self.addUsers([(muName, fName, lName, affil, email)])
+
+    def addUsers(self, users):
+        """
+        Add users, in one transaction, inserting up to batchSize users per
+        statement.
+
+        @param users  iterable of (muName, fName, lName, affil, email), see
+                      addUser
+
+        Raises MetaBException INST_NOT_FOUND if the affiliation of a user is not
+        known, nothing is added then.
+        """
+        users = list(users)
+        if not users:
+            return
+        with self._msConnect() as conn:
+            with conn.begin():
+                instIds = {}
+                for names in self._chunks(set(u[3] for u in users)):
+                    instIds.update(conn.execute(
+                        "SELECT instName, instId FROM Institution WHERE instName IN "
+                        "(%s)" % ", ".join(["%s"] * len(names)), names).fetchall())
+                for u in users:
+                    if u[3] not in instIds:
+                        raise MetaBException(MetaBException.INST_NOT_FOUND, u[3])
+                cmd = "INSERT INTO User(mysqlUserName, firstName, lastName, "
+                cmd += "email, instId) VALUES(%s, %s, %s, %s, %s)"
+                self._executeBatches(conn, cmd, [
+                    (muName, fName, lName, email, instIds[affil])
+                    for (muName, fName, lName, affil, email) in users])
+            self._catalogChanged(conn)
 
     def addInstitution(self, name):
         """
@@ -250,12 +1104,39 @@ class MetaAdminImpl(object):
 
         @param name  the name
         """
-        conn = getEngineFromFile(self._msMysqlAuthF).connect()
-        ret = conn.execute(
-            "SELECT COUNT(*) FROM Institution WHERE instName=%s", (name,))
-        if ret.scalar() == 1:
-            raise MetaBException(MetaBException.INST_EXISTS, name)
-        conn.execute("INSERT INTO Institution(instName) VALUES(%s)", (name,))
+        self.addInstitutions([name])
+
+    def addInstitutions(self, names):
+        """
+        Add institutions, in one transaction, inserting up to batchSize
+        institutions per statement.
+
+        @param names  iterable of names
+
+        Raises MetaBException INST_EXISTS if an institution already exists (or is
+        listed twice), nothing is added then.
+        """
+        names = list(names)
+        if not names:
+            return
+        seen = set()
+        for n in names:
+            if n in seen:
+                raise MetaBException(MetaBException.INST_EXISTS, n)
+            seen.add(n)
+        with self._msConnect() as conn:
+            with conn.begin():
+                for chunk in self._chunks(names):
+                    existing = [row[0] for row in conn.execute(
+                        "SELECT instName FROM Institution WHERE instName IN (%s)" %
+                        ", ".join(["%s"] * len(chunk)), chunk)]
+                    if existing:
+                        raise MetaBException(MetaBException.INST_EXISTS,
+                                             ", ".join(existing))
+                self._executeBatches(conn,
+                                     "INSERT INTO Institution(instName) VALUES(%s)",
+                                     [(n,) for n in names])
+            self._catalogChanged(conn)
 
     def addProject(self, name):
         """
@@ -263,9 +1144,58 @@ class MetaAdminImpl(object):
 
         @param name  the name
         """
-        conn = getEngineFromFile(self._msMysqlAuthF).connect()
-        ret = conn.execute(
-            "SELECT COUNT(*) FROM Project WHERE projectName=%s", (name,))
-        if ret.scalar() == 1:
-            raise MetaBException(MetaBException.PROJECT_EXISTS, name)
-        conn.execute("INSERT INTO Project(projectName) VALUES(%s)", (name,))
+        with self._msConnect() as conn:
+            ret = conn.execute(
+                "SELECT COUNT(*) FROM Project WHERE projectName=%s", (name,))
+            if ret.scalar() == 1:
+                raise MetaBException(MetaBException.PROJECT_EXISTS, name)
+            conn.execute("INSERT INTO Project(projectName) VALUES(%s)", (name,))
+            self._catalogChanged(conn)
+
+    def _catalogChanged(self, conn, dbName=None):
+        """
+        Bump the catalog generation number (this invalidates ETags and cached
+        responses of all metaserv RESTful servers), and drop responses cached
+        in this process.
+
+        @param conn    connection to the metaserv database
+        @param dbName  name of the database that changed, None if the change is
+                       not specific to one database
+        """
+        conn.execute("UPDATE CatalogGeneration SET generation = generation + 1")
+        invalidateAll(dbName)
+
+
+# File.onDisk of files found on disk: on spinning disk, see sql/fileRepo.sql
+ON_DISK = 0x4
+
+_MAX_FILE_NAME = 255 # File.fileName is a VARCHAR(255)
+
+_INSERT_COLUMN = "INSERT INTO DDT_Column(columnName, tableId, ordinalPosition, " \
+                 "descr, ucd, units) VALUES(%s, %s, %s, %s, %s, %s)"
+
+
+def _datetime(t):
+    """
+    Return time t (seconds since the epoch) as a DATETIME value.
+    """
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _columnValues(c):
+    """
+    Return (ordinalPosition, descr, ucd, units) of a column stored in DDT_Column.
+    """
+    return (c.ord_pos, c.description or "", c.ucd or "", c.unit or "")
+
+
+def _tableHash(t):
+    """
+    Return content hash of a table (see DDT_Table.contentHash): SHA-1 of its
+    description and of the stored values of all its columns.
+    """
+    h = hashlib.sha1()
+    h.update(repr(t.description or ""))
+    for c in t.columns:
+        h.update(repr((c.name,) + _columnValues(c)))
+    return h.hexdigest()
@@ -41,5 +41,13 @@ MetaBException = produceExceptionClass('MetaBException', [
     (3045, "PROJECT_NOT_FOUND", "Project not found."),
     (3050, "INST_EXISTS",       "Institution already exists.."),
     (3055, "INST_NOT_FOUND",    "Institution not found."),
+    (3060, "DB_NOT_REGISTERED", "Database not registered in metaserv."),
+    (3065, "BAD_MANIFEST",      "Invalid manifest file."),
+    (3070, "NOT_ALL_ADDED",     "Some databases from the manifest were not added."),
+    (3075, "BAD_FITS",          "Invalid FITS file."),
+    (3080, "DIR_NOT_FOUND",     "Directory not found."),
+    (3085, "FILEREPO_EXISTS",   "File repository already registered."),
+    (3090, "FILEREPO_UNKNOWN",  "File repository not registered in metaserv."),
+    (3095, "BAD_ALGORITHM",     "Unsupported checksum algorithm."),
     (9998, "NOT_IMPLEMENTED",   "Feature not implemented yet."),
     (9999, "INTERNAL",          "Internal error.")])
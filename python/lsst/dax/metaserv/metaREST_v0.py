@@ -23,19 +23,92 @@ This module implements the RESTful interface for Metadata Service.
 Corresponding URI: /meta. Default output format is json. Currently
 supported formats: json and html.
 
+Rendered responses are cached in-process (see resultCache). The cache is
+configured through the Flask application config:
+  metaserv_cache_size  maximum number of cached responses (default 1024,
+                       0 disables caching)
+  metaserv_cache_ttl   time-to-live of a cached response, in seconds
+                       (default 300)
+
+Responses carry a strong ETag derived from the catalog generation number,
+and conditional requests (If-None-Match) are answered with 304 before any
+query runs. Responses read from the data servers themselves (table listings
+from information_schema, table schemas) depend on the live schema rather
+than on the catalog: they are neither cached nor given an ETag. The
+generation number is polled from the CatalogGeneration table at most once
+per metaserv_generation_poll seconds (default 5).
+
+Vector results with more than metaserv_stream_threshold rows (default 10000,
+0 disables streaming) are not buffered: rows are read through a server-side
+cursor and the response is sent incrementally, using chunked transfer.
+
+Listings support keyset pagination: ?limit=<n> returns at most n rows
+(metaserv_page_max, default 1000, is the maximum), and the envelope then
+contains "next": the url of the following page (an opaque ?after= cursor),
+or null for the last page. ?after= alone uses metaserv_page_size (default
+100) rows per page.
+
+Batch requests (POST) accept at most metaserv_batch_max_items items
+(default 1000).
+
+File repositories (/image/<level>) and their files (/image/<level>/<repo>/files)
+are always paginated, and ?fields= selects the fields listed. Listing files
+reads one range of an index per page, whatever the size of the repository.
+
+Searches of images (/image/<level>/<repo>/search) by position use the
+HEALPix index of FitsStructuredMeta (see healpix); the radius of the cone is at
+most metaserv_search_max_radius degrees (default 10). Searches are always
+paginated. Searches of files by FITS keywords (/image/<level>/<repo>/query) are
+planned by keywordQuery.
+
+Queries about the contents of a database (information_schema, SHOW CREATE
+TABLE) run on the server hosting it (DbRepo.connHost/connPort), through pooled
+engines (see engineRegistry) configured by:
+  metaserv_pool_size         connections kept open per server (default 5)
+  metaserv_pool_max_overflow connections allowed above pool size (default 10)
+  metaserv_pool_recycle      connections are reopened after that many
+                             seconds (default 3600)
+  metaserv_pool_pre_ping     check connections on checkout (default True)
+  metaserv_pool_max_idle     engines unused for that many seconds are
+                             disposed (default 600)
+
+Request metrics (see metrics) are exposed in the Prometheus text format by
+/metrics: per route request counts, latency (total, and per phase: db,
+serialize, render), errors per exception type and response sizes, and the
+time taken to get pooled connections to the servers hosting databases. The
+pool of the default engine is timed if it is created with
+metrics.timedPool (see bin/metaServer.py), observing into the Metrics
+object stored in the application extensions as "metaserv_metrics".
+
 @author  Jacek Becla, SLAC
 @author Brian Van Klaveren, SLAC
 """
 
-from flask import Blueprint, request, current_app, make_response
+from flask import Blueprint, request, current_app, g, make_response, url_for
 from lsst.dax.webservcommon import renderJsonResponse
 
-from httplib import OK, NOT_FOUND, INTERNAL_SERVER_ERROR
+import base64
+import cgi
+import datetime
+import decimal
+import functools
+from httplib import OK, BAD_REQUEST, NOT_FOUND, NOT_MODIFIED, INTERNAL_SERVER_ERROR
+import hashlib
+from itertools import chain, islice
 import json
 import logging as log
 import re
+import sqlalchemy
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+import time
+
+from .engineRegistry import EngineRegistry
+from . import healpix
+from . import keywordQuery
+from . import metrics
+from .resultCache import GenerationTracker, ResultCache
 
 SAFE_NAME_REGEX = r'[a-zA-Z0-9_]+$'
 SAFE_SCHEMA_PATTERN = re.compile(SAFE_NAME_REGEX)
@@ -44,6 +117,35 @@ SAFE_TABLE_PATTERN = re.compile(SAFE_NAME_REGEX)
 metaREST = Blueprint('metaREST', __name__, template_folder="templates")
 
 
+# Context locals (g, request) are accessed as few times as possible, each
+# access costs about as much as recording the request.
+
+@metaREST.before_request
+def _startRequest():
+    g.metaservRequest = _RequestMetrics(time.time())
+
+
+@metaREST.after_request
+def _endRequest(response):
+    state = g.pop("metaservRequest", None)
+    if state is not None:
+        req = request._get_current_object()
+        rule = req.url_rule
+        # streamed bodies are measured once sent, see _streamResponse
+        nBytes = None if response.is_streamed else response.calculate_content_length()
+        _metrics().observeRequest(rule.rule if rule is not None else "unmatched",
+                                  req.method, response.status_code,
+                                  time.time() - state.start, state.phases, nBytes,
+                                  state.errors)
+    return response
+
+
+@metaREST.teardown_request
+def _failedRequest(exc):
+    if exc is not None:
+        _metrics().countError(_route(), type(exc).__name__)
+
+
 @metaREST.route('/', methods=['GET'])
 def getRoot():
     fmt = request.accept_mimetypes.best_match(['application/json', 'text/html'])
@@ -79,7 +181,8 @@ def getDbPerTypeDbName(lsstLevel, dbName):
 def getDbPerTypeDbNameTables(lsstLevel, dbName):
     '''Lists table names in a given database.'''
     query = "SELECT table_name FROM information_schema.tables WHERE table_schema=:dbName"
-    return _resultsOf(text(query), paramMap={"dbName": dbName})
+    return _listingOf(query, "table_name", basestring, {"dbName": dbName},
+                      sourceDb=dbName)
 
 
 @metaREST.route('/db/<string:lsstLevel>/<string:dbName>/tables/'
@@ -92,6 +195,18 @@ def getDbPerTypeDbNameTablesTableName(lsstLevel, dbName, tableName):
     return _resultsOf(text(query), paramMap={"dbName": dbName, "tableName": tableName}, scalar=True)
 
 
+@metaREST.route('/db/<string:lsstLevel>/<string:dbName>/' +
+                'tables/<string:tableName>/columns', methods=['GET'])
+def getDbPerTypeDbNameTablesTableNameColumns(lsstLevel, dbName, tableName):
+    '''Lists columns of a table from a given database.'''
+    query = "SELECT columnId, columnName, ordinalPosition, descr, ucd, units, " \
+            "SUI_displayPrec, SUI_displayCol FROM DDT_Column " \
+            "JOIN DDT_Table USING (tableId) JOIN DbRepo USING (dbRepoId) " \
+            "WHERE dbName=:dbName AND tableName=:tableName"
+    return _listingOf(query, "columnId", (int, long),
+                      {"dbName": dbName, "tableName": tableName})
+
+
 @metaREST.route('/db/<string:lsstLevel>/<string:dbName>/' +
                 'tables/<string:tableName>/schema', methods=['GET'])
 def getDbPerTypeDbNameTablesTableNameSchema(lsstLevel, dbName, tableName):
@@ -99,15 +214,577 @@ def getDbPerTypeDbNameTablesTableNameSchema(lsstLevel, dbName, tableName):
     # Scalar
     if SAFE_SCHEMA_PATTERN.match(dbName) and SAFE_TABLE_PATTERN.match(tableName):
         query = "SHOW CREATE TABLE %s.%s" % (dbName, tableName)
-        return _resultsOf(query, scalar=True)
+        return _resultsOf(query, scalar=True, dbName=dbName, sourceDb=dbName)
     return _response(_error("ValueError", "Database name or Table name is not safe"), 400)
 
 
+@metaREST.route('/db/<string:lsstLevel>/<string:dbName>/describe', methods=['GET'])
+def getDbPerTypeDbNameDescribe(lsstLevel, dbName):
+    '''Retrieves description of all tables of a given database, with their columns.'''
+    tableQuery = text(
+        "SELECT %s FROM DDT_Table JOIN DbRepo USING (dbRepoId) "
+        "WHERE dbName=:dbName ORDER BY tableId" % ", ".join(_DESCR_TABLE_FIELDS))
+    columnQuery = text(
+        "SELECT %s FROM DDT_Column JOIN DDT_Table USING (tableId) "
+        "JOIN DbRepo USING (dbRepoId) WHERE dbName=:dbName "
+        "ORDER BY tableId, ordinalPosition" % ", ".join(_DESCR_COLUMN_FIELDS))
+
+    def produce(engine, threshold):
+        tables = engine.execute(_streamed(tableQuery, threshold), dbName=dbName)
+        columns = engine.execute(_streamed(columnQuery, threshold), dbName=dbName)
+        return _vectorOf(_nestColumns(tables, columns), threshold, [tables, columns])
+
+    return _respond((str(tableQuery), str(columnQuery), dbName), produce, dbName)
+
+
+_DESCR_TABLE_FIELDS = ("tableId", "tableName", "descr")
+_DESCR_COLUMN_FIELDS = ("tableId", "columnId", "columnName", "ordinalPosition",
+                        "descr", "ucd", "units", "SUI_displayPrec", "SUI_displayCol")
+
+
+def _nestColumns(tables, columns):
+    """
+    Generate one dictionary per table row, with the list of dictionaries of its
+    column rows under "columns". Both tables and columns must be ordered by
+    tableId, so they are merged in one pass.
+    """
+    columns = iter(columns)
+    column = next(columns, None)
+    for table in tables:
+        table = dict(zip(_DESCR_TABLE_FIELDS, table))
+        tableId = table["tableId"]
+        table["columns"] = tableColumns = []
+        while column is not None and column[0] <= tableId:
+            if column[0] == tableId:
+                tableColumns.append(dict(zip(_DESCR_COLUMN_FIELDS[1:], column[1:])))
+            column = next(columns, None)
+        yield table
+
+
+@metaREST.route('/batch/tables', methods=['POST'])
+def postBatchTables():
+    '''Retrieves information about many tables, possibly from different databases.
+
+    The request body is json: {"tables": [[<dbName>, <tableName>], ...]}, items
+    can also be given as {"dbName": <dbName>, "tableName": <tableName>}. The
+    response contains one item per requested table, in the same order, with
+    either "result" (as for /db/<lsstLevel>/<dbName>/tables/<tableName>) or
+    "error".'''
+    body = request.get_json(force=True, silent=True)
+    items = body.get("tables") if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return _response(_error("ValueError", "Expected {\"tables\": [...]}"),
+                         BAD_REQUEST)
+    maxItems = current_app.config.get("metaserv_batch_max_items", 1000)
+    if len(items) > maxItems:
+        return _response(_error("ValueError", "Too many items (%d), the limit "
+                                "is %d" % (len(items), maxItems)), BAD_REQUEST)
+    refs = [_tableRef(item) for item in items]
+
+    # One query per chunk of (dbName, tableName) pairs, whatever the number
+    # of databases: pairs are joined as a derived table. Rows carry the pair
+    # as requested, names may match with another case under the collation
+    pairs = sorted(set(ref for ref in refs if ref is not None))
+    found = {}
+    start = time.time()
+    try:
+        engine = current_app.config["default_engine"]
+        for i in range(0, len(pairs), _BATCH_CHUNK):
+            chunk = pairs[i:i + _BATCH_CHUNK]
+            params = {}
+            selects = []
+            for (j, (dbName, tableName)) in enumerate(chunk):
+                params["d%d" % j] = dbName
+                params["t%d" % j] = tableName
+                selects.append("SELECT :d%d AS dbName, :t%d AS tableName" % (j, j))
+            query = "SELECT Requested.dbName, Requested.tableName, DDT_Table.* " \
+                    "FROM (%s) AS Requested " \
+                    "JOIN DbRepo ON (DbRepo.dbName = Requested.dbName) " \
+                    "JOIN DDT_Table ON (DDT_Table.dbRepoId = DbRepo.dbRepoId " \
+                    "AND DDT_Table.tableName = Requested.tableName)" % \
+                    " UNION ALL ".join(selects)
+            for row in engine.execute(text(query), **params):
+                found[(row[0], row[1])] = list(row)[2:]
+    except SQLAlchemyError as e:
+        log.debug("Encountered an error processing request: '%s'" % e.message)
+        return _response(_error(type(e).__name__, e.message), INTERNAL_SERVER_ERROR)
+    finally:
+        _observePhase("db", time.time() - start)
+
+    results = []
+    for (item, ref) in zip(items, refs):
+        if ref is None:
+            results.append({"error": _error("ValueError", "Expected [<dbName>, "
+                                            "<tableName>], got %s" % json.dumps(item))})
+        elif ref in found:
+            results.append({"dbName": ref[0], "tableName": ref[1],
+                            "result": found[ref]})
+        else:
+            results.append({"dbName": ref[0], "tableName": ref[1],
+                            "error": _error("NotFound", "Table not found")})
+    return _response(_vector(results), OK)
+
+
+_BATCH_CHUNK = 500 # (dbName, tableName) pairs per query
+
+
+def _tableRef(item):
+    """
+    Return (dbName, tableName) for a batch item, None if the item is not valid.
+    """
+    if isinstance(item, dict):
+        item = (item.get("dbName"), item.get("tableName"))
+    if not isinstance(item, (list, tuple)) or len(item) != 2:
+        return None
+    if not all(isinstance(name, basestring) for name in item):
+        return None
+    return tuple(item)
+
+
+@metaREST.route('/cache', methods=['GET'])
+def getCache():
+    '''Retrieves response cache counters.'''
+    cache = _cache()
+    stats = cache.stats() if cache is not None else {"maxSize": 0}
+    return _response(_scalar(stats), OK)
+
+
+@metaREST.route('/metrics', methods=['GET'])
+def getMetrics():
+    '''Retrieves request metrics, in the Prometheus text format.'''
+    return make_response(_metrics().render(), OK,
+                         {"Content-Type": metrics.CONTENT_TYPE})
+
+
 @metaREST.route('/image', methods=['GET'])
 def getImage():
-    return "meta/.../image not implemented. I am supposed to print list of " \
-           "supported image types here, something like: raw, template, coadd, " \
-           "jpeg, calexp, ... etc"
+    '''Lists types of file repositories (that have at least one repository).'''
+    query = "SELECT DISTINCT lsstLevel FROM Repo WHERE repoType = 'file'"
+    return _listingOf(query, "lsstLevel", basestring, {})
+
+
+@metaREST.route('/image/<string:lsstLevel>', methods=['GET'])
+def getImagePerType(lsstLevel):
+    '''Lists file repositories of a given type, ordered by repoId, in pages (see
+    _pageRequest; the default page size applies if ?limit= is not given).
+
+    ?fields= selects a comma-separated subset of _REPO_FIELDS, all by default.
+    fileCount is the number of files of the repository as maintained by
+    ingestion (FileRepoTypes.fileCount), files are not counted.'''
+    try:
+        fields = _fieldsRequest(_REPO_FIELDS)
+        (limit, after) = _pageRequest(always=True)
+        if after is not None and not isinstance(after, (int, long)):
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    query = "SELECT repoId, %s FROM Repo WHERE repoType = 'file' " \
+            "AND lsstLevel = :lsstLevel" % _selectList(_REPO_FIELDS, fields)
+    paramMap = {"lsstLevel": lsstLevel, "pageLimit": limit + 1}
+    if after is not None:
+        query += " AND repoId > :pageAfter"
+        paramMap["pageAfter"] = after
+    query = text(query + " ORDER BY repoId LIMIT :pageLimit")
+
+    def produce(engine, threshold):
+        rows = engine.execute(query, **paramMap).fetchall()
+        response = _vector([_record(fields, row[1:]) for row in rows[:limit]])
+        response["next"] = None
+        if len(rows) > limit:
+            response["next"] = _nextUrl(rows[limit - 1][0])
+        return response
+
+    # the "next" url of a page depends on the request url
+    key = (str(query), tuple(sorted(paramMap.items())), request.full_path)
+    return _respond(key, produce)
+
+
+@metaREST.route('/image/<string:lsstLevel>/<string:repo>', methods=['GET'])
+def getImagePerTypeRepo(lsstLevel, repo):
+    '''Retrieves information about the file repositories with a given short
+    name (Repo.shortName), normally one. Fields are those of /image/<level>,
+    ?fields= selects them.'''
+    try:
+        fields = _fieldsRequest(_REPO_FIELDS)
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    query = text("SELECT %s FROM Repo WHERE repoType = 'file' "
+                 "AND lsstLevel = :lsstLevel AND shortName = :repo "
+                 "ORDER BY repoId" % _selectList(_REPO_FIELDS, fields))
+
+    def produce(engine, threshold):
+        rows = engine.execute(query, lsstLevel=lsstLevel, repo=repo).fetchall()
+        if not rows:
+            raise _NotFound("File repository not found")
+        return _vector([_record(fields, row) for row in rows])
+
+    return _respond((str(query), lsstLevel, repo), produce)
+
+
+@metaREST.route('/image/<string:lsstLevel>/<string:repo>/files', methods=['GET'])
+def getImagePerTypeRepoFiles(lsstLevel, repo):
+    '''Lists files of a file repository, ordered by name, in pages (see
+    _pageRequest; the default page size applies if ?limit= is not given).
+
+    ?fields= selects a comma-separated subset of _FILE_FIELDS, all by default.
+    A page is read from one range of the (fRepoId, fileName) index of File,
+    so its cost depends neither on the size of the repository nor on the
+    position of the page. Repositories sharing the short name are listed one
+    after the other.'''
+    try:
+        fields = _fieldsRequest(_FILE_FIELDS)
+        (limit, after) = _pageRequest(always=True)
+        if after is not None:
+            after = _filesKey(after)
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    repoQuery = text("SELECT repoId FROM Repo WHERE repoType = 'file' "
+                     "AND lsstLevel = :lsstLevel AND shortName = :repo "
+                     "ORDER BY repoId")
+    query = "SELECT fileName, %s FROM File WHERE fRepoId = :repoId" % \
+            _selectList(_FILE_FIELDS, fields)
+    firstPage = text(query + " ORDER BY fileName LIMIT :pageLimit")
+    nextPage = text(query + " AND fileName > :afterName "
+                    "ORDER BY fileName LIMIT :pageLimit")
+
+    def produce(engine, threshold):
+        repoIds = [row[0] for row in engine.execute(repoQuery, lsstLevel=lsstLevel,
+                                                    repo=repo)]
+        if not repoIds:
+            raise _NotFound("File repository not found")
+        # (repoId, fileName, record) of up to limit+1 files
+        files = []
+        for repoId in repoIds:
+            pageLimit = limit + 1 - len(files)
+            if after is None or repoId > after[0]:
+                rows = engine.execute(firstPage, repoId=repoId, pageLimit=pageLimit)
+            elif repoId == after[0]:
+                rows = engine.execute(nextPage, repoId=repoId, afterName=after[1],
+                                      pageLimit=pageLimit)
+            else:
+                continue
+            files.extend((repoId, row[0], _record(fields, row[1:])) for row in rows)
+            if len(files) > limit:
+                break
+        response = _vector([f[2] for f in files[:limit]])
+        response["next"] = None
+        if len(files) > limit:
+            response["next"] = _nextUrl(list(files[limit - 1][:2]))
+        return response
+
+    key = ("files", lsstLevel, repo, tuple(fields), limit, after,
+           request.full_path)
+    return _respond(key, produce)
+
+
+# name -> SQL expression. Counts of files are maintained by ingestion, the
+# File table is never counted.
+_REPO_FIELDS = (("repoId", "repoId"), ("shortName", "shortName"), ("url", "url"),
+                ("dataRelease", "dataRelease"), ("version", "version"),
+                ("description", "description"), ("createTime", "createTime"),
+                ("ingestTime", "ingestTime"), ("availability", "availability"),
+                ("accessibility", "accessibility"),
+                ("fileCount", "(SELECT SUM(fileCount) FROM FileRepoTypes "
+                              "WHERE FileRepoTypes.fRepoId = Repo.repoId)"))
+_FILE_FIELDS = (("fileId", "fileId"), ("fileName", "fileName"), ("url", "url"),
+                ("checksum", "checksum"), ("size", "size"), ("modTime", "modTime"),
+                ("createTime", "createTime"), ("ingestTime", "ingestTime"),
+                ("availability", "availability"),
+                ("accessibility", "accessibility"), ("onDisk", "onDisk"),
+                ("hdus", "(SELECT hdus FROM FitsMeta "
+                         "WHERE FitsMeta.fileId = File.fileId)"))
+
+
+def _fieldsRequest(available):
+    """
+    Return names of the fields requested through ?fields= (comma-separated),
+    all fields by default. Raise ValueError for unknown fields.
+
+    @param available  sequence of (name, SQL expression)
+    """
+    names = [name for (name, expression) in available]
+    fields = request.args.get("fields")
+    if fields is None:
+        return names
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in names]
+    if unknown or not fields:
+        raise ValueError("Invalid fields: '%s', expected some of: %s" %
+                         (",".join(unknown), ", ".join(names)))
+    return fields
+
+
+def _selectList(available, fields):
+    expressions = dict(available)
+    return ", ".join(expressions[f] for f in fields)
+
+
+def _record(fields, row):
+    return dict((f, _jsonValue(v)) for (f, v) in zip(fields, row))
+
+
+def _jsonValue(value):
+    """
+    Return value, converted to a json-serializable type if needed.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def _filesKey(cursor):
+    """
+    Return (repoId, fileName) decoded from a cursor of a listing of files,
+    raise ValueError if it is not one.
+    """
+    if not (isinstance(cursor, list) and len(cursor) == 2 and
+            isinstance(cursor[0], (int, long)) and
+            isinstance(cursor[1], basestring)):
+        raise ValueError("Invalid cursor")
+    return tuple(cursor)
+
+
+@metaREST.route('/image/<string:lsstLevel>/<string:repo>/search', methods=['GET'])
+def getImageSearch(lsstLevel, repo):
+    '''Searches images of a file repository by position, time and exposure time.
+
+    Filters, all optional, combined:
+      ?ra=&dec=&radius=           cone, in degrees: HDUs whose position
+                                  (FitsStructuredMeta.ra, decl) is within it,
+                                  with their distance to its center
+      ?obsStartMin=&obsStartMax=  start of the exposure (obsStart), as
+                                  YYYY-MM-DD[THH:MM:SS[.ffffff]], inclusive
+      ?expTimeMin=&expTimeMax=    exposure time in seconds, inclusive
+    The response lists HDUs in pages (see _pageRequest; the default page size
+    applies if ?limit= is not given). The repository is identified by its short
+    name (Repo.shortName).
+
+    Pages follow the order of the index answering the search, so that a page
+    is read from consecutive index entries, without sorting matches: HDUs are
+    ordered by healpixId, fileId, hdu for searches with a cone (index on
+    healpixId, fileId, hdu, obsStart, expTime), and by obsStart, fileId, hdu
+    otherwise (index on obsStart, fileId, hdu, expTime). Time filters are
+    checked on index entries in both cases.'''
+    try:
+        cone = _coneRequest()
+        (clauses, paramMap) = _searchFilters()
+        (limit, after) = _pageRequest(always=True)
+        if after is not None:
+            after = _searchKey(after, cone)
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    paramMap.update(lsstLevel=lsstLevel, repo=repo, pageLimit=limit + 1)
+    if cone is not None:
+        # Candidates: a few ranges of the spatial index, exact filter in numpy
+        ranges = healpix.coverCone(*cone)
+        pixels = []
+        for (i, (first, last)) in enumerate(ranges):
+            pixels.append("healpixId BETWEEN :pixFirst%d AND :pixLast%d" % (i, i))
+            paramMap["pixFirst%d" % i] = first
+            paramMap["pixLast%d" % i] = last
+        clauses.append("(%s)" % " OR ".join(pixels))
+    # The sort column is selected last. STRAIGHT_JOIN keeps FitsStructuredMeta
+    # first, read in index order: starting from the (small) Repo table would
+    # sort all matches of the repository for every page.
+    sortColumn = "healpixId" if cone is not None else "obsStart"
+    query = "SELECT STRAIGHT_JOIN %s, %s FROM FitsStructuredMeta " \
+            "JOIN File USING (fileId) JOIN Repo ON (repoId = fRepoId) " \
+            "WHERE repoType = 'file' AND lsstLevel = :lsstLevel " \
+            "AND shortName = :repo AND File.onDisk != 0" % (
+                ", ".join(_SEARCH_FIELDS), sortColumn)
+    query += "".join(" AND " + c for c in clauses)
+    order = " ORDER BY %s, fileId, hdu LIMIT :pageLimit" % sortColumn
+    firstPage = text(query + order)
+    nextPage = text(query + " AND %s >= :afterKey AND (%s > :afterKey OR "
+                    "fileId > :afterFileId OR (fileId = :afterFileId AND "
+                    "hdu > :afterHdu))" % (sortColumn, sortColumn) + order)
+
+    def produce(engine, threshold):
+        # Candidates outside the cone are dropped, read until the page is full
+        found = []
+        key = after
+        while len(found) <= limit:
+            if key is None:
+                rows = list(engine.execute(firstPage, **paramMap))
+            else:
+                rows = list(engine.execute(nextPage, afterKey=key[0],
+                                           afterFileId=key[1], afterHdu=key[2],
+                                           **paramMap))
+            found.extend(_searchResults(rows, cone))
+            if len(rows) <= limit:
+                break
+            key = _searchRowKey(rows[-1])
+        response = _vector([result for (row, result) in found[:limit]])
+        response["next"] = None
+        if len(found) > limit:
+            (key, fileId, hdu) = _searchRowKey(found[limit - 1][0])
+            response["next"] = _nextUrl([_jsonValue(key), fileId, hdu])
+        return response
+
+    # the "next" url of a page depends on the request url
+    key = (str(firstPage), tuple(sorted(paramMap.items())), after,
+           request.full_path)
+    return _respond(key, produce)
+
+
+@metaREST.route('/image/<string:lsstLevel>/<string:repo>/query', methods=['GET'])
+def getImageQuery(lsstLevel, repo):
+    '''Searches files of a file repository by FITS keywords.
+
+    ?where= is a conjunction of keyword predicates, e.g. FILTER='r' AND
+    AIRMASS<1.2 (see keywordQuery). The response lists matching files
+    (fileId, fileName) ordered by fileId, in pages (see _pageRequest; the
+    default page size applies if ?limit= is not given). A page is planned
+    within the repository and after the cursor, and reads matches until it is
+    full, so that its cost does not grow with the position of the page or the
+    size of other repositories.'''
+    try:
+        where = request.args.get("where")
+        if not where:
+            raise ValueError("Missing parameter: where")
+        predicates = keywordQuery.parseQuery(where)
+        (limit, after) = _pageRequest(always=True)
+        if after is not None and not isinstance(after, (int, long)):
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    repoQuery = text("SELECT repoId FROM Repo WHERE repoType = 'file' "
+                     "AND lsstLevel = :lsstLevel AND shortName = :repo")
+    query = "SELECT fileId, fileName FROM File WHERE fileId IN (%s) ORDER BY fileId"
+
+    def produce(engine, threshold):
+        repoIds = [row[0] for row in engine.execute(repoQuery, lsstLevel=lsstLevel,
+                                                    repo=repo)]
+        # up to limit+1 files, the last one telling if there is a next page
+        fileIds = keywordQuery.findFiles(engine, predicates, repoIds, after,
+                                         limit + 1).tolist()
+        results = []
+        if fileIds:
+            results = [list(row) for row in engine.execute(
+                text(query % ", ".join(str(f) for f in fileIds)))]
+        response = _vector(results[:limit])
+        response["next"] = None
+        if len(results) > limit:
+            response["next"] = _nextUrl(results[limit - 1][0])
+        return response
+
+    key = ("query", tuple(predicates), lsstLevel, repo, limit, after,
+           request.full_path)
+    return _respond(key, produce)
+
+
+_SEARCH_FIELDS = ("fileId", "fileName", "hdu", "ra", "decl", "obsStart",
+                  "expTime", "expMidpt")
+
+
+def _coneRequest():
+    """
+    Return (ra, dec, radius), in degrees, requested through ?ra=, ?dec= and
+    ?radius=, None if none of them is given. Raise ValueError for missing or
+    invalid values.
+    """
+    names = ("ra", "dec", "radius")
+    if not any(name in request.args for name in names):
+        return None
+    try:
+        (ra, dec, radius) = [float(request.args[name]) for name in names]
+    except KeyError as e:
+        raise ValueError("Missing parameter: %s" % e.args[0])
+    if not -360 <= ra <= 360:
+        raise ValueError("ra must be between -360 and 360")
+    if not -90 <= dec <= 90:
+        raise ValueError("dec must be between -90 and 90")
+    maxRadius = current_app.config.get("metaserv_search_max_radius", 10)
+    if not 0 < radius <= maxRadius:
+        raise ValueError("radius must be positive, and at most %s" % maxRadius)
+    return (ra, dec, radius)
+
+
+def _searchFilters():
+    """
+    Return (list of SQL conditions, parameters) for the obsStart and expTime
+    filters of a search. Raise ValueError for invalid values.
+    """
+    clauses = []
+    paramMap = {}
+    for (name, column, op, parse) in (
+            ("obsStartMin", "obsStart", ">=", _parseTime),
+            ("obsStartMax", "obsStart", "<=", _parseTime),
+            ("expTimeMin", "expTime", ">=", float),
+            ("expTimeMax", "expTime", "<=", float)):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            paramMap[name] = parse(value)
+        except ValueError:
+            raise ValueError("Invalid %s: %s" % (name, value))
+        clauses.append("%s %s :%s" % (column, op, name))
+    return (clauses, paramMap)
+
+
+def _parseTime(value):
+    """
+    Parse YYYY-MM-DD, YYYY-MM-DDTHH:MM:SS or YYYY-MM-DDTHH:MM:SS.ffffff (a
+    space can replace T).
+    """
+    value = value.strip().replace(" ", "T")
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def _searchKey(cursor, cone):
+    """
+    Return (healpixId or obsStart, fileId, hdu) decoded from a search cursor,
+    healpixId if the search has a cone, raise ValueError if it is not one.
+    """
+    if not (isinstance(cursor, list) and len(cursor) == 3 and
+            all(isinstance(v, (int, long)) for v in cursor[1:])):
+        raise ValueError("Invalid cursor")
+    if cone is not None:
+        if not isinstance(cursor[0], (int, long)):
+            raise ValueError("Invalid cursor")
+        return tuple(cursor)
+    try:
+        return (_parseTime(cursor[0]),) + tuple(cursor[1:])
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def _searchRowKey(row):
+    """
+    Return the sort key (healpixId or obsStart, fileId, hdu) of a search row.
+    """
+    return (row[-1], row[0], row[2])
+
+
+def _searchResults(rows, cone=None):
+    """
+    Return (row, dictionary) of rows (selecting _SEARCH_FIELDS). If cone, a
+    tuple (ra, dec, radius), is given, rows outside of it are dropped, and the
+    others get their "distance" to its center.
+    """
+    if cone is not None and rows:
+        (ra, dec, radius) = cone
+        distances = healpix.angularDistance(ra, dec, [row[3] for row in rows],
+                                            [row[4] for row in rows]).tolist()
+    else:
+        distances = [None] * len(rows)
+    results = []
+    for (row, distance) in zip(rows, distances):
+        if cone is not None and distance > radius:
+            continue
+        result = _record(_SEARCH_FIELDS, row)
+        if cone is not None:
+            result["distance"] = distance
+        results.append((row, result))
+    return results
 
 
 _error = lambda exception, message: {"exception": exception, "message": message}
@@ -115,28 +792,463 @@ _vector = lambda results: {"results": results}
 _scalar = lambda result: {"result": result}
 
 
-def _resultsOf(query, paramMap=None, scalar=False):
-    status_code = OK
-    paramMap = paramMap or {}
+def _listingOf(query, keyColumn, keyType, paramMap, sourceDb=None):
+    """
+    Return the response for a listing, ordered by keyColumn, paginated if
+    requested (see _pageRequest).
+
+    @param query      query text, with a WHERE clause; keyColumn must be unique
+                      within the listing, and selected as the first column
+    @param keyColumn  name of the column used for ordering and as page key
+    @param keyType    type (or tuple of types) of keyColumn values, cursors of
+                      another type are rejected
+    @param sourceDb   see _resultsOf
+    """
     try:
-        engine = current_app.config["default_engine"]
+        page = _pageRequest()
+        if page is not None and page[1] is not None and \
+                not isinstance(page[1], keyType):
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return _response(_error("ValueError", str(e)), BAD_REQUEST)
+    if page is None:
+        return _resultsOf(text(query + " ORDER BY %s" % keyColumn), paramMap,
+                          sourceDb=sourceDb)
+    (limit, after) = page
+    paramMap = dict(paramMap, pageLimit=limit + 1)
+    if after is not None:
+        query += " AND %s > :pageAfter" % keyColumn
+        paramMap["pageAfter"] = after
+    query += " ORDER BY %s LIMIT :pageLimit" % keyColumn
+    return _resultsOf(text(query), paramMap, pageLimit=limit, sourceDb=sourceDb)
+
+
+def _pageRequest(always=False):
+    """
+    Return (limit, after) requested through ?limit= and ?after=, None if
+    pagination was not requested (unless always is set). Raise ValueError for
+    invalid values.
+    """
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    if limit is None and after is None and not always:
+        return None
+    maxLimit = current_app.config.get("metaserv_page_max", 1000)
+    if limit is None:
+        limit = min(current_app.config.get("metaserv_page_size", 100), maxLimit)
+    limit = int(limit)
+    if limit < 1 or limit > maxLimit:
+        raise ValueError("limit must be between 1 and %d" % maxLimit)
+    if after is not None:
+        after = _decodeCursor(after)
+    return (limit, after)
+
+
+def _encodeCursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key)).rstrip('=')
+
+
+def _decodeCursor(cursor):
+    try:
+        cursor = str(cursor)
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+def _nextUrl(key):
+    """
+    Return url of the page following key, for the current request.
+    """
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args["after"] = _encodeCursor(key)
+    return url_for(request.endpoint, **args)
+
+
+def _resultsOf(query, paramMap=None, scalar=False, dbName=None, pageLimit=None,
+               sourceDb=None):
+    """
+    Run the query and return the response, rendered in the negotiated format
+    (see _respond).
+
+    @param dbName     database the query describes, used for cache invalidation.
+                      Defaults to the "dbName" parameter of the query.
+    @param pageLimit  page size, for paginated queries (see _listingOf). The
+                      query should return up to pageLimit+1 rows.
+    @param sourceDb   run the query on the server hosting this database, instead
+                      of the metaserv server
+    """
+    paramMap = paramMap or {}
+
+    def produce(engine, threshold):
         if scalar:
-            result = list(engine.execute(query, **paramMap).first())
-            response = _scalar(result)
+            return _scalar(list(engine.execute(query, **paramMap).first()))
+        if pageLimit is not None:
+            threshold = 0 # the page size is bounded already
+        results = engine.execute(_streamed(query, threshold), **paramMap)
+        response = _vectorOf((list(result) for result in results), threshold,
+                             [results])
+        if pageLimit is not None:
+            head = response["results"]
+            response["next"] = None
+            if len(head) > pageLimit:
+                del head[pageLimit:]
+                response["next"] = _nextUrl(head[-1][0])
+        return response
+
+    # the "next" url of a page depends on the request url
+    key = (str(query), tuple(sorted(paramMap.items())), scalar,
+           pageLimit and request.full_path)
+    return _respond(key, produce, dbName or paramMap.get("dbName"), sourceDb)
+
+
+def _respond(key, produce, dbName=None, sourceDb=None):
+    """
+    Return the response produced by produce(engine, streamThreshold), rendered
+    in the negotiated format. Conditional requests matching the current ETag
+    are answered with 304 without calling produce. Successful responses are
+    served from / saved in the response cache. Large vector results
+    (_Stream, see _vectorOf) are streamed, and not cached.
+
+    Responses produced with sourceDb describe the live contents of a data
+    server (information_schema, SHOW CREATE TABLE), which change without the
+    catalog generation changing: they get no ETag and are not cached.
+
+    @param key      cache key of the response (format and catalog generation
+                    are added here)
+    @param dbName   database the response describes, used for cache invalidation
+    @param sourceDb produce gets engine connected to the server hosting this
+                    database, instead of the metaserv server
+    """
+    status_code = OK
+    fmt = _format()
+    generation = _generation() if sourceDb is None else None
+    etag = _etag(generation, fmt)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return _withETag(make_response('', NOT_MODIFIED), etag)
+    cache = _cache() if sourceDb is None else None
+    if cache is not None:
+        key += (fmt, generation)
+        body = cache.get(key)
+        if body is not None:
+            return _withETag(make_response(body, OK), etag)
+    start = time.time()
+    try:
+        if sourceDb is None:
+            engine = current_app.config["default_engine"]
         else:
-            results = [list(result) for result in engine.execute(query, **paramMap)]
-            response = _vector(results)
+            engine = _engineFor(sourceDb)
+        response = produce(engine,
+                           current_app.config.get("metaserv_stream_threshold", 10000))
+        if isinstance(response, _Stream):
+            return _withETag(
+                _streamResponse(response.items, fmt, response.results), etag)
+    except _NotFound as e:
+        return _response(_error("NotFound", str(e)), NOT_FOUND)
     except SQLAlchemyError as e:
         log.debug("Encountered an error processing request: '%s'" % e.message)
         status_code = INTERNAL_SERVER_ERROR
         response = _error(type(e).__name__, e.message)
-    return _response(response, status_code)
+    finally:
+        _observePhase("db", time.time() - start)
+    body = _render(response, status_code, fmt)
+    if status_code != OK:
+        return make_response(body, status_code)
+    if cache is not None:
+        cache.put(key, body, dbName=dbName)
+    return _withETag(make_response(body, OK), etag)
+
+
+class _NotFound(Exception):
+    """
+    Raised by produce (see _respond) if the requested resource does not exist.
+    """
+
+
+class _Stream(object):
+    """
+    Vector response too large to be buffered.
+    """
+    def __init__(self, items, results):
+        self.items = items
+        self.results = results
+
+
+def _streamed(query, threshold):
+    """
+    Return query set up to be read through a server-side cursor, if results
+    above threshold rows are to be streamed.
+    """
+    if threshold > 0 and hasattr(query, "execution_options"):
+        return query.execution_options(stream_results=True)
+    return query
+
+
+def _vectorOf(items, threshold, results=()):
+    """
+    Return _vector(items), or _Stream if there are more than threshold items
+    (0 disables streaming).
+
+    @param results  query results the items are read from, closed when
+                    a _Stream is done
+    """
+    if threshold > 0:
+        head = list(islice(items, threshold + 1))
+        if len(head) > threshold:
+            return _Stream(chain(head, items), results)
+    else:
+        head = list(items)
+    return _vector(head)
 
 
 def _response(response, status_code):
-    fmt = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return make_response(_render(response, status_code, _format()), status_code)
+
+
+def _format():
+    return request.accept_mimetypes.best_match(['application/json', 'text/html'])
+
+
+def _render(response, status_code, fmt):
+    state = g.get("metaservRequest")
+    if status_code != OK and state is not None and "exception" in response:
+        state.errors.append(response["exception"])
+    start = time.time()
     if fmt == 'text/html':
-        response = renderJsonResponse(response=response, status_code=status_code)
+        body = renderJsonResponse(response=response, status_code=status_code)
+        _observePhase("render", time.time() - start)
     else:
-        response = json.dumps(response)
-    return make_response(response, status_code)
+        body = json.dumps(response)
+        _observePhase("serialize", time.time() - start)
+    return body
+
+
+def _streamResponse(items, fmt, results=()):
+    """
+    Return a response that renders vector items incrementally.
+
+    @param results  query results the items are read from, closed when done
+
+    Reading rows overlaps with rendering them, the time taken is recorded as
+    the serialize (json) or render (html) phase of the request.
+    """
+    (render, phase) = (_streamHtml, "render") if fmt == 'text/html' else \
+                      (_streamJson, "serialize")
+    (requestMetrics, route) = (_metrics(), _route())
+
+    def generate():
+        start = time.time()
+        nBytes = 0
+        try:
+            for chunk in render(items):
+                nBytes += len(chunk)
+                yield chunk
+        except SQLAlchemyError as e:
+            # Headers are gone already, all we can do is to cut the response
+            log.error("Encountered an error streaming response: '%s'" % e.message)
+            requestMetrics.countError(route, type(e).__name__)
+        finally:
+            for r in results:
+                r.close()
+            requestMetrics.observeStream(route, phase, time.time() - start, nBytes)
+
+    return current_app.response_class(generate(), OK)
+
+
+def _streamJson(items, chunkSize=256):
+    """
+    Generate the json representation of _vector(items) in chunks. The output
+    is identical to json.dumps(_vector(items)).
+    """
+    yield '{"results": ['
+    sep = ''
+    chunk = []
+    for item in items:
+        chunk.append(sep + json.dumps(item))
+        sep = ', '
+        if len(chunk) >= chunkSize:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']}')
+    yield ''.join(chunk)
+
+
+def _streamHtml(items, chunkSize=256):
+    """
+    Generate an html table with one row per item, in chunks. Items are lists
+    of values, or dictionaries (keys of the first one are used as a header).
+    """
+    yield '<!DOCTYPE html>\n<html>\n<body>\n<table>\n'
+    keys = None
+    chunk = []
+    for item in items:
+        if isinstance(item, dict):
+            if keys is None:
+                keys = item.keys()
+                chunk.append('<tr>%s</tr>\n' % ''.join(
+                    '<th>%s</th>' % cgi.escape(k) for k in keys))
+            item = [item.get(k) for k in keys]
+        chunk.append('<tr>%s</tr>\n' % ''.join(
+            '<td>%s</td>' % _htmlCell(v) for v in item))
+        if len(chunk) >= chunkSize:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('</table>\n</body>\n</html>\n')
+    yield ''.join(chunk)
+
+
+def _htmlCell(value):
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    elif value is None:
+        value = ''
+    elif not isinstance(value, basestring):
+        value = str(value)
+    return cgi.escape(value)
+
+
+def _cache():
+    """
+    Return the response cache of the current application, None if disabled.
+    """
+    cache = current_app.extensions.get("metaserv_cache")
+    if cache is None:
+        maxSize = current_app.config.get("metaserv_cache_size", 1024)
+        if maxSize <= 0:
+            return None
+        cache = current_app.extensions.setdefault(
+            "metaserv_cache",
+            ResultCache(maxSize, current_app.config.get("metaserv_cache_ttl", 300)))
+    return cache
+
+
+def _engineFor(dbName):
+    """
+    Return engine connected to the server hosting database dbName. The default
+    engine is returned if the database is hosted by the metaserv server, or if
+    its location is not known.
+    """
+    engine = current_app.config["default_engine"]
+    locations = current_app.extensions.get("metaserv_locations")
+    if locations is None:
+        locations = current_app.extensions.setdefault(
+            "metaserv_locations",
+            ResultCache(4096, current_app.config.get("metaserv_cache_ttl", 300)))
+    location = locations.get(dbName)
+    if location is None:
+        row = engine.execute(
+            text("SELECT connHost, connPort FROM DbRepo WHERE dbName=:dbName"),
+            dbName=dbName).first()
+        location = (row[0], row[1]) if row else (None, None)
+        locations.put(dbName, location, dbName=dbName)
+    (host, port) = location
+    if not host or (host == engine.url.host and
+                    (port or 3306) == (engine.url.port or 3306)):
+        return engine
+    registry = current_app.extensions.get("metaserv_engines")
+    if registry is None:
+        config = current_app.config
+        registry = current_app.extensions.setdefault(
+            "metaserv_engines",
+            EngineRegistry(engine.url,
+                           poolSize=config.get("metaserv_pool_size", 5),
+                           maxOverflow=config.get("metaserv_pool_max_overflow", 10),
+                           poolRecycle=config.get("metaserv_pool_recycle", 3600),
+                           prePing=config.get("metaserv_pool_pre_ping", True),
+                           maxIdle=config.get("metaserv_pool_max_idle", 600),
+                           createEngine=functools.partial(_createEngine,
+                                                          _metrics())))
+    return registry.get(host, port)
+
+
+def _createEngine(requestMetrics, url, **kwargs):
+    """
+    Create an engine whose pool reports the time taken by checkouts to
+    requestMetrics.
+    """
+    server = "%s:%s" % (url.host, url.port or 3306)
+    poolClass = metrics.timedPool(
+        QueuePool, functools.partial(requestMetrics.observePoolWait, server))
+    return sqlalchemy.create_engine(url, poolclass=poolClass, **kwargs)
+
+
+def _metrics():
+    """
+    Return the request metrics of the current application.
+    """
+    requestMetrics = current_app.extensions.get("metaserv_metrics")
+    if requestMetrics is None:
+        requestMetrics = current_app.extensions.setdefault("metaserv_metrics",
+                                                           metrics.Metrics())
+    return requestMetrics
+
+
+def _route():
+    """
+    Return the route (url rule) of the current request.
+    """
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _observePhase(phase, seconds):
+    """
+    Add seconds to the time spent by the current request in phase.
+    """
+    state = g.get("metaservRequest")
+    if state is not None:
+        state.phases[phase] = state.phases.get(phase, 0.) + seconds
+
+
+class _RequestMetrics(object):
+    """
+    Observations of the current request, recorded when it ends.
+    """
+    __slots__ = ("start", "phases", "errors")
+
+    def __init__(self, start):
+        self.start = start
+        self.phases = {} # phase -> seconds
+        self.errors = [] # names of exception types
+
+
+def _generation():
+    """
+    Return the current catalog generation number, None if it is not known
+    (e.g., the CatalogGeneration table does not exist).
+    """
+    tracker = current_app.extensions.get("metaserv_generation")
+    if tracker is None:
+        engine = current_app.config["default_engine"]
+
+        def readGeneration():
+            try:
+                row = engine.execute(
+                    text("SELECT generation FROM CatalogGeneration")).first()
+            except SQLAlchemyError as e:
+                log.debug("Can't read catalog generation: '%s'" % e.message)
+                return None
+            return row[0] if row else None
+
+        tracker = current_app.extensions.setdefault(
+            "metaserv_generation",
+            GenerationTracker(readGeneration,
+                              current_app.config.get("metaserv_generation_poll", 5)))
+    return tracker.current()
+
+
+def _etag(generation, fmt):
+    """
+    Return the ETag of the requested resource in a given format, None if the
+    generation number is not known.
+    """
+    if generation is None:
+        return None
+    return hashlib.sha1("%s %s %s" % (generation, fmt, request.full_path)).hexdigest()
+
+
+def _withETag(response, etag):
+    if etag is not None:
+        response.set_etag(etag)
+    return response
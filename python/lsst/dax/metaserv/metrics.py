@@ -0,0 +1,225 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+
+"""
+Request metrics of the RESTful interface, exposed in the Prometheus text
+format (version 0.0.4) by /meta/v0/metrics:
+  metaserv_requests_total               requests, per route, method and status
+  metaserv_request_duration_seconds     latency of requests, per route
+  metaserv_phase_duration_seconds       time spent per route in each phase of
+                                        a request: db (running queries and
+                                        reading results), serialize (json) and
+                                        render (html)
+  metaserv_errors_total                 errors, per route and exception type
+  metaserv_response_bytes               size of response bodies, per route
+  metaserv_pool_checkout_wait_seconds   time taken to get a connection from
+                                        a pool (see timedPool), per server
+
+Observations of a request are recorded at once, under one lock, and
+histograms only increment the count of one bucket: collection costs a few
+microseconds per request. Buckets are cumulated when metrics are rendered.
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = tuple(4 ** i for i in range(4, 14)) # 256 bytes .. 64 MB
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram(object):
+    """
+    Counts of observations per bucket, with their sum.
+    """
+
+    def __init__(self, bounds):
+        """
+        @param bounds  sorted upper bounds (inclusive) of the buckets; larger
+                       observations fall in an implicit +Inf bucket
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """
+        Return [(upper bound as a string, cumulative count)], the last one
+        being ("+Inf", total count).
+        """
+        samples = []
+        total = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            total += count
+            samples.append((repr(float(bound)), total))
+        samples.append(("+Inf", total + self.counts[-1]))
+        return samples
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of request metrics.
+    """
+
+    def __init__(self, latencyBuckets=LATENCY_BUCKETS, sizeBuckets=SIZE_BUCKETS):
+        self._latencyBuckets = latencyBuckets
+        self._sizeBuckets = sizeBuckets
+        self._requests = {}  # (route, method, status) -> count
+        self._durations = {} # (route,) -> Histogram
+        self._phases = {}    # (route, phase) -> Histogram
+        self._errors = {}    # (route, exception) -> count
+        self._sizes = {}     # (route,) -> Histogram
+        self._poolWaits = {} # (server,) -> Histogram
+        self._lock = threading.Lock()
+
+    def observeRequest(self, route, method, status, seconds, phases=None,
+                       nBytes=None, errors=()):
+        """
+        Record a request.
+
+        @param route    route (url rule) of the request
+        @param status   http status code of the response
+        @param seconds  duration of the request
+        @param phases   dictionary: phase -> seconds spent in it
+        @param nBytes   size of the response body, None if not known (streamed)
+        @param errors   names of the exception types reported by the response
+        """
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._durations, (route,),
+                            self._latencyBuckets).observe(seconds)
+            if phases:
+                for (phase, spent) in phases.iteritems():
+                    self._histogram(self._phases, (route, phase),
+                                    self._latencyBuckets).observe(spent)
+            if nBytes is not None:
+                self._histogram(self._sizes, (route,),
+                                self._sizeBuckets).observe(nBytes)
+            for exception in errors:
+                key = (route, exception)
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def observeStream(self, route, phase, seconds, nBytes):
+        """
+        Record the end of a streamed response: time spent producing the body,
+        in phase, and its size.
+        """
+        with self._lock:
+            self._histogram(self._phases, (route, phase),
+                            self._latencyBuckets).observe(seconds)
+            self._histogram(self._sizes, (route,), self._sizeBuckets).observe(nBytes)
+
+    def countError(self, route, exception):
+        with self._lock:
+            key = (route, exception)
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def observePoolWait(self, server, seconds):
+        with self._lock:
+            self._histogram(self._poolWaits, (server,),
+                            self._latencyBuckets).observe(seconds)
+
+    def _histogram(self, histograms, key, bounds):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(bounds)
+        return histogram
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        with self._lock:
+            lines = []
+            _counter(lines, "metaserv_requests_total",
+                     "Requests, per route, method and status.",
+                     ("route", "method", "status"), self._requests)
+            _histograms(lines, "metaserv_request_duration_seconds",
+                        "Latency of requests, per route.",
+                        ("route",), self._durations)
+            _histograms(lines, "metaserv_phase_duration_seconds",
+                        "Time spent in each phase of requests (db, serialize, "
+                        "render), per route.", ("route", "phase"), self._phases)
+            _counter(lines, "metaserv_errors_total",
+                     "Errors, per route and exception type.",
+                     ("route", "exception"), self._errors)
+            _histograms(lines, "metaserv_response_bytes",
+                        "Size of response bodies, per route.",
+                        ("route",), self._sizes)
+            _histograms(lines, "metaserv_pool_checkout_wait_seconds",
+                        "Time taken to get a connection from a pool, per server.",
+                        ("server",), self._poolWaits)
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _counter(lines, name, descr, labels, counts):
+    lines.append("# HELP %s %s" % (name, descr))
+    lines.append("# TYPE %s counter" % name)
+    for (key, count) in sorted(counts.iteritems()):
+        lines.append("%s{%s} %d" % (name, _labels(labels, key), count))
+
+
+def _histograms(lines, name, descr, labels, histograms):
+    lines.append("# HELP %s %s" % (name, descr))
+    lines.append("# TYPE %s histogram" % name)
+    for (key, histogram) in sorted(histograms.iteritems()):
+        prefix = _labels(labels, key)
+        for (bound, count) in histogram.samples():
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, prefix, bound, count))
+        lines.append("%s_sum{%s} %r" % (name, prefix, histogram.sum))
+        lines.append("%s_count{%s} %d" % (name, prefix, sum(histogram.counts)))
+
+
+def _labels(names, values):
+    return ",".join('%s="%s"' % (n, _escape(v)) for (n, v) in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def timedPool(poolClass, observe):
+    """
+    Return a subclass of the SQLAlchemy pool class poolClass (e.g. QueuePool)
+    calling observe(seconds) with the time taken by each checkout to get a
+    connection: waiting for one to be returned, or opening a new one. Use it
+    as the poolclass of create_engine.
+    """
+    class TimedPool(poolClass):
+        def _do_get(self):
+            start = time.time()
+            try:
+                return poolClass._do_get(self)
+            finally:
+                observe(time.time() - start)
+
+    TimedPool.__name__ = "Timed" + poolClass.__name__
+    return TimedPool
+
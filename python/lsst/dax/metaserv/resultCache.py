@@ -0,0 +1,191 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+In-process cache for Metadata Service responses. Catalog metadata changes
+rarely, so the RESTful interface keeps recently rendered responses in a
+size-bounded LRU cache, with entries expiring after a configurable time.
+
+Entries can be tagged with the name of the database they describe, which
+allows writers (MetaAdminImpl) to drop only the entries affected by a change.
+
+Writers running in other processes are detected through the catalog
+generation counter (CatalogGeneration table), which is incremented by every
+write, and polled by GenerationTracker.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+import weakref
+
+# All live caches and trackers, so that writers running in the same process
+# can invalidate them without having to know about the Flask application.
+_caches = weakref.WeakSet()
+_trackers = weakref.WeakSet()
+
+
+class ResultCache(object):
+    """
+    Thread-safe LRU cache with time-to-live. Keeps hit/miss/eviction counters
+    so that the cache can be sized.
+    """
+
+    def __init__(self, maxSize=1024, ttl=300, timer=time.time):
+        """
+        @param maxSize  maximum number of entries kept, 0 disables caching
+        @param ttl      time-to-live of an entry, in seconds
+        @param timer    function returning current time in seconds
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict() # key -> (expiry, dbName, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        _caches.add(self)
+
+    def get(self, key):
+        """
+        Return value cached under key, or None if not cached (or expired).
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < self._timer():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries[key] = entry # move to the most-recently-used end
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, dbName=None):
+        """
+        Cache value under key.
+
+        @param dbName  name of the database the value describes, None if the
+                       value spans the whole catalog (e.g. list of databases)
+        """
+        if self.maxSize <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._timer() + self.ttl, dbName, value)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, dbName=None):
+        """
+        Drop entries affected by a change to database dbName: entries tagged
+        with dbName and catalog-wide entries. If dbName is None, drop everything.
+        """
+        with self._lock:
+            if dbName is None:
+                dropped = list(self._entries)
+            else:
+                dropped = [k for (k, e) in self._entries.iteritems()
+                           if e[1] is None or e[1] == dbName]
+            for k in dropped:
+                del self._entries[k]
+            self.invalidations += len(dropped)
+
+    def clear(self):
+        """
+        Drop all entries, keep counters.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return counters as a dictionary.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries),
+                    "maxSize": self.maxSize,
+                    "ttl": self.ttl,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hitRatio": float(self.hits) / lookups if lookups else 0.0,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations}
+
+
+class GenerationTracker(object):
+    """
+    Keeps the current catalog generation number. The number is re-read at most
+    once per pollInterval seconds, so that it can be consulted on every request.
+    """
+
+    def __init__(self, readFunc, pollInterval=5, timer=time.time):
+        """
+        @param readFunc      function returning the current generation number,
+                             or None if it is not known
+        @param pollInterval  how long a generation number read is trusted,
+                             in seconds
+        @param timer         function returning current time in seconds
+        """
+        self._read = readFunc
+        self.pollInterval = pollInterval
+        self._timer = timer
+        self._generation = None
+        self._expiry = 0
+        self._lock = threading.Lock()
+        _trackers.add(self)
+
+    def current(self):
+        """
+        Return the current generation number, None if it is not known.
+        """
+        with self._lock:
+            now = self._timer()
+            if self._expiry <= now:
+                self._generation = self._read()
+                self._expiry = now + self.pollInterval
+            return self._generation
+
+    def expire(self):
+        """
+        Force re-reading the generation number on the next call to current().
+        """
+        with self._lock:
+            self._expiry = 0
+
+
+def invalidateAll(dbName=None):
+    """
+    Invalidate entries affected by a change to database dbName in every live
+    cache, and force re-reading of the catalog generation number.
+    See ResultCache.invalidate.
+    """
+    for cache in list(_caches):
+        cache.invalidate(dbName)
+    for tracker in list(_trackers):
+        tracker.expire()
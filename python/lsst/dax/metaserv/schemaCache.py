@@ -0,0 +1,157 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+On-disk cache of parsed schema files. The same schema file (e.g.
+baselineSchema.sql) is typically used to describe many databases, the cache
+lets all but the first ADD DBDESCR skip parsing it.
+
+Entries are keyed by the SHA-1 of the (decompressed) file content and by
+schemaToMeta.PARSER_VERSION, and hold the list of parsed tables pickled in
+the binary pickle format. When the total size of the entries exceeds the
+size cap, the least recently used entries are removed.
+"""
+
+import cPickle
+from cStringIO import StringIO
+import errno
+import hashlib
+import logging as log
+import os
+import tempfile
+
+from . import schemaToMeta
+
+
+class SchemaCache(object):
+    """
+    Cache of parsed schema files, kept in a directory. Several processes can
+    share the directory: entries are written to a temporary file and renamed.
+    """
+
+    _SUFFIX = ".pickle"
+
+    def __init__(self, cacheDir, maxSize=256*1024*1024):
+        """
+        @param cacheDir  directory holding the entries, created if needed
+        @param maxSize   maximum total size of the entries, in bytes
+        """
+        self.cacheDir = os.path.expanduser(cacheDir)
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._log = log.getLogger("lsst.metaserv.schemaCache")
+
+    def tables(self, schemaF):
+        """
+        Return the list of schemaToMeta.SchemaTable parsed from file-like object
+        schemaF, loaded from the cache if the same content was parsed before
+        by the same version of the parser. The records returned are not shared,
+        they can be modified.
+        """
+        content = schemaF.read()
+        path = os.path.join(self.cacheDir, self._key(content) + self._SUFFIX)
+        tables = self._load(path)
+        if tables is not None:
+            self.hits += 1
+            return tables
+        self.misses += 1
+        tables = list(schemaToMeta.iterSchema(StringIO(content)))
+        self._store(path, tables)
+        return tables
+
+    def _key(self, content):
+        return "%s-v%d" % (hashlib.sha1(content).hexdigest(),
+                           schemaToMeta.PARSER_VERSION)
+
+    def _load(self, path):
+        """
+        Return entry stored in path, None if there is no such entry, or if it
+        can't be read.
+        """
+        try:
+            with open(path, "rb") as f:
+                tables = cPickle.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                self._log.warning("Can't read cached schema %s: %s", path, e)
+            return None
+        except Exception as e:
+            self._log.warning("Dropping corrupted cached schema %s: %s", path, e)
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, None) # mark as recently used
+        except OSError:
+            pass
+        return tables
+
+    def _store(self, path, tables):
+        """
+        Store entry in path, then enforce the size cap. Failures are logged,
+        they only mean the next parse will not be a hit.
+        """
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            (fd, tmpPath) = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                cPickle.dump(tables, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as e:
+            self._log.warning("Can't cache parsed schema in %s: %s", path, e)
+            return
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used entries until their total size fits maxSize.
+        """
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(self._SUFFIX):
+                path = os.path.join(self.cacheDir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for (mtime, size, path) in sorted(entries):
+            if total <= self.maxSize:
+                break
+            self._remove(path)
+            self.evictions += 1
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        """
+        Return counters as a dictionary.
+        """
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
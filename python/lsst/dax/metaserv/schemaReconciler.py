@@ -0,0 +1,235 @@
+# LSST Data Management System
+# Copyright 2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Reconciliation of a schema parsed from an ascii file (see schemaToMeta) with
+the schema of a database, as described by its information_schema. Every
+mismatch is collected into a SchemaReport, in one pass over the parsed tables:
+both sides are indexed by table and column name, so the cost is linear in the
+number of columns.
+"""
+
+from .metaBException import MetaBException
+
+
+class SchemaReport(object):
+    """
+    Differences between the ascii schema and the database schema. Missing,
+    extra and duplicate tables and columns make the schemas not match; ordinal
+    drift and type mismatches are reported, but do not.
+    """
+
+    def __init__(self):
+        self.nTables = 0          # number of tables in the ascii schema
+        self.nColumns = 0         # number of columns in the ascii schema
+        self.missingTables = []   # in the ascii schema, not in the db
+        self.extraTables = []     # in the db, not in the ascii schema
+        self.duplicateTables = [] # defined more than once in the ascii schema
+        self.missingColumns = []  # (table, column) not in the db
+        self.extraColumns = []    # (table, column) not in the ascii schema
+        self.ordinalDrift = []    # (table, column, position in ascii schema,
+                                  #  ordinal position in db)
+        self.typeMismatches = []  # (table, column, type in ascii schema,
+                                  #  type in db)
+        self._error = None        # first mismatch found: (code, args)
+
+    def matches(self):
+        """
+        Return True if the schemas have the same tables and columns.
+        """
+        return self._error is None
+
+    def error(self):
+        """
+        Return MetaBException describing the first mismatch found, None if the
+        schemas match.
+        """
+        if self._error is None:
+            return None
+        (code, args) = self._error
+        return MetaBException(code, *args)
+
+    def _mismatch(self, code, *args):
+        if self._error is None:
+            self._error = (code, args)
+
+    def asDict(self):
+        """
+        Return the report as a dictionary.
+        """
+        return {"matches": self.matches(),
+                "nTables": self.nTables,
+                "nColumns": self.nColumns,
+                "missingTables": self.missingTables,
+                "extraTables": self.extraTables,
+                "duplicateTables": self.duplicateTables,
+                "missingColumns": self.missingColumns,
+                "extraColumns": self.extraColumns,
+                "ordinalDrift": self.ordinalDrift,
+                "typeMismatches": self.typeMismatches}
+
+    def __str__(self):
+        lines = ["%s: %d tables, %d columns in ascii schema" % (
+            "match" if self.matches() else "MISMATCH", self.nTables,
+            self.nColumns)]
+        for (title, items, fmt) in (
+                ("tables not in db", self.missingTables, "%s"),
+                ("tables not in ascii schema", self.extraTables, "%s"),
+                ("tables defined twice", self.duplicateTables, "%s"),
+                ("columns not in db", self.missingColumns, "%s.%s"),
+                ("columns not in ascii schema", self.extraColumns, "%s.%s"),
+                ("ordinal drift", self.ordinalDrift,
+                 "%s.%s: position %d in ascii schema, %d in db"),
+                ("type mismatches", self.typeMismatches,
+                 "%s.%s: %s in ascii schema, %s in db")):
+            if items:
+                lines.append("%s (%d):" % (title, len(items)))
+                lines.extend("  " + fmt % (item if isinstance(item, tuple)
+                                           else (item,)) for item in items)
+        return "\n".join(lines)
+
+
+class SchemaReconciler(object):
+    """
+    Reconcile parsed tables with the database schema, one table at a time,
+    so that it can be used while parsing is in progress.
+    """
+
+    def __init__(self, dbColumns):
+        """
+        @param dbColumns  database schema: table name -> {column name:
+                          (ordinal position, column type)}, where column type
+                          is information_schema.COLUMNS.column_type
+        """
+        self._dbColumns = dbColumns
+        self._seen = set()
+        self._typesMatch = {} # (type in ascii schema, type in db) -> bool
+        self.report = SchemaReport()
+
+    def check(self, table):
+        """
+        Reconcile one table (schemaToMeta.SchemaTable): set ord_pos of its
+        columns found in the db, and record mismatches in the report.
+
+        @return True if the table has the same columns as in the db
+        """
+        report = self.report
+        name = table.name
+        report.nTables += 1
+        report.nColumns += len(table.columns)
+        if name in self._seen:
+            report.duplicateTables.append(name)
+            report._mismatch(MetaBException.NOT_MATCHING)
+            return False
+        self._seen.add(name)
+        columns = self._dbColumns.get(name)
+        if columns is None:
+            report.missingTables.append(name)
+            report._mismatch(MetaBException.TB_NOT_IN_DB, name)
+            return False
+        ok = True
+        nFound = 0
+        for c in table.columns:
+            dbColumn = columns.get(c.name)
+            if dbColumn is None:
+                report.missingColumns.append((name, c.name))
+                report._mismatch(MetaBException.COL_NOT_IN_TB, c.name, name)
+                ok = False
+                continue
+            nFound += 1
+            (c.ord_pos, dbType) = dbColumn
+            if c.displayOrder != c.ord_pos:
+                report.ordinalDrift.append((name, c.name, c.displayOrder,
+                                            c.ord_pos))
+            if dbType is not None:
+                key = (c.type, dbType)
+                match = self._typesMatch.get(key)
+                if match is None:
+                    match = self._typesMatch[key] = typesMatch(c.type, dbType)
+                if not match:
+                    report.typeMismatches.append((name, c.name, c.type, dbType))
+        if nFound != len(columns):
+            names = set(c.name for c in table.columns)
+            for cName in sorted(columns):
+                if cName not in names:
+                    report.extraColumns.append((name, cName))
+                    report._mismatch(MetaBException.COL_NOT_IN_FL, cName, name)
+            ok = False
+        return ok
+
+    def finish(self):
+        """
+        Record tables of the db that were not checked, return the report.
+        """
+        for name in sorted(self._dbColumns):
+            if name not in self._seen:
+                self.report.extraTables.append(name)
+                self.report._mismatch(MetaBException.NOT_MATCHING)
+        return self.report
+
+
+# Type names equivalent to the name MySQL reports in information_schema.
+_TYPE_ALIASES = {"integer": "int",
+                 "bool": "tinyint",
+                 "boolean": "tinyint",
+                 "real": "double",
+                 "dec": "decimal",
+                 "numeric": "decimal",
+                 "fixed": "decimal"}
+# Types whose parameter is a display width only.
+_INT_TYPES = frozenset(["tinyint", "smallint", "mediumint", "int", "bigint"])
+# Default parameters of types declared without any.
+_DEFAULT_PARAMS = {"char": "1", "binary": "1", "bit": "1", "decimal": "10,0"}
+
+
+def normalizeType(t):
+    """
+    Return column type t in a form that can be compared: lower case, aliases
+    resolved, integer display widths and modifiers (e.g. unsigned) dropped,
+    default parameters made explicit, FLOAT(p) resolved to float or double.
+    Types truncated by the ascii schema parser (e.g. "DECIMAL(10,") are
+    reduced to their name, see typesMatch.
+    """
+    t = t.lower().split()[0] if t.strip() else ""
+    (base, paren, params) = t.partition("(")
+    base = _TYPE_ALIASES.get(base, base)
+    if paren and not params.endswith(")"):
+        return base
+    params = params[:-1]
+    if base in _INT_TYPES:
+        return base
+    if base == "float" and params.isdigit():
+        return "float" if int(params) <= 24 else "double"
+    if not params:
+        params = _DEFAULT_PARAMS.get(base)
+    return "%s(%s)" % (base, params) if params else base
+
+
+def typesMatch(fileType, dbType):
+    """
+    Return True if column type fileType, from the ascii schema, is the same as
+    dbType, from information_schema.COLUMNS.column_type. Only type names are
+    compared if fileType was truncated by the ascii schema parser.
+    """
+    fileType = normalizeType(fileType)
+    dbType = normalizeType(dbType)
+    if "(" not in fileType:
+        dbType = dbType.partition("(")[0]
+    return fileType == dbType
@@ -20,12 +20,6 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 
-
-import os
-import pprint
-import re
-import sys
-
 """
 SchemaToMeta class parses mysql schema file that can optionally contain
 extra tokens in comments. Extracts information for each table:
@@ -45,12 +39,30 @@ way, e.g., it will not parse any sql-compliant structure. A comprehensive
 set of examples can be found in the tests/testSchemaToMeta.py.
 In addition, the cat/sql/baselineSchema.py is a good "template".
 
+iterSchema parses a schema from any file-like object (see also openSchema,
+which handles stdin and gzip/bz2 compressed files), and yields tables one at
+a time, as compact SchemaTable records. parseSchema returns the whole schema
+as nested dictionaries. parseSchemaParallel parses large, or split into many
+files, schemas in a pool of processes.
+
 This code was originally written for schema browser
 (in cat/bin/schema_to_metadata.py).
 """
 
+import bz2
+from contextlib import contextmanager
+import gzip
+import multiprocessing
+import pprint
+import re
+import sys
+
+# Version of the parser output; bump it whenever iterSchema produces something
+# different for the same input, so that cached results (see schemaCache) are
+# not reused.
+PARSER_VERSION = 1
+
 _tableStart = re.compile(r'CREATE TABLE (\w+)')
-_tableEnd = re.compile(r"\)")
 _engineLine = re.compile(r'\)\s*(ENGINE|TYPE)\s*=[\s]*(\w+)\s*;')
 _columnLine = re.compile(r'\s*(\w+)\s+\w+')
 _idxCols = re.compile(r'\((.+?)\)')
@@ -60,66 +72,25 @@ _descrLine = re.compile(r'<descr>(.+)</descr>')
 _descrStart = re.compile(r'<descr>(.+)')
 _descrMiddle = re.compile(r'--(.+)')
 _descrEnd = re.compile(r'--(.*)</descr>')
-_commentLine = re.compile(r'\s*--')
 _defaultLine = re.compile(r'\s+DEFAULT\s+(.+?)[\s,]')
 
 ####################################################################################
 # Helper functions
 ####################################################################################
 
-def _isIndexDefinition(c):
-    return c in ["PRIMARY", "KEY", "INDEX", "UNIQUE"]
-
-def _isCommentLine(theString):
-    return _commentLine.match(theString) is not None
-
-def _isUnitLine(theString):
-    return _unitLine.search(theString) is not None
-
-def _isUcdLine(theString):
-    return _ucdLine.search(theString) is not None
-
-def _retrUnit(theString):
-    return _unitLine.search(theString).group(1)
-
-def _retrUcd(theString):
-    return _ucdLine.search(theString).group(1)
-
-def _containsDescrTagStart(theString):
-    return '<descr>' in theString
-
-def _containsDescrTagEnd(theString):
-    return '</descr>' in theString
-
-def _retrDescr(theString):
-    return _descrLine.search(theString).group(1)
-
-def _retrDescrStart(theString):
-    return _descrStart.search(theString).group(1)
+_indexWords = frozenset(["PRIMARY", "KEY", "INDEX", "UNIQUE"])
 
-def _retrDescrMid(theString):
-    return _descrMiddle.search(theString).group(1)
-
-def _retrDescrEnd(theString):
-    return _descrEnd.search(theString).group(1).rstrip()
-
-def _retrIsNotNull(theString):
-    return 'NOT NULL' in theString
-
-def _retrType(theString):
-    t = theString.split()[1].rstrip(',')
+def _retrType(tokens):
+    t = tokens[1].rstrip(',')
     return "FLOAT" if t == "FLOAT(0)" else t
 
-def _retrDefaultValue(theString):
-    if not _defaultLine.search(theString):
+def _retrDefaultValue(theString, tokens):
+    if 'DEFAULT' not in theString or not _defaultLine.search(theString):
         return None
-    arr = theString.split()
-    returnNext = 0
-    for a in arr:
-        if returnNext:
-            return a.rstrip(',')
-        if a == 'DEFAULT':
-            returnNext = 1
+    i = tokens.index('DEFAULT')
+    if i + 1 < len(tokens):
+        return tokens[i+1].rstrip(',')
+    return None
 
 def _retrIdxColumns(theString):
     colExprs = _idxCols.search(theString).group(1).split(',')
@@ -128,10 +99,141 @@ def _retrIdxColumns(theString):
     return ", ".join(columns)
 
 ####################################################################################
-# The parseSchema function
+# Parsed schema records
+####################################################################################
+
+class SchemaTable(object):
+    """
+    Table parsed from a schema file. Attributes that were not found in the
+    file are None. Records pickle as plain tuples, which keeps cached parsed
+    schemas (see schemaCache) small and fast to load.
+    """
+    __slots__ = ("name", "description", "engine", "columns", "indexes")
+
+    def __init__(self, name):
+        self.name = name
+        self.description = None
+        self.engine = None
+        self.columns = []     # SchemaColumn records, in the file order
+        self.indexes = []     # SchemaIndex records, in the file order
+
+    def __getstate__(self):
+        return (self.name, self.description, self.engine, self.columns,
+                self.indexes)
+
+    def __setstate__(self, state):
+        (self.name, self.description, self.engine, self.columns,
+         self.indexes) = state
+
+    def asDict(self):
+        """
+        Return the table as a dictionary, see parseSchema.
+        """
+        d = {}
+        if self.description is not None:
+            d["description"] = self.description
+        if self.engine is not None:
+            d["engine"] = self.engine
+        if self.columns:
+            d["columns"] = [c.asDict() for c in self.columns]
+        if self.indexes:
+            d["indexes"] = [i.asDict() for i in self.indexes]
+        return d
+
+
+class SchemaColumn(object):
+    """
+    Column parsed from a schema file. Attributes that were not found in the
+    file are None; ord_pos is set by the caller (e.g. from the
+    information_schema).
+    """
+    __slots__ = ("name", "displayOrder", "type", "notNull", "defaultValue",
+                 "description", "unit", "ucd", "ord_pos")
+
+    def __init__(self, name, displayOrder, type, notNull, defaultValue=None):
+        self.name = name
+        self.displayOrder = displayOrder
+        self.type = type
+        self.notNull = notNull
+        self.defaultValue = defaultValue
+        self.description = None
+        self.unit = None
+        self.ucd = None
+        self.ord_pos = None
+
+    def __getstate__(self):
+        return (self.name, self.displayOrder, self.type, self.notNull,
+                self.defaultValue, self.description, self.unit, self.ucd,
+                self.ord_pos)
+
+    def __setstate__(self, state):
+        (self.name, self.displayOrder, self.type, self.notNull,
+         self.defaultValue, self.description, self.unit, self.ucd,
+         self.ord_pos) = state
+
+    def asDict(self):
+        """
+        Return the column as a dictionary, see parseSchema.
+        """
+        d = {"name": self.name,
+             "displayOrder": str(self.displayOrder),
+             "type": self.type,
+             "notNull": self.notNull}
+        for key in ("defaultValue", "description", "unit", "ucd", "ord_pos"):
+            value = getattr(self, key)
+            if value is not None:
+                d[key] = value
+        return d
+
+
+class SchemaIndex(object):
+    """
+    Index parsed from a schema file.
+    """
+    __slots__ = ("type", "columns")
+
+    def __init__(self, type, columns):
+        self.type = type
+        self.columns = columns
+
+    def __getstate__(self):
+        return (self.type, self.columns)
+
+    def __setstate__(self, state):
+        (self.type, self.columns) = state
+
+    def asDict(self):
+        return {"type": self.type, "columns": self.columns}
+
+####################################################################################
+# The parsing functions
 ####################################################################################
 
-def parseSchema(inFName):
+@contextmanager
+def openSchema(fName):
+    """
+    Open schema file fName for reading, decompressing it if its name ends with
+    ".gz" or ".bz2". "-" stands for the standard input, which is not closed
+    on exit.
+
+    Raises IOError if the file can't be opened.
+    """
+    if fName == "-":
+        yield sys.stdin
+        return
+    if fName.endswith(".gz"):
+        f = gzip.open(fName, "rb")
+    elif fName.endswith(".bz2"):
+        f = bz2.BZ2File(fName, "r")
+    else:
+        f = open(fName, "r")
+    try:
+        yield f
+    finally:
+        f.close()
+
+
+def parseSchema(inFile, cache=None):
     """Do actual parsing. Returns the retrieved structure as a table. The
     structure of the produced table:
 { <tableName1>: {
@@ -153,99 +255,253 @@ def parseSchema(inFName):
   }
   # repeated for every table
 }
-"""
 
-    if not os.path.isfile(inFName):
-        sys.stderr.write("File '%s' does not exist\n" % inFName)
-        sys.exit(1)
+    @param inFile  name of the schema file (see openSchema), or a file-like
+                   object
+    @param cache   schemaCache.SchemaCache to load the parsed schema from,
+                   or store it in; None to always parse
 
+    Raises IOError if the file can't be opened.
+"""
+    if isinstance(inFile, basestring):
+        with openSchema(inFile) as f:
+            return parseSchema(f, cache)
+    tables = iterSchema(inFile) if cache is None else cache.tables(inFile)
+    return dict((t.name, t.asDict()) for t in tables)
+
+
+def iterSchema(lines):
+    """
+    Parse schema, yield SchemaTable records, one table at a time: when its
+    definition ends, or when the input ends. A table defined more than once is
+    yielded every time.
+
+    @param lines  file-like object, or any iterable of lines
+
+    This is a single-pass state machine: each line is classified with cheap
+    string tests (is it a comment, does it open/close a table, which tags does
+    it contain), and regular expressions only run on lines that carry the
+    information they extract.
+    """
+    return _iterSchema(lines, _ParseState())
+
+
+class _ParseState(object):
+    """
+    Parser state carried over a table start: whether a multi-line column
+    description is open (the only state not reset when a new table starts).
+    Used to parse chunks of a schema independently, see parseSchemaParallel.
+    """
+    __slots__ = ("colDescr", "dependent", "touched")
+
+    def __init__(self, colDescr=None):
+        self.colDescr = colDescr  # in: at the start, out: at the end of input
+        self.dependent = False    # out: parsing used the initial colDescr
+        self.touched = False      # out: colDescr was set while parsing
+
+    def __getstate__(self):
+        return (self.colDescr, self.dependent, self.touched)
+
+    def __setstate__(self, state):
+        (self.colDescr, self.dependent, self.touched) = state
+
+
+def _iterSchema(lines, state):
+    """
+    Implement iterSchema, starting from state, and recording in it the final
+    state once all lines are parsed.
+    """
     in_table = None
     in_col = None
-    in_colDescr = None
-    table = {}
+    in_colDescr = state.colDescr
+    touched = False
+    dependent = False
 
     colNum = 1
 
-    iF = open(inFName, mode='r')
-    for line in iF:
-        m = _tableStart.search(line)
-        if m is not None and not _isCommentLine(line):
-            tableName = m.group(1)
-            table[tableName] = {}
-            colNum = 1
-            in_table = table[tableName]
-            in_col = None
-        elif _tableEnd.match(line):
+    for line in lines:
+        isComment = line.lstrip().startswith('--')
+        if 'CREATE TABLE' in line and not isComment:
+            m = _tableStart.search(line)
+            if m is not None:
+                if in_table is not None:
+                    yield in_table
+                in_table = SchemaTable(m.group(1))
+                colNum = 1
+                in_col = None
+                continue
+        if line.startswith(')'):
             m = _engineLine.match(line)
             if m is not None:
-                engineName = m.group(2)
-                in_table["engine"] = engineName
+                in_table.engine = m.group(2)
+            if in_table is not None:
+                yield in_table
             in_table = None
-        elif in_table is not None: # process columns for given table
-            m = _columnLine.match(line)
-            if m is not None:
-                firstWord = m.group(1)
-                if _isIndexDefinition(firstWord):
-                    t = "-"
-                    if firstWord == "PRIMARY":
-                        t = "PRIMARY KEY"
-                    elif firstWord == "UNIQUE":
-                        t = "UNIQUE"
-                    idxInfo = {"type" : t,
-                               "columns" : _retrIdxColumns(line)
-                           }
-                    in_table.setdefault("indexes", []).append(idxInfo)
-                else:
-                    in_col = {"name" : firstWord,
-                              "displayOrder" : str(colNum),
-                              "type" : _retrType(line),
-                              "notNull" : _retrIsNotNull(line),
-                    }
-                    dv = _retrDefaultValue(line)
-                    if dv is not None:
-                        in_col["defaultValue"] = dv
-                    colNum += 1
-                    if "columns" not in in_table:
-                        in_table["columns"] = []
-                    in_table["columns"].append(in_col)
-            elif _isCommentLine(line): # handle comments
-                if in_col is None:    # table comment
-
-                    if _containsDescrTagStart(line):
-                        if _containsDescrTagEnd(line):
-                            in_table["description"] = _retrDescr(line)
-                        else:
-                            in_table["description"] = _retrDescrStart(line)
-                    elif "description" in in_table:
-                        if _containsDescrTagEnd(line):
-                            in_table["description"] += _retrDescrEnd(line)
-                        else:
-                            in_table["description"] += _retrDescrMid(line)
+        elif in_table is None:
+            continue
+        elif isComment:
+            if in_col is None:    # table comment
+                if '<descr>' in line:
+                    if '</descr>' in line:
+                        in_table.description = _descrLine.search(line).group(1)
+                    else:
+                        in_table.description = _descrStart.search(line).group(1)
+                elif in_table.description is not None:
+                    if '</descr>' in line:
+                        in_table.description += \
+                            _descrEnd.search(line).group(1).rstrip()
+                    else:
+                        in_table.description += _descrMiddle.search(line).group(1)
+            else:                 # column comment
+                if '<descr>' in line:
+                    if '</descr>' in line:
+                        in_col.description = _descrLine.search(line).group(1)
+                    else:
+                        in_col.description = _descrStart.search(line).group(1)
+                        in_colDescr = 1
+                        touched = True
                 else:
-                                      # column comment
-                    if _containsDescrTagStart(line):
-                        if _containsDescrTagEnd(line):
-                            in_col["description"] = _retrDescr(line)
-                        else:
-                            in_col["description"] = _retrDescrStart(line)
-                            in_colDescr = 1
-                    elif in_colDescr:
-                        if _containsDescrTagEnd(line):
-                            in_col["description"] += _retrDescrEnd(line)
+                    if not touched:
+                        # in_colDescr still holds its value from the start
+                        dependent = True
+                    if in_colDescr:
+                        if '</descr>' in line:
+                            in_col.description += \
+                                _descrEnd.search(line).group(1).rstrip()
                             in_colDescr = None
                         else:
-                            in_col["description"] += _retrDescrMid(line)
-
-                                      # units
-                    if _isUnitLine(line):
-                        in_col["unit"] = _retrUnit(line)
-
-                                      # ucds
-                    if _isUcdLine(line):
-                        in_col["ucd"] = _retrUcd(line)
-
-    iF.close()
-    return table
+                            in_col.description += \
+                                _descrMiddle.search(line).group(1)
+
+                if '<unit>' in line:  # units
+                    m = _unitLine.search(line)
+                    if m is not None:
+                        in_col.unit = m.group(1)
+
+                if '<ucd>' in line:   # ucds
+                    m = _ucdLine.search(line)
+                    if m is not None:
+                        in_col.ucd = m.group(1)
+        else:                     # column or index definition
+            m = _columnLine.match(line)
+            if m is None:
+                continue
+            firstWord = m.group(1)
+            if firstWord in _indexWords:
+                t = "-"
+                if firstWord == "PRIMARY":
+                    t = "PRIMARY KEY"
+                elif firstWord == "UNIQUE":
+                    t = "UNIQUE"
+                in_table.indexes.append(SchemaIndex(t, _retrIdxColumns(line)))
+            else:
+                tokens = line.split()
+                in_col = SchemaColumn(firstWord, colNum, _retrType(tokens),
+                                      'NOT NULL' in line,
+                                      _retrDefaultValue(line, tokens))
+                colNum += 1
+                in_table.columns.append(in_col)
+
+    state.colDescr = in_colDescr
+    state.dependent = dependent
+    state.touched = touched
+    if in_table is not None:
+        yield in_table
+
+
+def parseSchemaParallel(inFiles, workers=None, chunksPerWorker=4):
+    """
+    Parse schema split into files inFiles in a pool of processes. The result
+    is the same as parseSchema of all lines of inFiles, in order.
+
+    @param inFiles          names of the schema files (see openSchema)
+    @param workers          number of processes, None for the number of cores
+    @param chunksPerWorker  number of chunks per process, more chunks balance
+                            the load better
+
+    Raises IOError if a file can't be opened.
+    """
+    return dict((t.name, t.asDict()) for t in
+                schemaTablesParallel(inFiles, workers, chunksPerWorker))
+
+
+def schemaTablesParallel(inFiles, workers=None, chunksPerWorker=4):
+    """
+    Return list of SchemaTable records parsed from inFiles in a pool of
+    processes, in the order iterSchema would yield them. Parameters are the
+    same as for parseSchemaParallel.
+
+    The input is split into chunks at table starts (CREATE TABLE lines), and
+    every chunk is parsed independently, assuming no multi-line column
+    description is open at its start. Chunks whose result depends on that
+    assumption report it; they are parsed again, in order, in the rare case
+    the assumption is wrong (an unterminated description in the previous
+    chunk). Worker processes get the lines from the parent when forked, only
+    chunk boundaries and parsed tables are sent between processes.
+    """
+    global _poolLines
+    lines = []
+    for fName in inFiles:
+        with openSchema(fName) as f:
+            lines.extend(f)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunks = _splitAtTables(lines, max(1, workers * chunksPerWorker))
+    _poolLines = lines
+    try:
+        if workers > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(min(workers, len(chunks)))
+            try:
+                results = pool.map(_parseChunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_parseChunk(c) for c in chunks]
+
+        tables = []
+        colDescr = None
+        for (chunk, (chunkTables, state)) in zip(chunks, results):
+            if state.dependent and colDescr is not None:
+                (chunkTables, state) = _parseChunk(chunk, colDescr)
+            tables.extend(chunkTables)
+            if state.touched or state.dependent:
+                colDescr = state.colDescr
+        return tables
+    finally:
+        _poolLines = None
+
+
+# Lines being parsed by schemaTablesParallel, inherited by worker processes.
+_poolLines = None
+
+
+def _splitAtTables(lines, nChunks):
+    """
+    Split lines into up to nChunks (start, end) ranges of about the same
+    number of lines, each starting at a table start, except the first one.
+    """
+    chunkLines = len(lines) // nChunks + 1
+    chunks = []
+    start = 0
+    for (i, line) in enumerate(lines):
+        if i - start >= chunkLines and 'CREATE TABLE' in line and \
+           not line.lstrip().startswith('--') and _tableStart.search(line):
+            chunks.append((start, i))
+            start = i
+    chunks.append((start, len(lines)))
+    return chunks
+
+
+def _parseChunk(chunk, colDescr=None):
+    """
+    Parse lines of the (start, end) chunk of _poolLines, return (list of
+    SchemaTable, final _ParseState).
+    """
+    state = _ParseState(colDescr)
+    (start, end) = chunk
+    tables = list(_iterSchema(_poolLines[start:end], state))
+    return (tables, state)
 
 
 ###############################################################################
@@ -82,6 +82,10 @@ CREATE TABLE DDT_Table
         -- <descr>The name of the table.</descr>
     descr TEXT,
         -- <descr>Table description.</descr>
+    contentHash CHAR(40),
+        -- <descr>SHA-1 of the table description and of its columns (as stored
+        -- in DDT_Column). Used to skip unchanged tables when re-registering
+        -- a database.</descr>
     PRIMARY KEY PK_DDT_Table(tableId),
     CONSTRAINT FK_DDTTable_dbRepoId
         FOREIGN KEY(dbRepoId)
@@ -91,6 +91,9 @@ CREATE TABLE File
     checksum VARCHAR(128),
     createTime DATETIME,
     ingestTime DATETIME,
+    modTime DOUBLE,
+        -- <descr>Modification time of the file when it was last scanned,
+        -- in seconds since the epoch.</descr>
     size BIGINT,
         -- <descr>File size in bytes.</descr>
     availability ENUM('published', 'notPublished'),
@@ -112,6 +115,7 @@ CREATE TABLE File
         -- <descr>Time of the completion of the last successful backup.
         -- </descr>
     PRIMARY KEY PK_File_fileId(fileId),
+    INDEX IDX_File_fRepoId_fileName(fRepoId, fileName),
     CONSTRAINT FK_File_fRepoId
         FOREIGN KEY(fRepoId)
         REFERENCES FileRepo(fRepoId)
@@ -177,9 +181,14 @@ CREATE TABLE FitsStructuredMeta
         -- <descr>Duration of exposure, accurate to 10ms.</descr>
         -- <ucd>time.duration</ucd>
         -- <unit>s</unit>
+    healpixId BIGINT,
+        -- <descr>HEALPix pixel (nested scheme, order 16) containing ra, decl,
+        -- used for positional searches.</descr>
     INDEX IDX_fitsStructuredMeta_fileId(fileId),
     INDEX IDX_fitsStructuredMeta_ra(ra),
     INDEX IDX_fitsStructuredMeta_decl(decl),
+    INDEX IDX_fitsStructuredMeta_healpixId_fileId(healpixId, fileId, hdu, obsStart, expTime),
+    INDEX IDX_fitsStructuredMeta_obsStart_fileId(obsStart, fileId, hdu, expTime),
     CONSTRAINT FK_fitsStructuredMeta_fileId
         FOREIGN KEY(fileId)
         REFERENCES File(fileId)
@@ -198,7 +207,8 @@ CREATE TABLE FitsUnstructuredMeta
     intValue INTEGER,
     doubleValue DOUBLE,
     INDEX IDX_fitsUnstructuredMeta_fitsFileId(fileId),
-    INDEX IDX_fitsUnstructuredMeta_fitsKey(fitsKey),
+    INDEX IDX_fitsUnstructuredMeta_fitsKey_string(fitsKey, stringValue, fileId),
+    INDEX IDX_fitsUnstructuredMeta_fitsKey_double(fitsKey, doubleValue, fileId),
     CONSTRAINT FK_fitsUnstructuredMeta_fileId
         FOREIGN KEY(fileId)
         REFERENCES File(fileId)
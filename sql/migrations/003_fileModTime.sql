@@ -0,0 +1,28 @@
+-- LSST Data Management System
+-- Copyright 2015 AURA/LSST.
+--
+-- This product includes software developed by the
+-- LSST Project (http://www.lsst.org/).
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the LSST License Statement and
+-- the GNU General Public License along with this program.  If not,
+-- see <https://www.lsstcorp.org/LegalNotices/>.
+
+-- @brief Migration: add File.modTime (see fileRepo.sql), used to detect files
+-- that changed when a file repository is rescanned, and an index to look files
+-- up by name within a repo. Files ingested earlier have no modTime, the next
+-- rescan fills it in for files whose size did not change.
+
+
+ALTER TABLE File ADD COLUMN modTime DOUBLE AFTER ingestTime,
+                 ADD INDEX IDX_File_fRepoId_fileName(fRepoId, fileName);
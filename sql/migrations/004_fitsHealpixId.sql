@@ -0,0 +1,29 @@
+-- LSST Data Management System
+-- Copyright 2015 AURA/LSST.
+--
+-- This product includes software developed by the
+-- LSST Project (http://www.lsst.org/).
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the LSST License Statement and
+-- the GNU General Public License along with this program.  If not,
+-- see <https://www.lsstcorp.org/LegalNotices/>.
+
+-- @brief Migration: add FitsStructuredMeta.healpixId (see fileRepo.sql), the
+-- spatial key of positional searches (/image/<level>/<repo>/search).
+-- Rows ingested earlier have no healpixId, and are not found by searches
+-- until UPDATE FILEREPO is run on their repository, which fills it in. It is
+-- indexed by 005_fitsTimeIndexes.sql.
+
+
+ALTER TABLE FitsStructuredMeta
+    ADD COLUMN healpixId BIGINT AFTER expTime;
@@ -0,0 +1,31 @@
+-- LSST Data Management System
+-- Copyright 2015 AURA/LSST.
+--
+-- This product includes software developed by the
+-- LSST Project (http://www.lsst.org/).
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the LSST License Statement and
+-- the GNU General Public License along with this program.  If not,
+-- see <https://www.lsstcorp.org/LegalNotices/>.
+
+-- @brief Migration: composite indexes of FitsStructuredMeta for searches of
+-- images (/image/<level>/<repo>/search, see fileRepo.sql), in the order their
+-- pages are read: by healpixId, fileId, hdu for searches with a cone, by
+-- obsStart, fileId, hdu otherwise. A page is read from consecutive index
+-- entries, without sorting all matches, and filters on obsStart and expTime
+-- are checked on index entries, so that only rows that pass them are read.
+
+
+ALTER TABLE FitsStructuredMeta
+    ADD INDEX IDX_fitsStructuredMeta_healpixId_fileId(healpixId, fileId, hdu, obsStart, expTime),
+    ADD INDEX IDX_fitsStructuredMeta_obsStart_fileId(obsStart, fileId, hdu, expTime);
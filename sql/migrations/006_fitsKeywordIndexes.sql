@@ -0,0 +1,30 @@
+-- LSST Data Management System
+-- Copyright 2015 AURA/LSST.
+--
+-- This product includes software developed by the
+-- LSST Project (http://www.lsst.org/).
+--
+-- This program is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- This program is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the LSST License Statement and
+-- the GNU General Public License along with this program.  If not,
+-- see <https://www.lsstcorp.org/LegalNotices/>.
+
+-- @brief Migration: composite indexes of FitsUnstructuredMeta for keyword
+-- queries (/image/<level>/<repo>/query, see keywordQuery). A predicate on a
+-- keyword is one range of one of these indexes, and the matching file ids are
+-- read from the index alone. They supersede the index on fitsKey alone.
+
+
+ALTER TABLE FitsUnstructuredMeta
+    DROP INDEX IDX_fitsUnstructuredMeta_fitsKey,
+    ADD INDEX IDX_fitsUnstructuredMeta_fitsKey_string(fitsKey, stringValue, fileId),
+    ADD INDEX IDX_fitsUnstructuredMeta_fitsKey_double(fitsKey, doubleValue, fileId);
@@ -96,3 +96,16 @@ CREATE TABLE RepoAnnotations
         FOREIGN KEY(userId)
         REFERENCES User(userId)
 ) ENGINE = InnoDB;
+
+
+CREATE TABLE CatalogGeneration
+    -- <descr>Global generation counter of the catalog. It is incremented by
+    -- every write done through the metaserv admin, and used by the RESTful
+    -- interface to validate cached responses (ETags). Contains exactly one
+    -- row. This is a global table, (there is only one in the entire Metadata
+    -- Store).</descr>
+(
+    generation BIGINT NOT NULL DEFAULT 0
+) ENGINE = InnoDB;
+
+INSERT INTO CatalogGeneration(generation) VALUES(0);
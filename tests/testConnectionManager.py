@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for the ConnectionManager class, and for the batched
+MetaAdminImpl APIs using it.
+"""
+
+from contextlib import contextmanager
+import threading
+import unittest
+
+from sqlalchemy.engine.url import URL
+
+from lsst.dax.metaserv.connectionManager import ConnectionManager
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl
+from lsst.dax.metaserv.metaBException import MetaBException
+
+
+class FakeResult(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = len(rows)
+    def fetchall(self):
+        return self.rows
+    def first(self):
+        return self.rows[0] if self.rows else None
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.closed = False
+    def execute(self, cmd, params=()):
+        self.engine.statements.append((cmd, params))
+        return FakeResult(self.engine.respond(cmd, params))
+    @contextmanager
+    def begin(self):
+        yield
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine(object):
+    def __init__(self, url):
+        self.url = url
+        self.disposed = False
+        self.connections = []
+        self.statements = []
+        self.respond = lambda cmd, params: []
+    def connect(self):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+    def dispose(self):
+        self.disposed = True
+
+
+class FakeAuthFiles(object):
+    """
+    Maps auth file names to urls, counts engines created.
+    """
+    def __init__(self, urls):
+        self.urls = urls
+        self.created = 0
+    def __call__(self, authFile):
+        self.created += 1
+        return FakeEngine(self.urls[authFile])
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        ms = URL("mysql", username="u", host="h1", port=3306,
+                 database="metaServ_core")
+        self.authFiles = FakeAuthFiles({
+            "ms.cnf": ms,
+            "ms2.cnf": URL("mysql", username="u", password="p", host="h1",
+                           port=3306, database="metaServ_core"),
+            "other.cnf": URL("mysql", username="u", host="h2", port=3306,
+                             database="metaServ_core")})
+        self.conns = ConnectionManager(self.authFiles)
+
+    def testEngines(self):
+        e1 = self.conns.engine("ms.cnf")
+        self.assertIs(self.conns.engine("ms.cnf"), e1)
+        self.assertIs(self.conns.engine("ms2.cnf"), e1)
+        self.assertIsNot(self.conns.engine("other.cnf"), e1)
+        self.assertEqual(self.authFiles.created, 3)
+        self.assertEqual(len(self.conns), 2)
+        self.conns.close()
+        self.assertTrue(e1.disposed)
+        self.assertEqual(len(self.conns), 0)
+
+    def testConnect(self):
+        with self.conns.connect("ms.cnf") as conn:
+            self.assertFalse(conn.closed)
+        self.assertTrue(conn.closed)
+        with self.assertRaises(RuntimeError):
+            with self.conns.connect("ms.cnf") as conn:
+                raise RuntimeError()
+        self.assertTrue(conn.closed)
+
+    def testPinned(self):
+        with self.conns.pinned("ms.cnf") as pinned:
+            with self.conns.connect("ms2.cnf") as conn:
+                self.assertIs(conn, pinned)
+            with self.conns.pinned("ms.cnf") as conn:
+                self.assertIs(conn, pinned)
+            self.assertFalse(pinned.closed)
+            with self.conns.connect("other.cnf") as conn:
+                self.assertIsNot(conn, pinned)
+            with self.conns.unpinned():
+                with self.conns.connect("ms.cnf") as conn:
+                    self.assertIsNot(conn, pinned)
+            with self.conns.connect("ms.cnf") as conn:
+                self.assertIs(conn, pinned)
+            # other threads get their own connections
+            seen = []
+            def run():
+                with self.conns.connect("ms.cnf") as conn:
+                    seen.append(conn)
+            t = threading.Thread(target=run)
+            t.start()
+            t.join()
+            self.assertIsNot(seen[0], pinned)
+        self.assertTrue(pinned.closed)
+        with self.conns.connect("ms.cnf") as conn:
+            self.assertIsNot(conn, pinned)
+
+
+class TestBatchedAdd(unittest.TestCase):
+
+    def setUp(self):
+        url = URL("mysql", username="u", host="h1", port=3306,
+                  database="metaServ_core")
+        self.impl = MetaAdminImpl("ms.cnf", batchSize=2)
+        self.impl._conns = ConnectionManager(lambda authFile: FakeEngine(url))
+        self.engine = self.impl._conns.engine("ms.cnf")
+
+    def _inserts(self, table):
+        return [params for (cmd, params) in self.engine.statements
+                if cmd.startswith("INSERT INTO %s(" % table)]
+
+    def testAddUsers(self):
+        self.engine.respond = lambda cmd, params: \
+            [(n, i) for (i, n) in enumerate(["SLAC", "NCSA"], 1) if n in params]
+        users = [("u%d" % i, "f", "l", ("SLAC", "NCSA")[i % 2], "e")
+                 for i in range(5)]
+        self.impl.addUsers(users)
+        inserts = self._inserts("User")
+        self.assertEqual([len(b) for b in inserts], [2, 2, 1])
+        self.assertEqual(inserts[0][1], ("u1", "f", "l", "e", 2))
+        self.assertEqual(len(self.engine.connections), 1)
+        self.assertTrue(self.engine.connections[0].closed)
+
+        self.engine.statements = []
+        with self.assertRaises(MetaBException):
+            self.impl.addUsers(users + [("x", "f", "l", "Nowhere", "e")])
+        self.assertEqual(self._inserts("User"), [])
+
+    def testAddInstitutions(self):
+        self.impl.addInstitutions(["A", "B", "C"])
+        self.assertEqual(self._inserts("Institution"),
+                         [[("A",), ("B",)], [("C",)]])
+        self.engine.statements = []
+        self.engine.respond = lambda cmd, params: [("B",)] if "B" in params else []
+        for names in (["D", "B"], ["D", "D"]):
+            with self.assertRaises(MetaBException):
+                self.impl.addInstitutions(names)
+        self.assertEqual(self._inserts("Institution"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+"""
+This is a unittest for updates of database descriptions
+(MetaAdminImpl.updateDbDescr): only the differences with what metaserv stores
+must be written.
+"""
+
+import logging as log
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from sqlalchemy.engine.url import URL
+
+from lsst.dax.metaserv.connectionManager import ConnectionManager
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl, _SourceDb, _tableHash
+from lsst.dax.metaserv.schemaToMeta import iterSchema
+from testConnectionManager import FakeEngine
+
+_SCHEMA = """
+CREATE TABLE t1
+    -- <descr>First table</descr>
+(
+    id BIGINT NOT NULL
+);
+"""
+
+
+class TestDbDescrUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.schemaF = os.path.join(self._dir, "s.sql")
+        with open(self.schemaF, "w") as f:
+            f.write(_SCHEMA)
+        table = next(iterSchema(StringIO(_SCHEMA)))
+        table.columns[0].ord_pos = 1
+        self.hash = _tableHash(table)
+
+        url = URL("mysql", username="u", host="h1", port=3306,
+                  database="metaServ_core")
+        self.impl = MetaAdminImpl("ms.cnf")
+        self.impl._conns = ConnectionManager(lambda authF: FakeEngine(url))
+        self.engine = self.impl._conns.engine("ms.cnf")
+        self.source = _SourceDb("db1", {"t1": {"id": (1, "bigint(20)")}},
+                                "v1", "descr", "host", 3306)
+        self.impl._describeSource = lambda dbName, authF: self.source
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _respond(self, cmd, params):
+        if cmd.startswith("SELECT dbRepoId, version"):
+            return [(3, "v1", "descr", "host", 3306)]
+        if cmd.startswith("SELECT tableId, tableName, contentHash"):
+            return [(10, "t1", self.hash)]
+        return []
+
+    def _writes(self):
+        return [cmd for (cmd, params) in self.engine.statements
+                if not cmd.startswith("SELECT")]
+
+    def testUnchanged(self):
+        self.engine.respond = self._respond
+        for i in range(2):
+            stats = self.impl.updateDbDescr("db1", self.schemaF, "db.cnf")
+            self.assertEqual(stats["tablesUnchanged"], 1)
+        # no write, the catalog generation is kept
+        self.assertEqual(self._writes(), [])
+
+    def testChanged(self):
+        self.engine.respond = self._respond
+        self.source = self.source._replace(schemaVersion="v2")
+        self.impl.updateDbDescr("db1", self.schemaF, "db.cnf")
+        writes = self._writes()
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(writes[0].startswith("UPDATE Repo SET version"))
+        self.assertTrue(writes[1].startswith("UPDATE CatalogGeneration"))
+
+        self.engine.statements = []
+        self.source = self.source._replace(schemaVersion="v1")
+        self.hash = "old"
+        stats = self.impl.updateDbDescr("db1", self.schemaF, "db.cnf")
+        self.assertEqual(stats["tablesUpdated"], 1)
+        self.assertEqual(len([w for w in self._writes()
+                              if w.startswith("UPDATE CatalogGeneration")]), 1)
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+This is a unittest for database manifests and MetaAdminImpl.addDbDescrManifest.
+"""
+
+import imp
+import logging as log
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import sqlalchemy
+
+from lsst.dax.metaserv.connectionManager import ConnectionManager
+from lsst.dax.metaserv.dbManifest import readManifest
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl, _SourceDb
+from lsst.dax.metaserv.metaBException import MetaBException
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+_CSV = """# test manifest
+dbName, schemaFile, level, dataRel, owner, accessibility, project, mysqlAuthFile
+
+db1, s.sql, L2, DR1, joe, public
+db2, /abs/s.sql.gz, L2, DR1, joe, private, Other, ~/db2.cnf
+"""
+
+_SCHEMA = """
+CREATE TABLE t1 (
+    id BIGINT NOT NULL
+);
+"""
+
+
+class TestDbManifest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, content):
+        fName = os.path.join(self._dir, name)
+        with open(fName, "w") as f:
+            f.write(content)
+        return fName
+
+    def testCsv(self):
+        fName = self._write("m.csv", _CSV)
+        entries = readManifest(fName, {"project": "LSST",
+                                       "mysqlAuthFile": "ms.cnf"})
+        self.assertEqual([e["dbName"] for e in entries], ["db1", "db2"])
+        self.assertEqual(entries[0]["schemaFile"],
+                         os.path.join(self._dir, "s.sql"))
+        self.assertEqual(entries[0]["project"], "LSST")
+        self.assertEqual(entries[0]["mysqlAuthFile"], "ms.cnf")
+        self.assertEqual(entries[1]["schemaFile"], "/abs/s.sql.gz")
+        self.assertEqual(entries[1]["project"], "Other")
+        self.assertEqual(entries[1]["mysqlAuthFile"],
+                         os.path.expanduser("~/db2.cnf"))
+        self.assertEqual(entries[1]["accessibility"], "private")
+
+    def testInvalid(self):
+        for content in ("dbName,schemaFile\ndb1,s.sql\n",
+                        _CSV + "db1, s.sql, L2, DR1, joe, public\n",
+                        _CSV + "db3, s.sql, L2, DR1, joe, public, P, a, extra\n",
+                        "dbName,schemaFile,level,dataRel,owner,accessibility,x\n"):
+            fName = self._write("m.csv", content)
+            with self.assertRaises(MetaBException) as cm:
+                readManifest(fName)
+            self.assertEqual(cm.exception.errCode, MetaBException.BAD_MANIFEST)
+        with self.assertRaises(MetaBException):
+            readManifest(os.path.join(self._dir, "missing.csv"))
+
+    @unittest.skipIf(yaml is None, "PyYAML not available")
+    def testYaml(self):
+        fName = self._write("m.yaml", """
+databases:
+  - {dbName: db1, schemaFile: s.sql, level: L2, dataRel: DR1, owner: joe,
+     accessibility: public}
+""")
+        entries = readManifest(fName)
+        self.assertEqual(entries[0]["dbName"], "db1")
+        self.assertEqual(entries[0]["schemaFile"],
+                         os.path.join(self._dir, "s.sql"))
+        self.assertIsNone(entries[0]["project"])
+
+    def testAddManifest(self):
+        """
+        Databases are prepared concurrently, registered serially in manifest
+        order, and a failure only affects the database it concerns.
+        """
+        schemaF = self._write("s.sql", _SCHEMA)
+        lines = ["dbName,schemaFile,level,dataRel,owner,accessibility"]
+        lines += ["db%d,%s,L2,DR1,joe,public" % (i, schemaF) for i in range(8)]
+        fName = self._write("m.csv", "\n".join(lines) + "\n")
+
+        impl = MetaAdminImpl("ms.cnf")
+        lock = threading.Lock()
+        active = [0, 0]     # currently preparing, max seen
+        registering = []
+
+        def describeSource(dbName, dbMysqlAuthF):
+            self.assertEqual(dbMysqlAuthF, "ms.cnf")
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            if dbName == "db3":
+                raise MetaBException(MetaBException.DB_DOES_NOT_EXIST, dbName)
+            return _SourceDb(dbName, {"t1": {"id": (1, "bigint(20)")}},
+                             "unknown", "", "host", 3306)
+
+        def registerDb(source, tables, level, dataRel, owner, accessibility,
+                       projectName, bulk):
+            self.assertEqual(registering, [])
+            registering.append(source.dbName)
+            self.assertEqual([c.ord_pos for c in tables[0].columns], [1])
+            self.assertEqual(projectName, "LSST")
+            registering.pop()
+            if source.dbName == "db5":
+                raise MetaBException(MetaBException.OWNER_NOT_FOUND, owner)
+
+        impl._describeSource = describeSource
+        impl._registerDb = registerDb
+        results = impl.addDbDescrManifest(fName, workers=4)
+        self.assertEqual([r[0] for r in results], ["db%d" % i for i in range(8)])
+        failed = dict((n, e.errCode) for (n, e) in results if e is not None)
+        self.assertEqual(failed, {"db3": MetaBException.DB_DOES_NOT_EXIST,
+                                  "db5": MetaBException.OWNER_NOT_FOUND})
+        self.assertGreater(active[1], 1)
+
+    def testManifestInScript(self):
+        """
+        In batch mode, the databases of a manifest are committed on their own,
+        the failure of one does not roll back the others.
+        """
+        schemaF = self._write("s.sql", _SCHEMA)
+        lines = ["dbName,schemaFile,level,dataRel,owner,accessibility"]
+        lines += ["db%d,%s,L2,DR1,joe,public" % (i, schemaF) for i in range(3)]
+        manifestF = self._write("m.csv", "\n".join(lines) + "\n")
+        scriptF = self._write("script", "ADD DBDESCR MANIFEST %s 2;\n" % manifestF)
+
+        engine = sqlalchemy.create_engine(
+            "sqlite:///" + os.path.join(self._dir, "metaServ.db"))
+        engine.execute("CREATE TABLE DbRepo (dbName TEXT)")
+        metaAdmin = imp.load_source("metaAdmin", os.path.join(
+            os.path.dirname(__file__), os.pardir, "bin", "metaAdmin.py"))
+        cmdParser = metaAdmin.CommandParser("ms.cnf")
+        impl = cmdParser._impl
+        impl._conns = ConnectionManager(lambda authF: engine)
+
+        def describeSource(dbName, dbMysqlAuthF):
+            return _SourceDb(dbName, {"t1": {"id": (1, "bigint(20)")}},
+                             "unknown", "", "host", 3306)
+
+        def registerDb(source, tables, level, dataRel, owner, accessibility,
+                       projectName, bulk):
+            with impl._msConnect() as conn, conn.begin():
+                conn.execute("INSERT INTO DbRepo VALUES (?)", (source.dbName,))
+                if source.dbName == "db1":
+                    raise MetaBException(MetaBException.OWNER_NOT_FOUND, owner)
+
+        impl._describeSource = describeSource
+        impl._registerDb = registerDb
+        self.assertEqual(cmdParser.runScript(scriptF), 1)
+        self.assertEqual([row[0] for row in engine.execute(
+            "SELECT dbName FROM DbRepo ORDER BY dbName")], ["db0", "db2"])
+        impl.close()
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
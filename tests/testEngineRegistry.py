@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+This is a unittest for the EngineRegistry class.
+"""
+
+import unittest
+
+from sqlalchemy.engine.url import URL
+
+from lsst.dax.metaserv.engineRegistry import EngineRegistry
+
+
+class FakeEngine(object):
+    def __init__(self, url, **kwargs):
+        self.url = url
+        self.kwargs = kwargs
+        self.disposed = False
+    def dispose(self):
+        self.disposed = True
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+
+class TestEngineRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.baseUrl = URL("mysql", username="u", password="p", host="h0",
+                           port=3306, database="metaServ_core")
+        self.registry = EngineRegistry(self.baseUrl, poolSize=3, maxIdle=10,
+                                       timer=self.timer, createEngine=FakeEngine)
+
+    def testReuse(self):
+        e1 = self.registry.get("h1", 3306)
+        self.assertIs(self.registry.get("h1", 3306), e1)
+        self.assertIsNot(self.registry.get("h1", 3307), e1)
+        self.assertEqual(e1.url.host, "h1")
+        self.assertEqual(e1.url.username, "u")
+        self.assertEqual(e1.url.database, None)
+        self.assertEqual(e1.kwargs["pool_size"], 3)
+        self.assertEqual(self.baseUrl.host, "h0")
+
+    def testIdleEviction(self):
+        e1 = self.registry.get("h1", 3306)
+        self.timer.now = 5
+        e2 = self.registry.get("h2", 3306)
+        self.timer.now = 12
+        self.registry.evictIdle()
+        self.assertTrue(e1.disposed)
+        self.assertFalse(e2.disposed)
+        self.assertEqual(len(self.registry), 1)
+        self.assertIsNot(self.registry.get("h1", 3306), e1)
+        self.registry.dispose()
+        self.assertTrue(e2.disposed)
+        self.assertEqual(len(self.registry), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for checksums of file repositories (fileChecksum and
+MetaAdminImpl.checksumFileRepo).
+"""
+
+import hashlib
+import logging as log
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.engine.url import URL
+
+from lsst.dax.metaserv.connectionManager import ConnectionManager
+from lsst.dax.metaserv.fileChecksum import checkAlgorithm, checksumFile, \
+    checksumFiles
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl
+from lsst.dax.metaserv.metaBException import MetaBException
+from testConnectionManager import FakeEngine
+
+
+class TestFileChecksum(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.content = {}
+        for (name, size) in (("empty.fits", 0), ("small.fits", 1000),
+                             ("big.fits", 100000), ("changed.fits", 2880)):
+            data = os.urandom(size)
+            with open(os.path.join(self._dir, name), "wb") as f:
+                f.write(data)
+            self.content[name] = data
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _expected(self, name, algorithm="sha1"):
+        return "%s:%s" % (algorithm,
+                          hashlib.new(algorithm, self.content[name]).hexdigest())
+
+    def testChecksumFile(self):
+        for name in self.content:
+            path = os.path.join(self._dir, name)
+            for useMmap in (False, True):
+                for algorithm in ("md5", "sha1", "sha256"):
+                    self.assertEqual(
+                        checksumFile(path, algorithm, bufferSize=4096,
+                                     useMmap=useMmap),
+                        (self._expected(name, algorithm),
+                         len(self.content[name])))
+
+    def testAlgorithm(self):
+        checkAlgorithm("sha384")
+        for algorithm in ("sha512", "noSuchHash"):
+            with self.assertRaises(MetaBException) as cm:
+                checkAlgorithm(algorithm)
+            self.assertEqual(cm.exception.errCode, MetaBException.BAD_ALGORITHM)
+
+    def testChecksumFiles(self):
+        tasks = [(name, os.path.join(self._dir, name)) for name in self.content]
+        tasks.append(("missing", os.path.join(self._dir, "missing.fits")))
+        results = dict((r[0], r[1:]) for r in
+                       checksumFiles(tasks, workers=3, bufferSize=4096))
+        self.assertEqual(len(results), len(tasks))
+        for name in self.content:
+            self.assertEqual(results[name], (self._expected(name),
+                                             len(self.content[name]), None))
+        (checksum, nBytes, error) = results["missing"]
+        self.assertEqual((checksum, nBytes), (None, 0))
+        self.assertTrue(error)
+
+    def testChecksumFileRepo(self):
+        url = URL("mysql", username="u", host="h1", port=3306,
+                  database="metaServ_core")
+        impl = MetaAdminImpl("ms.cnf", batchSize=2)
+        impl._conns = ConnectionManager(lambda authF: FakeEngine(url))
+        engine = impl._conns.engine("ms.cnf")
+        files = []
+        for (fileId, name) in enumerate(sorted(self.content)):
+            st = os.stat(os.path.join(self._dir, name))
+            size = st.st_size - (name == "changed.fits")
+            files.append((fileId, name, size,
+                          None if name == "empty.fits" else st.st_mtime))
+        files.append((9, "missing.fits", 10, 1.0))
+        def respond(cmd, params):
+            if cmd.startswith("SELECT repoId, accessibility FROM Repo"):
+                return [(7, "unreleased")]
+            if cmd.startswith("SELECT fileId, fileName, size, modTime"):
+                return files
+            return []
+        engine.respond = respond
+        stats = impl.checksumFileRepo(self._dir, workers=2)
+        del stats["seconds"], stats["MBps"]
+        self.assertEqual(stats, {"hashed": 3, "skipped": 1, "failed": 1,
+                                 "bytes": 101000})
+
+        selects = [cmd for (cmd, params) in engine.statements
+                   if cmd.startswith("SELECT fileId")]
+        self.assertIn("checksum IS NULL", selects[0])
+        updates = [params for (cmd, params) in engine.statements
+                   if cmd.startswith("UPDATE File SET checksum")]
+        self.assertEqual([len(batch) for batch in updates], [2, 1])
+        names = dict((f[0], f[1]) for f in files)
+        self.assertEqual(sorted((names[fileId], checksum)
+                                for batch in updates
+                                for (checksum, fileId) in batch),
+                         [(name, self._expected(name)) for name in
+                          ("big.fits", "empty.fits", "small.fits")])
+
+        engine.respond = lambda cmd, params: []
+        with self.assertRaises(MetaBException) as cm:
+            impl.checksumFileRepo(self._dir)
+        self.assertEqual(cm.exception.errCode, MetaBException.FILEREPO_UNKNOWN)
+
+####################################################################################
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
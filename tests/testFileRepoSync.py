@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for rescans of file repositories
+(MetaAdminImpl.updateFileRepo): only the differences between the directory
+and the File table must be written.
+"""
+
+import logging as log
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.engine.url import URL
+
+from lsst.dax.metaserv.connectionManager import ConnectionManager
+from lsst.dax.metaserv import healpix
+from lsst.dax.metaserv.fitsIngest import scanFitsFiles
+from lsst.dax.metaserv.metaAdminImpl import MetaAdminImpl, ON_DISK
+from lsst.dax.metaserv.metaBException import MetaBException
+from testConnectionManager import FakeEngine
+from testFitsHeader import _writeFits
+
+
+class TestFileRepoSync(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, "sub"))
+        for name in ("same.fits", "grown.fits", "new.fits", "back.fits",
+                     "old.fits", "sub/a.fits"):
+            _writeFits(os.path.join(self._dir, name))
+        (self.found, failed) = scanFitsFiles(self._dir)
+        self.assertEqual(failed, [])
+
+        url = URL("mysql", username="u", host="h1", port=3306,
+                  database="metaServ_core")
+        self.impl = MetaAdminImpl("ms.cnf", batchSize=2)
+        self.impl._conns = ConnectionManager(lambda authF: FakeEngine(url))
+        self.engine = self.impl._conns.engine("ms.cnf")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _stored(self, name, fileId, onDisk=ON_DISK, sizeDelta=0, modTime=True):
+        (size, mTime) = self.found[name]
+        return (name, fileId, size + sizeDelta, mTime if modTime else None, onDisk)
+
+    def _respond(self, stored, newIds):
+        def respond(cmd, params):
+            if cmd.startswith("SELECT repoId, accessibility FROM Repo"):
+                return [(7, "unreleased")]
+            if cmd.startswith("SELECT fileName, fileId, size"):
+                return stored
+            if cmd.startswith("SELECT fileName, fileId FROM File"):
+                return [(n, newIds[n]) for n in params[1:]]
+            return []
+        return respond
+
+    def _statements(self, prefix):
+        return [params for (cmd, params) in self.engine.statements
+                if cmd.startswith(prefix)]
+
+    def testUpdate(self):
+        stored = [self._stored("same.fits", 1),
+                  self._stored("grown.fits", 2, sizeDelta=-2880),
+                  self._stored("back.fits", 3, onDisk=0),
+                  self._stored("old.fits", 4, modTime=False),
+                  self._stored("sub/a.fits", 5),
+                  ("gone.fits", 6, 2880, 1.0, ON_DISK),
+                  ("goneEarlier.fits", 7, 2880, 1.0, 0)]
+        self.engine.respond = self._respond(stored, {"new.fits": 8})
+        stats = self.impl.updateFileRepo(self._dir, workers=1)
+        del stats["seconds"]
+        self.assertEqual(stats, {"added": 1, "updated": 1, "restored": 1,
+                                 "missing": 1, "unchanged": 3, "failed": 0,
+                                 "hdus": 6, "structured": 4, "keywords": 24,
+                                 "indexed": 0})
+
+        self.assertEqual(self._statements("UPDATE File SET onDisk = %d" % ON_DISK),
+                         [[3]])
+        self.assertEqual(self._statements("UPDATE File SET onDisk = 0"), [[6]])
+        self.assertEqual(self._statements("UPDATE File SET modTime"),
+                         [[(self.found["old.fits"][1], 4)]])
+        inserted = self._statements("INSERT INTO File(")
+        self.assertEqual([[r[1] for r in rows] for rows in inserted],
+                         [["new.fits"]])
+        row = inserted[0][0]
+        self.assertEqual((row[0], row[2], row[5], row[6], row[8]),
+                         (7, os.path.join(self._dir, "new.fits"),
+                          self.found["new.fits"][1], self.found["new.fits"][0],
+                          ON_DISK))
+        updated = self._statements("UPDATE File SET createTime")
+        self.assertEqual([[r[-1] for r in rows] for rows in updated], [[2]])
+        self.assertIn("checksum = NULL", [cmd for (cmd, params) in
+                                          self.engine.statements
+                                          if cmd.startswith("UPDATE File SET "
+                                                            "createTime")][0])
+        for table in ("FitsMeta", "FitsStructuredMeta", "FitsUnstructuredMeta"):
+            self.assertEqual(self._statements("DELETE FROM %s" % table), [[2]])
+        fitsMeta = self._statements("INSERT INTO FitsMeta")
+        self.assertEqual(sorted(r[0] for rows in fitsMeta for r in rows), [2, 8])
+        structured = self._statements("INSERT INTO FitsStructuredMeta")
+        self.assertEqual(sorted((r[0], r[1], r[-1]) for rows in structured
+                                for r in rows),
+                         [(fileId, hdu, healpix.ang2pix(healpix.ORDER,
+                                                        10.0 + hdu - 1, -5.5))
+                          for fileId in (2, 8) for hdu in (1, 2)])
+        # restored + new - missing
+        self.assertEqual(self._statements("UPDATE FileRepoTypes"), [(1, 7)])
+        # files are private, as the repo is unreleased
+        self.assertEqual(row[7], "private")
+
+    def testUnchanged(self):
+        stored = [self._stored(n, i) for (i, n) in enumerate(sorted(self.found))]
+        self.engine.respond = self._respond(stored, {})
+        stats = self.impl.updateFileRepo(self._dir, workers=1)
+        self.assertEqual(stats["unchanged"], len(self.found))
+        writes = [cmd for (cmd, params) in self.engine.statements
+                  if not cmd.startswith("SELECT")]
+        self.assertEqual(writes, [])
+
+    def testIndex(self):
+        stored = [self._stored(n, i) for (i, n) in enumerate(sorted(self.found))]
+        respond = self._respond(stored, {})
+        def respondIndex(cmd, params):
+            if cmd.startswith("SELECT fileId, hdu, ra, decl"):
+                return [(1, 1, 0.0, 90.0), (1, 2, 359.9, -30.0)]
+            return respond(cmd, params)
+        self.engine.respond = respondIndex
+        stats = self.impl.updateFileRepo(self._dir, workers=1)
+        self.assertEqual(stats["indexed"], 2)
+        self.assertEqual(self._statements("UPDATE FitsStructuredMeta"),
+                         [[(healpix.ang2pix(healpix.ORDER, 0.0, 90.0), 1, 1),
+                           (healpix.ang2pix(healpix.ORDER, 359.9, -30.0), 1, 2)]])
+        self.assertEqual(len(self._statements("UPDATE CatalogGeneration")), 1)
+
+    def testUnknown(self):
+        with self.assertRaises(MetaBException):
+            self.impl.updateFileRepo(os.path.join(self._dir, "nothing"))
+        self.engine.respond = lambda cmd, params: []
+        with self.assertRaises(MetaBException):
+            self.impl.updateFileRepo(self._dir)
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
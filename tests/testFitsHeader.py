@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for the FITS header reader and the parsing stage of
+file repository ingestion.
+"""
+
+import logging as log
+import os
+import shutil
+import tempfile
+import unittest
+
+from lsst.dax.metaserv.fitsHeader import (extractMeta, parseCard, readFitsFile,
+                                          readHeaders)
+from lsst.dax.metaserv.fitsIngest import batches, findFitsFiles, parseFitsFiles
+from lsst.dax.metaserv.metaBException import MetaBException
+
+
+def _card(key, value=None, comment=None):
+    """
+    Return an 80-character card.
+    """
+    if value is None:
+        card = "%-8s" % key + ("  " + comment if comment else "")
+    else:
+        if isinstance(value, bool):
+            v = "%20s" % ("T" if value else "F")
+        elif isinstance(value, str):
+            v = "'%-8s'" % value.replace("'", "''")
+        else:
+            v = "%20s" % value
+        card = "%-8s= %s" % (key, v)
+        if comment:
+            card += " / " + comment
+    return "%-80s" % card[:80]
+
+
+def _hdu(cards, data=""):
+    """
+    Return a header with cards and END, followed by data, both padded.
+    """
+    header = "".join(cards) + _card("END")
+    header += " " * (-len(header) % 2880)
+    return header + data + "\0" * (-len(data) % 2880)
+
+
+def _image(primary, extra, nx, ny, inherit=False):
+    """
+    Return cards of an image HDU of nx*ny 16-bit pixels, and its data.
+    """
+    if primary:
+        cards = [_card("SIMPLE", True)]
+    else:
+        cards = [_card("XTENSION", "IMAGE")]
+    cards += [_card("BITPIX", 16), _card("NAXIS", 2), _card("NAXIS1", nx),
+              _card("NAXIS2", ny)]
+    if not primary:
+        cards += [_card("PCOUNT", 0), _card("GCOUNT", 1)]
+    return _hdu(cards + extra, "\x01" * (2 * nx * ny))
+
+
+_PRIMARY = [_card("DATE-OBS", "2015-03-04T05:06:07.25"), _card("EXPTIME", 30.0),
+            _card("FILTER", "r"), _card("AIRMASS", 1.15), _card("OBSID", 42),
+            _card("BIGNUM", 2**40), _card("PHOTOMET", True),
+            _card("COMMENT", None, "a comment"), _card("HISTORY", None, "x"),
+            _card("OBSERVER", "O'Brien", "with a quote / and slash")]
+
+
+def _writeFits(fName, nAmps=2, nx=100, ny=50):
+    content = _image(True, _PRIMARY, 0, 0)
+    for amp in range(nAmps):
+        content += _image(False, [_card("RA", 10.0 + amp), _card("DEC", -5.5),
+                                  _card("EXTNAME", "amp%d" % amp),
+                                  "%-80s" % "GAIN    =                1.5D0"],
+                         nx, ny)
+    with open(fName, "wb") as f:
+        f.write(content)
+
+
+class TestFitsHeader(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testParseCard(self):
+        self.assertEqual(parseCard(_card("A", 3)), ("A", 3))
+        self.assertEqual(parseCard(_card("A", -2.5e-3)), ("A", -2.5e-3))
+        self.assertEqual(parseCard(_card("A", "1.0D2")), ("A", "1.0D2"))
+        self.assertEqual(parseCard("%-80s" % "A       =               1.0D2"),
+                         ("A", 100.0))
+        self.assertEqual(parseCard(_card("A", False, "no")), ("A", False))
+        self.assertEqual(parseCard(_card("A", "it''s")), ("A", "it''s"))
+        self.assertEqual(parseCard(_card("A", "it's  ", "c")), ("A", "it's"))
+        self.assertEqual(parseCard(_card("COMMENT", None, "x = 1")),
+                         ("COMMENT", None))
+        self.assertEqual(parseCard("%-80s" % "A       =  / undefined"),
+                         ("A", None))
+
+    def testHeaders(self):
+        fName = os.path.join(self._dir, "a.fits")
+        _writeFits(fName, nAmps=3)
+        with open(fName) as f:
+            headers = readHeaders(f.read())
+        self.assertEqual(len(headers), 4)
+        self.assertEqual(dict(headers[3])["EXTNAME"], "amp2")
+
+        info = readFitsFile(fName)
+        self.assertEqual(info.hdus, 4)
+        self.assertEqual(info.size, os.path.getsize(fName))
+        # primary has no position, each amp inherits time from the primary
+        self.assertEqual([r[0] for r in info.structured], [1, 2, 3])
+        (hdu, equinox, ra, decl, rotAng, obsStart, expMidpt, expTime) = \
+            info.structured[1]
+        self.assertEqual((ra, decl, expTime), (11.0, -5.5, 30.0))
+        self.assertIsNone(equinox)
+        self.assertEqual(obsStart, "2015-03-04 05:06:07.250000")
+        self.assertAlmostEqual(expMidpt,
+                               57085 + (5 * 3600 + 6 * 60 + 7.25 + 15) / 86400.)
+
+        keywords = dict(((k, hdu), (s, i, d)) for (k, hdu, s, i, d)
+                        in info.keywords)
+        self.assertEqual(keywords[("FILTER", 0)], ("r", None, None))
+        self.assertEqual(keywords[("AIRMASS", 0)], ("1.15", None, 1.15))
+        self.assertEqual(keywords[("OBSID", 0)], ("42", 42, 42.0))
+        self.assertEqual(keywords[("BIGNUM", 0)], (str(2**40), None, 2.**40))
+        self.assertEqual(keywords[("PHOTOMET", 0)], ("T", 1, None))
+        self.assertEqual(keywords[("OBSERVER", 0)], ("O'Brien", None, None))
+        self.assertEqual(keywords[("GAIN", 1)], ("1.5", None, 1.5))
+        self.assertEqual(keywords[("EXTNAME", 2)], ("amp1", None, None))
+        for key in ("SIMPLE", "BITPIX", "NAXIS1", "COMMENT", "HISTORY", "RA",
+                    "PCOUNT"):
+            self.assertFalse([k for k in keywords if k[0] == key], key)
+        # the primary HDU has no structured metadata, its keywords are kept
+        self.assertEqual(keywords[("EXPTIME", 0)], ("30.0", None, 30.0))
+
+    def testMjd(self):
+        (structured, keywords) = extractMeta([[
+            ("SIMPLE", True), ("RA", 1.0), ("DEC", 2.0), ("MJD-OBS", 57000.5),
+            ("EXPOSURE", 86400.0), ("EQUINOX", 2000.0)]])
+        self.assertEqual(structured, [(0, 2000.0, 1.0, 2.0, None,
+                                       "2014-12-09 12:00:00.000000",
+                                       57001.0, 86400.0)])
+        self.assertEqual(keywords, [])
+
+    def testInvalid(self):
+        good = _image(True, _PRIMARY, 10, 10)
+        for content in ("", "x" * 2880, good[:2880].replace("END ", "XYZ "),
+                        _hdu([_card("SIMPLE", True), _card("NAXIS", 1)], "x")):
+            fName = os.path.join(self._dir, "bad.fits")
+            with open(fName, "wb") as f:
+                f.write(content)
+            with self.assertRaises(MetaBException):
+                readFitsFile(fName)
+
+    def testParseFiles(self):
+        os.makedirs(os.path.join(self._dir, "b", "c"))
+        names = ["a.fits", "b/x.fit", "b/c/y.fits", "b/c/z.FITS"]
+        for name in names:
+            _writeFits(os.path.join(self._dir, name))
+        for name in ("b/bad.fits", "b/notes.txt", "b/c/y.fits.gz"):
+            with open(os.path.join(self._dir, name), "w") as f:
+                f.write("x")
+        paths = findFitsFiles(self._dir)
+        self.assertEqual(paths, sorted(names + ["b/bad.fits"]))
+        for workers in (1, 2):
+            results = list(parseFitsFiles(self._dir, paths, workers, 1))
+            self.assertEqual([r[0] for r in results], paths)
+            failed = [r[0] for r in results if r[1] is None]
+            self.assertEqual(failed, ["b/bad.fits"])
+            self.assertTrue(all(r[1].hdus == 3 for r in results if r[1]))
+        self.assertEqual(list(batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for the HEALPix spatial index (healpix).
+"""
+
+import logging as log
+import math
+import unittest
+
+import numpy as np
+
+from lsst.dax.metaserv import healpix
+
+
+class TestHealpix(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(42)
+
+    def _randomPositions(self, n):
+        ra = self.rng.uniform(0, 360, n)
+        decl = np.degrees(np.arcsin(self.rng.uniform(-1, 1, n)))
+        return (ra, decl)
+
+    def testBasePixels(self):
+        # centers of the 12 base pixels
+        (ra, decl) = healpix.pix2ang(0, np.arange(12))
+        z = np.sin(np.radians(decl))
+        self.assertTrue(np.allclose(z, [2. / 3] * 4 + [0] * 4 + [-2. / 3] * 4))
+        self.assertTrue(np.allclose(ra, [45, 135, 225, 315, 0, 90, 180, 270,
+                                         45, 135, 225, 315]))
+        self.assertEqual(healpix.ang2pix(0, ra, decl).tolist(), range(12))
+        # poles are the north corner of face 0, the south corner of face 8
+        nPix = 4 ** healpix.ORDER
+        self.assertEqual(healpix.ang2pix(healpix.ORDER, 0, 90), nPix - 1)
+        self.assertEqual(healpix.ang2pix(healpix.ORDER, 0, -90), 8 * nPix)
+
+    def testRoundTrip(self):
+        (ra, decl) = self._randomPositions(20000)
+        for order in (0, 3, 9, healpix.ORDER, healpix.MAX_ORDER):
+            pixels = healpix.ang2pix(order, ra, decl)
+            self.assertTrue((pixels >= 0).all())
+            self.assertTrue((pixels < 12 * 4 ** order).all())
+            # positions are within the radius of their pixel
+            (cRa, cDecl) = healpix.pix2ang(order, pixels)
+            distances = healpix.angularDistance(ra, decl, cRa, cDecl)
+            self.assertLessEqual(np.radians(distances).max(),
+                                 healpix.maxPixrad(order))
+            # centers are in their own pixel
+            self.assertTrue((healpix.ang2pix(order, cRa, cDecl) == pixels).all())
+        # ra wraps around
+        self.assertTrue((healpix.ang2pix(10, ra - 360, decl) ==
+                         healpix.ang2pix(10, ra, decl)).all())
+
+    def testNested(self):
+        (ra, decl) = self._randomPositions(1000)
+        self.assertTrue((healpix.ang2pix(healpix.ORDER, ra, decl) >> 20 ==
+                         healpix.ang2pix(healpix.ORDER - 10, ra, decl)).all())
+
+    def testCoverCone(self):
+        cones = [(0, 0, 1), (359.99, 10, 0.5), (0, 90, 2), (123, -89.9, 0.3),
+                 (10, 45, 1 / 3600.), (200, -30, 20), (45, 0, 90)]
+        for (ra, decl, radius) in cones:
+            ranges = healpix.coverCone(ra, decl, radius)
+            self.assertLess(len(ranges), 50)
+            first = np.array([r[0] for r in ranges])
+            last = np.array([r[1] for r in ranges])
+            self.assertTrue((first[1:] > last[:-1] + 1).all())
+            # random positions close to the cone, those inside must be covered
+            (pRa, pDecl) = self._randomPositions(200000)
+            scale = math.radians(min(radius * 1.5, 180))
+            pRa = ra + (pRa - 180) * (scale / math.pi)
+            pDecl = np.clip(decl + pDecl * (scale / (math.pi / 2)), -90, 90)
+            inside = healpix.angularDistance(ra, decl, pRa, pDecl) <= radius
+            self.assertGreater(inside.sum(), 100)
+            pixels = healpix.ang2pix(healpix.ORDER, pRa[inside], pDecl[inside])
+            i = np.searchsorted(first, pixels, side="right") - 1
+            self.assertTrue((i >= 0).all())
+            self.assertTrue((pixels <= last[i]).all())
+
+    def testAngularDistance(self):
+        self.assertAlmostEqual(healpix.angularDistance(359.5, 0, 0.5, 0), 1.)
+        self.assertAlmostEqual(healpix.angularDistance(0, 89.5, 180, 89.5), 1.)
+        self.assertAlmostEqual(healpix.angularDistance(10, 20, 10, 20), 0.)
+        self.assertAlmostEqual(
+            healpix.angularDistance(10, 20, 10, 20 + 1 / 3600.) * 3600, 1.)
+
+
+####################################################################################
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for listings of file repositories and of their files
+(/image, /image/<level>, /image/<level>/<repo> and /image/<level>/<repo>/files).
+Queries run on an in-memory SQLite database.
+"""
+
+import json
+import logging as log
+import unittest
+
+from flask import Flask
+import sqlalchemy
+
+from lsst.dax.metaserv import metaREST_v0
+
+N_FILES = 25
+
+
+class RecordingEngine(object):
+    """
+    Engine recording the statements it executes.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def execute(self, query, **params):
+        self.statements.append(str(query))
+        return self.engine.execute(query, **params)
+
+
+class TestImageListing(unittest.TestCase):
+
+    def setUp(self):
+        engine = sqlalchemy.create_engine("sqlite://")
+        engine.execute("CREATE TABLE Repo (repoId INT, repoType TEXT, "
+                       "lsstLevel TEXT, url TEXT, dataRelease TEXT, "
+                       "version TEXT, shortName TEXT, description TEXT, "
+                       "createTime DATETIME, ingestTime DATETIME, "
+                       "availability TEXT, accessibility TEXT)")
+        engine.execute("CREATE TABLE FileRepoTypes (fRepoId INT, "
+                       "fileType TEXT, fileCount INT)")
+        engine.execute("CREATE TABLE File (fileId INT, fRepoId INT, "
+                       "fileName TEXT, url TEXT, checksum TEXT, "
+                       "createTime DATETIME, ingestTime DATETIME, "
+                       "modTime DOUBLE, size BIGINT, availability TEXT, "
+                       "accessibility TEXT, onDisk INT)")
+        engine.execute("CREATE TABLE FitsMeta (fileId INT, hdus INT)")
+        for (repoId, repoType, lsstLevel, shortName) in (
+                (1, 'file', 'L1', 'raw'), (2, 'file', 'L1', 'calexp'),
+                (3, 'file', 'L2', 'raw'), (4, 'db', 'L2', None),
+                (5, 'file', 'L1', 'raw')):
+            engine.execute("INSERT INTO Repo (repoId, repoType, lsstLevel, "
+                           "shortName, url, ingestTime) VALUES (?, ?, ?, ?, ?, "
+                           "'2015-06-01 12:00:00')",
+                           repoId, repoType, lsstLevel, shortName,
+                           "/data/%s" % repoId)
+        # fileCount as maintained by ingestion, deliberately not the number
+        # of rows of File
+        engine.execute("INSERT INTO FileRepoTypes VALUES (1, 'fits', 1000000), "
+                       "(2, 'fits', 7), (5, 'fits', 3), (5, 'csv', 1)")
+        # files of repositories 1 and 5 (both "raw"), inserted out of order
+        self.names = {1: [], 5: []}
+        for fileId in range(1, N_FILES + 1):
+            repoId = 1 if fileId <= 20 else 5
+            fileName = "d%d/f%02d.fits" % (fileId % 3, (fileId * 7) % 100)
+            self.names[repoId].append(fileName)
+            engine.execute("INSERT INTO File (fileId, fRepoId, fileName, size, "
+                           "onDisk) VALUES (?, ?, ?, ?, 1)", fileId, repoId,
+                           fileName, fileId * 2880)
+            engine.execute("INSERT INTO FitsMeta VALUES (?, ?)", fileId,
+                           1 + fileId % 2)
+        self.engine = RecordingEngine(engine)
+        app = Flask(__name__)
+        app.config["default_engine"] = self.engine
+        app.config["metaserv_cache_size"] = 0
+        app.register_blueprint(metaREST_v0.metaREST, url_prefix='/meta/v0')
+        self.client = app.test_client()
+
+    def _get(self, url, status=200):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status)
+        return json.loads(resp.data)
+
+    def _pages(self, url):
+        results = []
+        pages = 0
+        while url:
+            resp = self._get(url)
+            results.extend(resp["results"])
+            url = resp["next"]
+            pages += 1
+        return (results, pages)
+
+    def testLevels(self):
+        self.assertEqual(self._get("/meta/v0/image")["results"], [["L1"], ["L2"]])
+
+    def testRepos(self):
+        resp = self._get("/meta/v0/image/L1")
+        self.assertEqual([r["repoId"] for r in resp["results"]], [1, 2, 5])
+        self.assertEqual(resp["results"][0]["fileCount"], 1000000)
+        self.assertEqual(resp["results"][0]["ingestTime"], "2015-06-01 12:00:00")
+        self.assertEqual(resp["results"][2]["fileCount"], 4)
+        self.assertIsNone(resp["next"])
+        # counts are read from FileRepoTypes
+        self.assertFalse([s for s in self.engine.statements if "COUNT(" in s])
+        (results, pages) = self._pages("/meta/v0/image/L1?limit=2&fields=shortName,fileCount")
+        self.assertEqual(pages, 2)
+        self.assertEqual(results, [{"shortName": "raw", "fileCount": 1000000},
+                                   {"shortName": "calexp", "fileCount": 7},
+                                   {"shortName": "raw", "fileCount": 4}])
+        self.assertEqual(self._get("/meta/v0/image/L3")["results"], [])
+        for args in ("fields=fileCount,nosuchfield", "fields=,", "limit=0",
+                     "after=" + metaREST_v0._encodeCursor("x")):
+            self._get("/meta/v0/image/L1?" + args, 400)
+
+    def testRepo(self):
+        resp = self._get("/meta/v0/image/L2/raw")
+        self.assertEqual(len(resp["results"]), 1)
+        self.assertEqual(resp["results"][0]["url"], "/data/3")
+        self.assertIsNone(resp["results"][0]["fileCount"])
+        resp = self._get("/meta/v0/image/L1/raw?fields=repoId,fileCount")
+        self.assertEqual(resp["results"], [{"repoId": 1, "fileCount": 1000000},
+                                           {"repoId": 5, "fileCount": 4}])
+        self.assertEqual(self._get("/meta/v0/image/L1/nosuchrepo", 404)["exception"],
+                         "NotFound")
+        self._get("/meta/v0/image/L1/raw?fields=checksum", 400)
+
+    def testFiles(self):
+        expected = sorted(self.names[1]) + sorted(self.names[5])
+        (results, pages) = self._pages("/meta/v0/image/L1/raw/files?limit=4")
+        self.assertEqual([r["fileName"] for r in results], expected)
+        self.assertEqual(pages, 7)
+        first = [r for r in results if r["fileId"] == 1][0]
+        self.assertEqual((first["size"], first["hdus"], first["onDisk"]),
+                         (2880, 2, 1))
+        # each page reads ranges of the (fRepoId, fileName) index, with LIMIT
+        resp = self._get("/meta/v0/image/L1/raw/files?limit=4")
+        self.engine.statements = []
+        resp = self._get(resp["next"])
+        reads = [s for s in self.engine.statements if "FROM File " in s]
+        self.assertEqual(len(reads), 1)
+        self.assertIn("fileName > :afterName", reads[0])
+        self.assertIn("LIMIT :pageLimit", reads[0])
+        self.assertNotIn("COUNT(", reads[0])
+        # a page across repositories
+        (results, pages) = self._pages(
+            "/meta/v0/image/L1/raw/files?limit=15&fields=fileName")
+        self.assertEqual(results, [{"fileName": n} for n in expected])
+        self.assertEqual(pages, 2)
+        resp = self._get("/meta/v0/image/L1/calexp/files")
+        self.assertEqual(resp, {"results": [], "next": None})
+        self._get("/meta/v0/image/L1/nosuchrepo/files", 404)
+        for args in ("fields=hdu", "after=" + metaREST_v0._encodeCursor([1, 2]),
+                     "after=" + metaREST_v0._encodeCursor("x")):
+            self._get("/meta/v0/image/L1/raw/files?" + args, 400)
+
+
+####################################################################################
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
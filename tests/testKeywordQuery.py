@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for queries of files by FITS keywords (keywordQuery, and
+/image/<level>/<repo>/query). Queries run on an in-memory SQLite database.
+"""
+
+import json
+import logging as log
+import unittest
+
+from flask import Flask
+import sqlalchemy
+
+from lsst.dax.metaserv import metaREST_v0
+from lsst.dax.metaserv.keywordQuery import Predicate, findFiles, parseQuery
+
+N_FILES = 60
+
+
+class RecordingEngine(object):
+    """
+    Engine recording the statements it executes.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def execute(self, query, **params):
+        self.statements.append(str(query))
+        return self.engine.execute(query, **params)
+
+
+class TestKeywordQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite://")
+        self.engine.execute("CREATE TABLE Repo (repoId INT, repoType TEXT, "
+                            "lsstLevel TEXT, shortName TEXT)")
+        self.engine.execute("CREATE TABLE File (fileId INT, fRepoId INT, "
+                            "fileName TEXT)")
+        self.engine.execute("CREATE TABLE FitsUnstructuredMeta (fileId INT, "
+                            "fitsKey TEXT, hdu INT, stringValue TEXT, "
+                            "intValue INT, doubleValue DOUBLE)")
+        self.engine.execute("INSERT INTO Repo VALUES (1, 'file', 'L1', 'raw'), "
+                            "(2, 'file', 'L1', 'other')")
+        self.files = {}
+        for fileId in range(1, N_FILES + 1):
+            keys = {"FILTER": "ugrizy"[fileId % 6],
+                    "AIRMASS": 1.0 + (fileId % 10) / 10.,
+                    "VISIT": fileId * 2,
+                    "SIMULATE": "T" if fileId % 15 == 0 else "F"}
+            self.files[fileId] = keys
+            self.engine.execute("INSERT INTO File VALUES (?, ?, ?)", fileId,
+                                1 if fileId <= 50 else 2, "f%02d.fits" % fileId)
+            for hdu in (0, 1):
+                for (key, value) in keys.items():
+                    if isinstance(value, str):
+                        row = (value, None, None)
+                    elif isinstance(value, int):
+                        row = (str(value), value, float(value))
+                    else:
+                        row = (repr(value), None, value)
+                    self.engine.execute(
+                        "INSERT INTO FitsUnstructuredMeta VALUES (?, ?, ?, ?, ?, ?)",
+                        (fileId, key, hdu) + row)
+
+    def _expected(self, predicates):
+        ops = {"=": lambda a, b: a == b, "!=": lambda a, b: a != b,
+               "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+               ">": lambda a, b: a > b, ">=": lambda a, b: a >= b}
+        return [f for (f, keys) in sorted(self.files.items())
+                if all(p.key in keys and ops[p.op](keys[p.key], p.value)
+                       for p in predicates)]
+
+    def testParse(self):
+        self.assertEqual(parseQuery("FILTER='r' AND AIRMASS<1.2"),
+                         [Predicate("FILTER", "=", "r"),
+                          Predicate("AIRMASS", "<", 1.2)])
+        self.assertEqual(parseQuery(" date-obs >= '2015-01-01 ' and SIMULATE<>T "),
+                         [Predicate("DATE-OBS", ">=", "2015-01-01"),
+                          Predicate("SIMULATE", "!=", "T")])
+        self.assertEqual(parseQuery("OBJECT='it''s'"),
+                         [Predicate("OBJECT", "=", "it's")])
+        for query in ("", "FILTER", "FILTER='r' AIRMASS<1.2", "FILTER=r",
+                      "FILTER='r", "LONGKEYWORD=1", "FILTER='r' OR VISIT=2",
+                      " AND ".join(["VISIT=1"] * 17)):
+            self.assertRaises(ValueError, parseQuery, query)
+
+    def testFindFiles(self):
+        queries = ["FILTER='r' AND AIRMASS<1.2", "VISIT>=20 AND VISIT<=40",
+                   "SIMULATE=T AND FILTER!='u'", "FILTER='x' AND VISIT>0",
+                   "AIRMASS>=1.5 AND FILTER>'i' AND VISIT<100",
+                   "AIRMASS=1.2", "NOSUCHKY=1 AND VISIT>0"]
+        for query in queries:
+            predicates = parseQuery(query)
+            expected = self._expected(predicates)
+            for probeCost in (0, 1000000):
+                found = findFiles(self.engine, predicates, estimateCap=20,
+                                  probeCost=probeCost)
+                self.assertEqual(found.tolist(), expected)
+
+    def testPlan(self):
+        # the most selective predicate is read first, the others probed
+        engine = RecordingEngine(self.engine)
+        predicates = parseQuery("AIRMASS<1.8 AND SIMULATE=T")
+        found = findFiles(engine, predicates)
+        self.assertEqual(found.tolist(), self._expected(predicates))
+        reads = [s for s in engine.statements if not s.startswith("SELECT COUNT")]
+        self.assertIn("stringValue", reads[0])
+        self.assertNotIn("IN (", reads[0])
+        self.assertIn("doubleValue", reads[1])
+        self.assertIn("fileId IN (15, 30, 45, 60)", reads[1])
+        # nothing else is read once no file is left
+        engine.statements = []
+        findFiles(engine, parseQuery("VISIT>0 AND FILTER='x'"))
+        self.assertEqual(len(engine.statements), 3)
+
+    def testFindPage(self):
+        queries = ["FILTER='r' AND AIRMASS<1.5", "VISIT>=20 AND VISIT<=110",
+                   "AIRMASS>1.1 AND SIMULATE=F", "FILTER='x' AND VISIT>0"]
+        for query in queries:
+            predicates = parseQuery(query)
+            inRepo = [f for f in self._expected(predicates) if f <= 50]
+            for after in (None, 0, 12, 48):
+                expected = [f for f in inRepo if after is None or f > after]
+                for (limit, probeCost) in ((1, 10), (3, 0), (3, 1000000), (100, 10)):
+                    found = findFiles(self.engine, predicates, [1], after, limit,
+                                      estimateCap=20, probeCost=probeCost)
+                    self.assertEqual(found.tolist(), expected[:limit])
+        self.assertEqual(findFiles(self.engine, parseQuery("VISIT>0"), [], None,
+                                   3).tolist(), [])
+
+    def testPagePlan(self):
+        # a page reads the first matches of an equality in the repository,
+        # after the cursor, a batch at a time
+        engine = RecordingEngine(self.engine)
+        predicates = parseQuery("AIRMASS<1.8 AND SIMULATE=F")
+        found = findFiles(engine, predicates, [2], 52, 2, probeCost=1)
+        self.assertEqual(found.tolist(), [53, 54])
+        reads = [s for s in engine.statements if not s.startswith("SELECT COUNT")]
+        # 2 rows (both HDUs of file 53), then 4 rows (files 54 and 55)
+        self.assertEqual(len(reads), 4)
+        for read in reads[::2]:
+            self.assertIn("stringValue", read)
+            self.assertIn("fRepoId IN (2)", read)
+            self.assertIn("fileId > :after ORDER BY fileId LIMIT :size", read)
+        self.assertIn("fileId IN (53)", reads[1])
+        self.assertIn("fileId IN (54, 55)", reads[3])
+        # a range matching few entries is read at once
+        engine.statements = []
+        found = findFiles(engine, parseQuery("AIRMASS>1.85 AND SIMULATE=F"),
+                          [2], 52, 2)
+        self.assertEqual(found.tolist(), [59])
+        reads = [s for s in engine.statements if not s.startswith("SELECT COUNT")]
+        self.assertIn("doubleValue", reads[0])
+        self.assertNotIn("LIMIT", reads[0])
+
+    def testEndpoint(self):
+        app = Flask(__name__)
+        app.config["default_engine"] = self.engine
+        app.config["metaserv_cache_size"] = 0
+        app.register_blueprint(metaREST_v0.metaREST, url_prefix='/meta/v0')
+        client = app.test_client()
+        predicates = parseQuery("FILTER='r' AND AIRMASS<1.5")
+        expected = [f for f in self._expected(predicates) if f <= 50]
+        url = "/meta/v0/image/L1/raw/query?where=FILTER%3D'r'%20AND%20" \
+              "AIRMASS<1.5&limit=2"
+        results = []
+        while url:
+            resp = json.loads(client.get(url).data)
+            self.assertLessEqual(len(resp["results"]), 2)
+            results.extend(resp["results"])
+            url = resp["next"]
+        self.assertEqual([r[0] for r in results], expected)
+        self.assertEqual(results[0][1], "f%02d.fits" % expected[0])
+        for args in ("", "where=FILTER", "where=VISIT>1&after=" +
+                     metaREST_v0._encodeCursor("x")):
+            resp = client.get("/meta/v0/image/L1/raw/query?" + args)
+            self.assertEqual(resp.status_code, 400)
+
+
+####################################################################################
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
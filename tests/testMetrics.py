@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+"""
+This is a unittest for request metrics (metrics, and /meta/v0/metrics).
+"""
+
+import json
+import logging as log
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+from lsst.dax.metaserv import metaREST_v0
+from lsst.dax.metaserv.metrics import Histogram, Metrics, timedPool
+
+
+def _samples(text):
+    """
+    Return dictionary: sample name with labels -> value, of metrics in the
+    Prometheus text format.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            (name, value) = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetrics(unittest.TestCase):
+
+    def testHistogram(self):
+        h = Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 7, 8):
+            h.observe(value)
+        self.assertEqual(h.samples(), [("1.0", 2), ("2.0", 3), ("5.0", 4),
+                                       ("+Inf", 6)])
+        self.assertEqual(h.sum, 21.)
+
+    def testRender(self):
+        m = Metrics(latencyBuckets=(0.1, 1.))
+        m.observeRequest("/a", "GET", 200, 0.05, {"db": 0.02, "serialize": 0.5}, 100)
+        m.observeRequest("/a", "GET", 200, 2., {"db": 1.5})
+        m.observeRequest('/b"\n', "GET", 500, 0.01, errors=["OperationalError"])
+        m.countError("/a", "ValueError")
+        m.observePoolWait("host:3306", 0.2)
+        text = m.render()
+        self.assertIn("# TYPE metaserv_requests_total counter", text)
+        self.assertIn("# TYPE metaserv_phase_duration_seconds histogram", text)
+        samples = _samples(text)
+        self.assertEqual(samples['metaserv_requests_total{route="/a",method="GET",'
+                                 'status="200"}'], 2)
+        self.assertEqual(samples['metaserv_requests_total{route="/b\\"\\n",'
+                                 'method="GET",status="500"}'], 1)
+        self.assertEqual(samples['metaserv_request_duration_seconds_bucket{'
+                                 'route="/a",le="0.1"}'], 1)
+        self.assertEqual(samples['metaserv_request_duration_seconds_bucket{'
+                                 'route="/a",le="+Inf"}'], 2)
+        self.assertEqual(samples['metaserv_request_duration_seconds_count{'
+                                 'route="/a"}'], 2)
+        self.assertAlmostEqual(samples['metaserv_phase_duration_seconds_sum{'
+                                       'route="/a",phase="db"}'], 1.52)
+        self.assertEqual(samples['metaserv_phase_duration_seconds_count{'
+                                 'route="/a",phase="serialize"}'], 1)
+        self.assertEqual(samples['metaserv_response_bytes_count{route="/a"}'], 1)
+        self.assertEqual(samples['metaserv_errors_total{route="/a",'
+                                 'exception="ValueError"}'], 1)
+        self.assertEqual(samples['metaserv_errors_total{route="/b\\"\\n",'
+                                 'exception="OperationalError"}'], 1)
+        self.assertEqual(samples['metaserv_pool_checkout_wait_seconds_bucket{'
+                                 'server="host:3306",le="1.0"}'], 1)
+
+    def testTimedPool(self):
+        waits = []
+        tmpDir = tempfile.mkdtemp()
+        try:
+            engine = sqlalchemy.create_engine(
+                "sqlite:///" + os.path.join(tmpDir, "metrics.db"),
+                poolclass=timedPool(QueuePool, waits.append), pool_size=1)
+            engine.execute("SELECT 1")
+            engine.execute("SELECT 1")
+            self.assertEqual(len(waits), 2)
+            self.assertTrue(all(w >= 0 for w in waits))
+            # the pool class is kept when the engine is disposed
+            engine.dispose()
+            engine.execute("SELECT 1")
+            self.assertEqual(len(waits), 3)
+            engine.dispose()
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testEndpoint(self):
+        engine = sqlalchemy.create_engine("sqlite://")
+        engine.execute("CREATE TABLE Repo (repoId INT, repoType TEXT, "
+                       "lsstLevel TEXT, shortName TEXT)")
+        engine.execute("INSERT INTO Repo VALUES (1, 'file', 'L1', 'raw'), "
+                       "(2, 'file', 'L2', 'raw'), (3, 'db', 'L2', NULL)")
+        app = Flask(__name__)
+        app.config["default_engine"] = engine
+        app.config["metaserv_cache_size"] = 0
+        app.config["metaserv_stream_threshold"] = 1
+        app.register_blueprint(metaREST_v0.metaREST, url_prefix='/meta/v0')
+        client = app.test_client()
+        self.assertEqual(client.get("/meta/v0/image?limit=5").status_code, 200)
+        self.assertEqual(client.get("/meta/v0/image?limit=5").status_code, 200)
+        self.assertEqual(client.get("/meta/v0/image?limit=0").status_code, 400)
+        self.assertEqual(client.get("/meta/v0/image/L1/x?fields=shortName").status_code, 404)
+        resp = client.get("/meta/v0/image/L1/x?fields=shortName", headers={"accept": "text/html"})
+        self.assertEqual(resp.status_code, 404)
+        # streamed
+        resp = client.get("/meta/v0/image")
+        self.assertEqual(json.loads(resp.data)["results"], [["L1"], ["L2"]])
+
+        resp = client.get("/meta/v0/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["Content-Type"].startswith("text/plain"))
+        samples = _samples(resp.data)
+        image = 'route="/meta/v0/image"'
+        repo = 'route="/meta/v0/image/<string:lsstLevel>/<string:repo>"'
+        self.assertEqual(samples['metaserv_requests_total{%s,method="GET",'
+                                 'status="200"}' % image], 3)
+        self.assertEqual(samples['metaserv_requests_total{%s,method="GET",'
+                                 'status="400"}' % image], 1)
+        self.assertEqual(samples['metaserv_request_duration_seconds_count{%s}'
+                                 % image], 4)
+        self.assertEqual(samples['metaserv_errors_total{%s,exception="ValueError"}'
+                                 % image], 1)
+        self.assertEqual(samples['metaserv_errors_total{%s,exception="NotFound"}'
+                                 % repo], 2)
+        self.assertEqual(samples['metaserv_phase_duration_seconds_count{%s,'
+                                 'phase="db"}' % image], 3)
+        self.assertEqual(samples['metaserv_phase_duration_seconds_count{%s,'
+                                 'phase="serialize"}' % image], 4)
+        self.assertEqual(samples['metaserv_phase_duration_seconds_count{%s,'
+                                 'phase="render"}' % repo], 1)
+        # sizes of the two buffered pages, then of the streamed response
+        self.assertEqual(samples['metaserv_response_bytes_count{%s}' % image], 4)
+        self.assertGreater(samples['metaserv_response_bytes_sum{%s}' % image], 0)
+        self.assertTrue(re.search(r'metaserv_request_duration_seconds_bucket\{'
+                                  r'route="/meta/v0/image",le="0.0005"\} \d+',
+                                  resp.data))
+
+
+####################################################################################
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+This is a unittest for the ResultCache and GenerationTracker classes.
+"""
+
+import unittest
+
+from lsst.dax.metaserv.resultCache import (GenerationTracker, ResultCache,
+                                           invalidateAll)
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(unittest.TestCase):
+
+    def testLru(self):
+        """
+        Least recently used entries are evicted first.
+        """
+        c = ResultCache(maxSize=2, ttl=100)
+        c.put("a", 1)
+        c.put("b", 2)
+        self.assertEqual(c.get("a"), 1)
+        c.put("c", 3)
+        self.assertEqual(c.get("b"), None)
+        self.assertEqual(c.get("a"), 1)
+        self.assertEqual(c.get("c"), 3)
+        stats = c.stats()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 2)
+
+    def testTtl(self):
+        """
+        Entries expire after ttl seconds.
+        """
+        timer = FakeTimer()
+        c = ResultCache(maxSize=10, ttl=5, timer=timer)
+        c.put("a", 1)
+        timer.now = 5
+        self.assertEqual(c.get("a"), 1)
+        timer.now = 6
+        self.assertEqual(c.get("a"), None)
+        self.assertEqual(c.stats()["expirations"], 1)
+
+    def testInvalidate(self):
+        """
+        Invalidation drops entries of the given db and catalog-wide entries.
+        """
+        c = ResultCache(maxSize=10, ttl=100)
+        c.put("dbs", 1)
+        c.put("db1", 2, dbName="db1")
+        c.put("db2", 3, dbName="db2")
+        invalidateAll("db1")
+        self.assertEqual(c.get("dbs"), None)
+        self.assertEqual(c.get("db1"), None)
+        self.assertEqual(c.get("db2"), 3)
+        c.invalidate()
+        self.assertEqual(c.get("db2"), None)
+
+    def testDisabled(self):
+        c = ResultCache(maxSize=0)
+        c.put("a", 1)
+        self.assertEqual(c.get("a"), None)
+
+    def testGenerationPolling(self):
+        """
+        Generation number is re-read only after pollInterval, or after
+        a local write.
+        """
+        timer = FakeTimer()
+        reads = []
+        def readFunc():
+            reads.append(1)
+            return len(reads)
+        t = GenerationTracker(readFunc, pollInterval=5, timer=timer)
+        self.assertEqual(t.current(), 1)
+        timer.now = 4
+        self.assertEqual(t.current(), 1)
+        timer.now = 5
+        self.assertEqual(t.current(), 2)
+        invalidateAll()
+        self.assertEqual(t.current(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+This is a unittest for the SchemaCache class.
+"""
+
+import logging as log
+import os
+import random
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from lsst.dax.metaserv import schemaToMeta
+from lsst.dax.metaserv.schemaCache import SchemaCache
+from lsst.dax.metaserv.schemaToMeta import parseSchema
+from testSchemaToMeta import _randomSchema
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def _entries(self):
+        return sorted(os.listdir(self.cacheDir))
+
+    def testHit(self):
+        """
+        The second parse of the same content is a hit, and gives the same result.
+        """
+        cache = SchemaCache(os.path.join(self.cacheDir, "sub"))
+        schema = _randomSchema(random.Random(2), 30)
+        expected = parseSchema(StringIO(schema))
+        self.assertEqual(parseSchema(StringIO(schema), cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(parseSchema(StringIO(schema), cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # returned records are not shared
+        tables = cache.tables(StringIO(schema))
+        tables[0].columns[0].ord_pos = 1
+        self.assertIsNone(cache.tables(StringIO(schema))[0].columns[0].ord_pos)
+
+        # a different content, or a different parser version, is a miss
+        parseSchema(StringIO(schema + "\n"), cache)
+        self.assertEqual(cache.misses, 2)
+        version = schemaToMeta.PARSER_VERSION
+        schemaToMeta.PARSER_VERSION = version + 1
+        try:
+            parseSchema(StringIO(schema), cache)
+        finally:
+            schemaToMeta.PARSER_VERSION = version
+        self.assertEqual(cache.misses, 3)
+
+    def testEviction(self):
+        """
+        Least recently used entries are removed above the size cap.
+        """
+        cache = SchemaCache(self.cacheDir)
+        schemas = [_randomSchema(random.Random(i), 20) for i in range(3)]
+        cache.tables(StringIO(schemas[0]))
+        entrySize = os.path.getsize(os.path.join(self.cacheDir,
+                                                 self._entries()[0]))
+        cache.maxSize = 2.5 * entrySize
+        cache.tables(StringIO(schemas[1]))
+        for e in self._entries():
+            os.utime(os.path.join(self.cacheDir, e), (0, 0))
+        cache.tables(StringIO(schemas[1]))     # hit, now most recently used
+        cache.tables(StringIO(schemas[2]))     # miss, evicts schemas[0]
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(self._entries()), 2)
+        cache.tables(StringIO(schemas[1]))
+        self.assertEqual(cache.hits, 2)
+        cache.tables(StringIO(schemas[0]))
+        self.assertEqual(cache.misses, 4)
+
+    def testCorrupted(self):
+        """
+        Corrupted entries are misses, and are replaced.
+        """
+        cache = SchemaCache(self.cacheDir)
+        schema = _randomSchema(random.Random(3), 5)
+        expected = cache.tables(StringIO(schema))
+        path = os.path.join(self.cacheDir, self._entries()[0])
+        with open(path, "wb") as f:
+            f.write("garbage")
+        tables = cache.tables(StringIO(schema))
+        self.assertEqual([t.asDict() for t in tables],
+                         [t.asDict() for t in expected])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache.tables(StringIO(schema))
+        self.assertEqual(cache.hits, 1)
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
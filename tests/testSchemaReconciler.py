@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# LSST Data Management System
+# Copyright 2015 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+This is a unittest for the SchemaReconciler class.
+"""
+
+import logging as log
+from StringIO import StringIO
+import time
+import unittest
+
+from lsst.dax.metaserv.metaBException import MetaBException
+from lsst.dax.metaserv.schemaReconciler import SchemaReconciler, typesMatch
+from lsst.dax.metaserv.schemaToMeta import iterSchema
+
+_SCHEMA = """
+CREATE TABLE t1 (
+    id BIGINT NOT NULL,
+    ra DOUBLE,
+    decl FLOAT(0),
+    name VARCHAR(64),
+    flag BIT
+);
+CREATE TABLE t2 (
+    a INT,
+    b INT
+);
+CREATE TABLE t3 (
+    x INT
+);
+"""
+
+_DB = {"t1": {"id": (1, "bigint(20)"),
+              "ra": (2, "double"),
+              "decl": (3, "float"),
+              "name": (4, "varchar(64)"),
+              "flag": (5, "bit(1)")},
+       "t2": {"a": (1, "int(11)"),
+              "b": (2, "int(11)")},
+       "t3": {"x": (1, "int(11)")}}
+
+
+def _reconcile(schema, dbColumns):
+    reconciler = SchemaReconciler(dbColumns)
+    tables = list(iterSchema(StringIO(schema)))
+    results = [reconciler.check(t) for t in tables]
+    return (tables, results, reconciler.finish())
+
+
+class TestSchemaReconciler(unittest.TestCase):
+
+    def testMatch(self):
+        (tables, results, report) = _reconcile(_SCHEMA, _DB)
+        self.assertEqual(results, [True, True, True])
+        self.assertTrue(report.matches())
+        self.assertIsNone(report.error())
+        self.assertEqual((report.nTables, report.nColumns), (3, 8))
+        self.assertEqual(report.ordinalDrift, [])
+        self.assertEqual(report.typeMismatches, [])
+        self.assertEqual([c.ord_pos for c in tables[0].columns], [1, 2, 3, 4, 5])
+
+    def testAllMismatches(self):
+        """
+        Every mismatch is reported, the error describes the first one.
+        """
+        db = dict(_DB)
+        db["t1"] = dict(_DB["t1"], extra=(6, "int(11)"), ra=(2, "float"))
+        db["t2"] = {"a": (2, "int(11)"), "b": (1, "int(11)")}
+        db["t4"] = {"y": (1, "int(11)")}
+        del db["t3"]
+        (tables, results, report) = _reconcile(
+            _SCHEMA + "CREATE TABLE t2 (\n    a INT\n);\n", db)
+        self.assertEqual(results, [False, True, False, False])
+        self.assertFalse(report.matches())
+        self.assertEqual(report.missingTables, ["t3"])
+        self.assertEqual(report.extraTables, ["t4"])
+        self.assertEqual(report.duplicateTables, ["t2"])
+        self.assertEqual(report.missingColumns, [])
+        self.assertEqual(report.extraColumns, [("t1", "extra")])
+        self.assertEqual(report.ordinalDrift, [("t2", "a", 1, 2), ("t2", "b", 2, 1)])
+        self.assertEqual(report.typeMismatches, [("t1", "ra", "DOUBLE", "float")])
+        e = report.error()
+        self.assertIsInstance(e, MetaBException)
+        self.assertTrue("extra" in str(e))
+        self.assertTrue("tables not in db (1):\n  t3" in str(report))
+
+    def testMissingColumn(self):
+        db = dict(_DB, t3={"z": (1, "int(11)")})
+        (tables, results, report) = _reconcile(_SCHEMA, db)
+        self.assertEqual(report.missingColumns, [("t3", "x")])
+        self.assertEqual(report.extraColumns, [("t3", "z")])
+        self.assertIsNone(tables[2].columns[0].ord_pos)
+
+    def testTypesMatch(self):
+        for (a, b) in (("INT", "int(11)"), ("INTEGER", "int(10) unsigned"),
+                       ("FLOAT", "float"), ("FLOAT(30)", "double"),
+                       ("DOUBLE", "double"), ("REAL", "double"),
+                       ("CHAR", "char(1)"), ("DECIMAL", "decimal(10,0)"),
+                       ("DECIMAL(10,", "decimal(10,2)"), ("BOOL", "tinyint(1)")):
+            self.assertTrue(typesMatch(a, b), (a, b))
+        for (a, b) in (("VARCHAR(32)", "varchar(64)"), ("FLOAT", "double"),
+                       ("INT", "bigint(20)"), ("CHAR", "char(8)")):
+            self.assertFalse(typesMatch(a, b), (a, b))
+
+    def testLinear(self):
+        """
+        100k columns are reconciled quickly.
+        """
+        nTables, nColumns = 1000, 100
+        schema = "".join("CREATE TABLE t%d (\n%s);\n" % (t, "".join(
+            "    c%d INT,\n" % c for c in range(nColumns)))
+                         for t in range(nTables))
+        db = dict(("t%d" % t, dict(("c%d" % c, (c + 1, "int(11)"))
+                                   for c in range(nColumns)))
+                  for t in range(nTables))
+        tables = list(iterSchema(StringIO(schema)))
+        start = time.time()
+        reconciler = SchemaReconciler(db)
+        for t in tables:
+            reconciler.check(t)
+        report = reconciler.finish()
+        elapsed = time.time() - start
+        self.assertTrue(report.matches())
+        self.assertEqual(report.nColumns, nTables * nColumns)
+        log.info("Reconciled %d columns in %.3f s", report.nColumns, elapsed)
+        self.assertLess(elapsed, 5)
+
+
+def main():
+    log.basicConfig(
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s',
+        datefmt='%m/%d/%Y %I:%M:%S',
+        level=log.DEBUG)
+
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
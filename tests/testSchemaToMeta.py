@@ -27,8 +27,13 @@ This is a unittest for the SchemaToMeta class.
 """
 
 # standard library
+import bz2
+import gzip
+import itertools
 import logging as log
 import os
+import random
+from StringIO import StringIO
 import tempfile
 import unittest
 
@@ -38,7 +43,76 @@ import unittest
 # pp.pprint(theTable)
 
 # local
-from lsst.dax.metaserv.schemaToMeta import parseSchema
+from lsst.dax.metaserv.schemaToMeta import (iterSchema, openSchema, parseSchema,
+                                            parseSchemaParallel)
+import schemaToMetaReference
+
+
+def _randomSchema(rnd, nTables):
+    """
+    Generate a synthetic schema exercising the constructs understood by
+    parseSchema: multi-line descriptions, units, ucds, defaults, indexes,
+    commented-out tables, stray lines.
+    """
+    types = ["INT", "BIGINT", "DOUBLE", "FLOAT", "FLOAT(0)", "CHAR(1)",
+             "VARCHAR(255)", "DATETIME", "BIT(1)"]
+    lines = []
+    for t in range(nTables):
+        if rnd.random() < 0.1:
+            lines.append("-- CREATE TABLE commented%d" % t)
+            lines.append("--    x int,")
+            lines.append("-- ) ENGINE=MyISAM;")
+        lines.append("CREATE TABLE t%d%s" % (t, rnd.choice(["", " (", "  ("])))
+        r = rnd.random()
+        if r < 0.3:
+            lines.append("    -- <descr>Table t%d.</descr>" % t)
+        elif r < 0.6:
+            lines.append("    -- <descr>Table t%d" % t)
+            for i in range(rnd.randint(0, 3)):
+                lines.append("    -- spans line %d" % i)
+            lines.append("    -- %s</descr>" % rnd.choice(["", "end. "]))
+        elif r < 0.7:
+            lines.append("    -- not a description")
+        if "(" not in lines[-1] or lines[-1].lstrip().startswith("--"):
+            lines.append("(")
+        cols = []
+        for c in range(rnd.randint(1, 12)):
+            name = "c%d_%d" % (t, c)
+            cols.append(name)
+            line = "    %s %s" % (name, rnd.choice(types))
+            if rnd.random() < 0.3:
+                line += " NOT NULL"
+            if rnd.random() < 0.3:
+                line += " DEFAULT %s" % rnd.choice(["0", "'x'", "NULL", "1.5"])
+            lines.append(line + ",")
+            r = rnd.random()
+            if r < 0.3:
+                lines.append("        -- <descr>Column %s.</descr>" % name)
+            elif r < 0.5:
+                lines.append("        -- <descr>Column %s" % name)
+                lines.append("        -- continued")
+                lines.append("        -- </descr>")
+            elif r < 0.6:
+                lines.append("        -- dangling comment")
+            if rnd.random() < 0.3:
+                lines.append("        -- <unit>deg</unit>")
+            if rnd.random() < 0.3:
+                lines.append("        -- <ucd>pos.eq.ra;meta.main</ucd>")
+            if rnd.random() < 0.05:
+                lines.append("")
+        for i in range(rnd.randint(0, 3)):
+            kind = rnd.choice(["PRIMARY KEY", "KEY idx%d" % i,
+                               "INDEX idx%d" % i, "UNIQUE uq%d" % i])
+            idxCols = rnd.sample(cols, rnd.randint(1, min(3, len(cols))))
+            idxCols = [c + rnd.choice(["", " ASC", " DESC"]) for c in idxCols]
+            lines.append("    %s (%s)," % (kind, ", ".join(idxCols)))
+        lines.append(rnd.choice([") ENGINE=MyISAM;", ") ENGINE = InnoDB;",
+                                 ") TYPE=MyISAM;", ");", ")"]))
+        lines.append("")
+        if rnd.random() < 0.1:
+            lines.append("SET foreign_key_checks = 0;")
+    return "\n".join(lines) + "\n"
+
 
 class TestS2M(unittest.TestCase):
 
@@ -204,6 +278,167 @@ CREATE TABLE t (
         self.assertEqual(theTable["t"]["indexes"][3]["type"], "UNIQUE")
 
 
+    def testReference(self):
+        """
+        Differential test: parseSchema must produce exactly the same structure
+        as the reference (regex-per-line) parser on large synthetic schemas.
+        """
+        rnd = random.Random(20150901)
+        for i in range(20):
+            (fd, fName) = tempfile.mkstemp()
+            theFile = os.fdopen(fd, "w")
+            theFile.write(_randomSchema(rnd, rnd.randint(1, 200)))
+            theFile.close()
+            try:
+                self.assertEqual(parseSchema(fName),
+                                 schemaToMetaReference.parseSchema(fName))
+            finally:
+                os.remove(fName)
+
+
+    def testIterSchema(self):
+        """
+        Test iterating over tables of a file-like object.
+        """
+        tables = iterSchema(StringIO("""
+CREATE TABLE t1 (
+    id int NOT NULL,
+        -- <descr>the t1.id</descr>
+    PRIMARY KEY (id)
+) ENGINE=MyISAM;
+
+CREATE TABLE t2 (
+    v varchar(255) DEFAULT 'x'
+);
+
+CREATE TABLE t3 (
+    w int
+"""))
+        t = next(tables)
+        self.assertEqual(t.name, "t1")
+        self.assertEqual(t.engine, "MyISAM")
+        self.assertIsNone(t.description)
+        self.assertEqual(len(t.columns), 1)
+        self.assertEqual(t.columns[0].name, "id")
+        self.assertEqual(t.columns[0].displayOrder, 1)
+        self.assertTrue(t.columns[0].notNull)
+        self.assertEqual(t.columns[0].description, "the t1.id")
+        self.assertEqual(t.indexes[0].type, "PRIMARY KEY")
+        self.assertRaises(AttributeError, setattr, t, "extra", 1)
+        t = next(tables)
+        self.assertEqual(t.name, "t2")
+        self.assertEqual(t.columns[0].defaultValue, "'x'")
+        self.assertEqual(t.asDict(), {"columns": [{"name": "v",
+                                                   "displayOrder": "1",
+                                                   "type": "varchar(255)",
+                                                   "notNull": False,
+                                                   "defaultValue": "'x'"}]})
+        t = next(tables) # not terminated, yielded at the end of input
+        self.assertEqual(t.name, "t3")
+        self.assertRaises(StopIteration, next, tables)
+
+
+    def testCompressed(self):
+        """
+        Test reading gzip and bz2 compressed files, and a missing file.
+        """
+        schema = _randomSchema(random.Random(1), 10)
+        (fd, fName) = tempfile.mkstemp()
+        os.close(fd)
+        theFile = open(fName, "w")
+        theFile.write(schema)
+        theFile.close()
+        expected = parseSchema(fName)
+        self.assertEqual(len(expected), 10)
+        for (suffix, openF) in ((".gz", gzip.open), (".bz2", bz2.BZ2File)):
+            theFile = openF(fName + suffix, "w")
+            theFile.write(schema)
+            theFile.close()
+            try:
+                self.assertEqual(parseSchema(fName + suffix), expected)
+                with openSchema(fName + suffix) as f:
+                    self.assertEqual(sorted(t.name for t in iterSchema(f)),
+                                     sorted(expected))
+            finally:
+                os.remove(fName + suffix)
+        os.remove(fName)
+        self.assertRaises(IOError, parseSchema, fName)
+
+
+    def _writeFiles(self, contents):
+        fNames = []
+        for content in contents:
+            (fd, fName) = tempfile.mkstemp()
+            theFile = os.fdopen(fd, "w")
+            theFile.write(content)
+            theFile.close()
+            fNames.append(fName)
+        return fNames
+
+    def _parseSerial(self, fNames):
+        files = [open(fName) for fName in fNames]
+        try:
+            return dict((t.name, t.asDict())
+                        for t in iterSchema(itertools.chain(*files)))
+        finally:
+            for f in files:
+                f.close()
+
+    def testParallel(self):
+        """
+        Parallel parsing of a schema split into files gives the same result as
+        serial parsing of all their lines.
+        """
+        rnd = random.Random(7)
+        for i in range(5):
+            lines = _randomSchema(rnd, rnd.randint(1, 300)).splitlines(True)
+            cuts = sorted(rnd.sample(range(len(lines)), 2))
+            contents = ["".join(lines[:cuts[0]]), "".join(lines[cuts[0]:cuts[1]]),
+                        "".join(lines[cuts[1]:])]
+            contents[1] = contents[1].rstrip("\n") # file without a newline at end
+            fNames = self._writeFiles(contents)
+            try:
+                expected = self._parseSerial(fNames)
+                for workers in (1, 3):
+                    self.assertEqual(parseSchemaParallel(fNames, workers, 5),
+                                     expected)
+            finally:
+                for fName in fNames:
+                    os.remove(fName)
+
+    def testParallelOpenDescr(self):
+        """
+        A column description left open in one chunk continues in the next one.
+        """
+        fNames = self._writeFiles(["""
+CREATE TABLE t1 (
+    a int,
+        -- <descr>never closed
+    b int
+);
+CREATE TABLE t2 (
+    c int,
+        -- <descr>closed</descr>
+        -- continued from t1.a
+        -- </descr>
+    d int
+        -- not a description
+);
+CREATE TABLE t3 (
+    e int,
+        -- <descr>e</descr>
+        -- not a description
+);
+"""])
+        try:
+            expected = self._parseSerial(fNames)
+            self.assertEqual(expected["t2"]["columns"][0]["description"],
+                             "closed continued from t1.a")
+            self.assertEqual(parseSchemaParallel(fNames, 2, 2), expected)
+        finally:
+            os.remove(fNames[0])
+
+
 def main():
     log.basicConfig(
         format='%(asctime)s %(name)s %(levelname)s: %(message)s',
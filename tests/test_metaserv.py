@@ -13,6 +13,7 @@ class MockResults(list):
         self.cursor = MagicMock()
         self.cursor.description = description
         self.cursor.description_flags = [0 for _ in description]
+        self.close = MagicMock()
         # If first is called, just return the first row
         self.first = lambda: self
 
@@ -33,7 +34,8 @@ class TestMySqlQuery(unittest.TestCase):
         "/meta/v0/db/L2":
             "SELECT dbName FROM Repo JOIN DbRepo on (repoId=dbRepoId) WHERE lsstLevel = :lsstLevel",
         "/meta/v0/db/L2/DC_W13_Stripe82/tables":
-            "SELECT table_name FROM information_schema.tables WHERE table_schema=:dbName",
+            "SELECT table_name FROM information_schema.tables WHERE table_schema=:dbName "
+            "ORDER BY table_name",
         "/meta/v0/db/L2/DC_W13_Stripe82/tables/Science_Ccd_Exposure/schema":
             "SHOW CREATE TABLE DC_W13_Stripe82.Science_Ccd_Exposure"
     }
@@ -45,16 +47,22 @@ class TestMySqlQuery(unittest.TestCase):
         "SELECT dbName FROM Repo JOIN DbRepo on (repoId=dbRepoId) WHERE lsstLevel = :lsstLevel":
             [["metaServ_baselineSchema"]],
         # Vector result (result is truncated for test brevity)
-        "SELECT table_name FROM information_schema.tables WHERE table_schema=:dbName":
+        "SELECT table_name FROM information_schema.tables WHERE table_schema=:dbName "
+            "ORDER BY table_name":
             [["AvgForcedPhot"], ["AvgForcedPhotYearly"]],
         # Scalar result (result is truncated for test brevity)
         "SHOW CREATE TABLE DC_W13_Stripe82.Science_Ccd_Exposure":
             ["Science_Ccd_Exposure",
              "CREATE TABLE `Science_Ccd_Exposure` (\n  `scienceCcdExposureId` bigint(20) NOT NULL,\n"
-             ") ENGINE=MyISAM DEFAULT CHARSET=latin1"]
+             ") ENGINE=MyISAM DEFAULT CHARSET=latin1"],
+        # Catalog generation number, used for ETags
+        "SELECT generation FROM CatalogGeneration": ["7"],
+        # Location of a database, no host means the metaserv server
+        "SELECT connHost, connPort FROM DbRepo WHERE dbName=:dbName": ["", 0]
     }
 
     def setUp(self):
+        self.queries = dict(self.queries) # tests can add queries
         self.app = Flask(__name__)
         self.client = self.app.test_client()
         self.mock_engine = MagicMock()
@@ -91,6 +99,310 @@ class TestMySqlQuery(unittest.TestCase):
                 expected_row = "<td>" + "</td><td>".join([str(i) for i in expected_results]) + "</td>"
                 self.assertIn(expected_row.replace(" ", ""), resp.data.replace(" ", ""))
 
+    def test_conditional_get(self):
+        url = "/meta/v0/db/L2"
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        self.assertEqual(resp.status_code, 200)
+        self.mock_engine.execute.reset_mock()
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, "")
+        self.assertFalse(self.mock_engine.execute.called)
+        # Different representation, different ETag
+        resp = self.client.get(url, headers={"If-None-Match": etag,
+                                             "accept": "text/html"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_live_schema_not_cached(self):
+        # table listings and schemas come from the data server, not from the
+        # catalog: no generation ETag, no cache
+        self.app.config["metaserv_cache_size"] = 16
+        for url in ("/meta/v0/db/L2/DC_W13_Stripe82/tables",
+                    "/meta/v0/db/L2/DC_W13_Stripe82/tables/Science_Ccd_Exposure/schema"):
+            self.mock_engine.execute.reset_mock()
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("ETag", resp.headers)
+            resp = self.client.get(url, headers={"If-None-Match": "*"})
+            self.assertEqual(resp.status_code, 200)
+            queries = [str(c[0][0]) for c in self.mock_engine.execute.call_args_list]
+            self.assertEqual(queries.count(self.urls[url]), 2)
+        # catalog listings are still cached
+        self.mock_engine.execute.reset_mock()
+        self.client.get("/meta/v0/db/L2")
+        self.client.get("/meta/v0/db/L2")
+        queries = [str(c[0][0]) for c in self.mock_engine.execute.call_args_list]
+        self.assertEqual(queries.count(self.urls["/meta/v0/db/L2"]), 1)
+
+    def test_streaming(self):
+        self.app.config["metaserv_stream_threshold"] = 1
+        url = "/meta/v0/db/L2/DC_W13_Stripe82/tables"
+        expected_results = self.queries[self.urls[url]]
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(json.loads(resp.data)["results"], expected_results)
+        resp = self.client.get(url, headers={"accept": "text/html"})
+        for row in expected_results:
+            self.assertIn("<td>%s</td>" % row[0], resp.data)
+
+    def test_pagination(self):
+        pagedQuery = "SELECT table_name FROM information_schema.tables " \
+                     "WHERE table_schema=:dbName ORDER BY table_name LIMIT :pageLimit"
+        nextQuery = "SELECT table_name FROM information_schema.tables " \
+                    "WHERE table_schema=:dbName AND table_name > :pageAfter " \
+                    "ORDER BY table_name LIMIT :pageLimit"
+        self.queries[pagedQuery] = [["AvgForcedPhot"], ["AvgForcedPhotYearly"]]
+        self.queries[nextQuery] = [["AvgForcedPhotYearly"]]
+        resp = self.client.get("/meta/v0/db/L2/DC_W13_Stripe82/tables?limit=1")
+        json_resp = json.loads(resp.data)
+        self.assertEqual(json_resp["results"], [["AvgForcedPhot"]])
+        self.assertTrue(json_resp["next"].startswith(
+            "/meta/v0/db/L2/DC_W13_Stripe82/tables?"))
+        resp = self.client.get(json_resp["next"])
+        json_resp = json.loads(resp.data)
+        self.assertEqual(json_resp["results"], [["AvgForcedPhotYearly"]])
+        self.assertEqual(json_resp["next"], None)
+        kwargs = self.mock_engine.execute.call_args[1]
+        self.assertEqual(kwargs["pageAfter"], "AvgForcedPhot")
+        self.assertEqual(kwargs["pageLimit"], 2)
+        resp = self.client.get("/meta/v0/db/L2/DC_W13_Stripe82/tables?after=xyz")
+        self.assertEqual(resp.status_code, 400)
+        # forged cursors, valid json of the wrong type for the key column
+        self.mock_engine.execute.reset_mock()
+        for (url, cursor) in (("tables", ["a", "b"]), ("tables", 3),
+                              ("tables/Object/columns", "10"),
+                              ("tables/Object/columns", [10]),
+                              ("tables/Object/columns", {"columnId": 10})):
+            resp = self.client.get("/meta/v0/db/L2/DC_W13_Stripe82/%s?after=%s" %
+                                   (url, metaREST_v0._encodeCursor(cursor)))
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(json.loads(resp.data)["message"], "Invalid cursor")
+        self.assertFalse(self.mock_engine.execute.called)
+
+    def test_describe(self):
+        self.queries["SELECT tableId, tableName, descr FROM DDT_Table "
+                     "JOIN DbRepo USING (dbRepoId) WHERE dbName=:dbName "
+                     "ORDER BY tableId"] = [[1, "Object", "objects"],
+                                            [2, "Source", "sources"],
+                                            [3, "Empty", ""]]
+        self.queries["SELECT tableId, columnId, columnName, ordinalPosition, descr, "
+                     "ucd, units, SUI_displayPrec, SUI_displayCol FROM DDT_Column "
+                     "JOIN DDT_Table USING (tableId) JOIN DbRepo USING (dbRepoId) "
+                     "WHERE dbName=:dbName ORDER BY tableId, ordinalPosition"] = [
+            [1, 10, "objectId", 1, "id", "meta.id", "", None, 1],
+            [1, 11, "ra", 2, "ra", "pos.eq.ra", "deg", 6, 1],
+            [2, 12, "sourceId", 1, "id", "meta.id", "", None, 1]]
+        resp = self.client.get("/meta/v0/db/L2/DC_W13_Stripe82/describe")
+        results = json.loads(resp.data)["results"]
+        self.assertEqual([t["tableName"] for t in results], ["Object", "Source", "Empty"])
+        self.assertEqual([c["columnName"] for c in results[0]["columns"]],
+                         ["objectId", "ra"])
+        self.assertEqual(results[0]["columns"][1]["units"], "deg")
+        self.assertEqual(results[0]["columns"][1]["SUI_displayPrec"], 6)
+        self.assertEqual(len(results[1]["columns"]), 1)
+        self.assertEqual(results[2]["columns"], [])
+
+    def test_batch_tables(self):
+        query = "SELECT Requested.dbName, Requested.tableName, DDT_Table.* " \
+                "FROM (SELECT :d0 AS dbName, :t0 AS tableName UNION ALL " \
+                "SELECT :d1 AS dbName, :t1 AS tableName UNION ALL " \
+                "SELECT :d2 AS dbName, :t2 AS tableName) AS Requested " \
+                "JOIN DbRepo ON (DbRepo.dbName = Requested.dbName) " \
+                "JOIN DDT_Table ON (DDT_Table.dbRepoId = DbRepo.dbRepoId " \
+                "AND DDT_Table.tableName = Requested.tableName)"
+        self.queries[query] = [["db1", "Object", 1, 1, "Object", "objects"],
+                               ["db2", "Object", 2, 2, "Object", "objects 2"]]
+        body = {"tables": [["db1", "Object"],
+                           {"dbName": "db1", "tableName": "Missing"},
+                           ["db1"],
+                           ["db2", "Object"],
+                           ["db1", "Object"]]}
+        resp = self.client.post("/meta/v0/batch/tables", data=json.dumps(body))
+        results = json.loads(resp.data)["results"]
+        self.assertEqual(results[0]["result"], [1, 1, "Object", "objects"])
+        self.assertEqual(results[1]["error"]["exception"], "NotFound")
+        self.assertEqual(results[2]["error"]["exception"], "ValueError")
+        self.assertEqual(results[3]["result"], [2, 2, "Object", "objects 2"])
+        self.assertEqual(results[4]["result"], results[0]["result"])
+        # one query for all pairs, across databases, each pair bound once
+        self.assertEqual(self.mock_engine.execute.call_count, 1)
+        kwargs = self.mock_engine.execute.call_args[1]
+        self.assertEqual(sorted(zip([kwargs["d%d" % i] for i in range(3)],
+                                    [kwargs["t%d" % i] for i in range(3)])),
+                         [("db1", "Missing"), ("db1", "Object"), ("db2", "Object")])
+        self.app.config["metaserv_batch_max_items"] = 2
+        resp = self.client.post("/meta/v0/batch/tables", data=json.dumps(body))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch_tables_chunks(self):
+        side_effect = self.mock_engine.execute.side_effect
+
+        def batch(query, **kwargs):
+            if "AS Requested" not in str(query):
+                return side_effect(query, **kwargs)
+            n = len(kwargs) // 2
+            rows = [[kwargs["d%d" % i], kwargs["t%d" % i], i] for i in range(n)]
+            return MockResults(rows, [mysql_desc(c) for c in rows[0]])
+
+        self.mock_engine.execute.side_effect = batch
+        self.app.config["metaserv_batch_max_items"] = 2000
+        pairs = [["db%d" % (i % 300), "T%d" % i] for i in range(1200)]
+        resp = self.client.post("/meta/v0/batch/tables",
+                                data=json.dumps({"tables": pairs}))
+        results = json.loads(resp.data)["results"]
+        self.assertEqual([[r["dbName"], r["tableName"]] for r in results], pairs)
+        self.assertTrue(all("result" in r for r in results))
+        # 300 databases, 3 queries
+        self.assertEqual(self.mock_engine.execute.call_count,
+                         (len(pairs) + metaREST_v0._BATCH_CHUNK - 1) //
+                         metaREST_v0._BATCH_CHUNK)
+
+    def test_batch_tables_case(self):
+        # names compare case-insensitively, as with the default collation of
+        # MySQL: results are matched on the names as requested
+        stored = {("db1", "object"): [1, 1, "Object", "objects"]}
+        side_effect = self.mock_engine.execute.side_effect
+
+        def batch(query, **kwargs):
+            if "AS Requested" not in str(query):
+                return side_effect(query, **kwargs)
+            requested = [(kwargs["d%d" % i], kwargs["t%d" % i])
+                         for i in range(len(kwargs) // 2)]
+            rows = [[d, t] + stored[(d.lower(), t.lower())] for (d, t) in requested
+                    if (d.lower(), t.lower()) in stored]
+            return MockResults(rows, [mysql_desc(c) for c in rows[0]])
+
+        self.mock_engine.execute.side_effect = batch
+        body = {"tables": [["db1", "object"], ["DB1", "OBJECT"], ["db1", "Object"]]}
+        resp = self.client.post("/meta/v0/batch/tables", data=json.dumps(body))
+        results = json.loads(resp.data)["results"]
+        self.assertEqual([[r["dbName"], r["tableName"]] for r in results],
+                         body["tables"])
+        for r in results:
+            self.assertEqual(r["result"], [1, 1, "Object", "objects"])
+
+    def test_remote_server(self):
+        query = "SELECT connHost, connPort FROM DbRepo WHERE dbName=:dbName"
+        self.queries[query] = ["otherhost", 3307]
+        remote_engine = MagicMock()
+        remote_engine.execute.side_effect = self.mock_engine.execute.side_effect
+        registry = MagicMock()
+        registry.get.return_value = remote_engine
+        self.app.extensions["metaserv_engines"] = registry
+        url = "/meta/v0/db/L2/DC_W13_Stripe82/tables/Science_Ccd_Exposure/schema"
+        resp = self.client.get(url)
+        self.assertEqual(json.loads(resp.data)["result"],
+                         self.queries[self.urls[url]])
+        registry.get.assert_called_once_with("otherhost", 3307)
+        self.assertEqual(str(remote_engine.execute.call_args[0][0]),
+                         self.urls[url])
+
+    def test_image_search(self):
+        # _SEARCH_FIELDS, then healpixId
+        rows = [[1, "a.fits", 1, 359.9, 0.05, "2015-01-01 00:00:00", 15.0, 57023.0, 10],
+                [1, "a.fits", 2, 0.3, -0.1, "2015-01-01 00:00:00", 15.0, 57023.0, 11],
+                [2, "b.fits", 1, 0.6, 0.0, "2015-01-02 00:00:00", 30.0, 57024.0, 12]]
+        side_effect = self.mock_engine.execute.side_effect
+
+        def search(query, **kwargs):
+            if "FROM FitsStructuredMeta" in str(query):
+                return MockResults(rows, [mysql_desc(c) for c in rows[0]])
+            return side_effect(query, **kwargs)
+
+        self.mock_engine.execute.side_effect = search
+        resp = self.client.get("/meta/v0/image/L1/raw/search?ra=0&dec=0&radius=0.5")
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.data)["results"]
+        self.assertEqual([(r["fileId"], r["hdu"]) for r in results], [(1, 1), (1, 2)])
+        self.assertAlmostEqual(results[1]["distance"], (0.3 ** 2 + 0.1 ** 2) ** 0.5, 3)
+        self.assertEqual(results[0]["fileName"], "a.fits")
+        (query, kwargs) = self.mock_engine.execute.call_args
+        self.assertIn("healpixId BETWEEN :pixFirst0 AND :pixLast0", str(query[0]))
+        self.assertIn("ORDER BY healpixId, fileId, hdu LIMIT", str(query[0]))
+        self.assertEqual((kwargs["lsstLevel"], kwargs["repo"]), ("L1", "raw"))
+        for args in ("ra=0&dec=0", "ra=0&dec=91&radius=1", "ra=x&dec=0&radius=1",
+                     "ra=0&dec=0&radius=0", "ra=0&dec=0&radius=20"):
+            resp = self.client.get("/meta/v0/image/L1/raw/search?" + args)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_image_search_pages(self):
+        inside = [0.1, 0.0, "2015-01-01 00:00:00", 15.0, 57023.0]
+        outside = [5.0, 0.0, "2015-01-01 00:00:00", 15.0, 57023.0]
+        # _SEARCH_FIELDS, then the sort column (healpixId, or obsStart)
+        rows = [[1, "a.fits", 1] + inside, [1, "a.fits", 2] + outside,
+                [2, "b.fits", 1] + outside, [3, "c.fits", 1] + inside,
+                [4, "d.fits", 1] + inside, [5, "e.fits", 1] + inside]
+        rows = [r + [100 - r[0]] for r in rows]
+        side_effect = self.mock_engine.execute.side_effect
+
+        def search(query, **kwargs):
+            if "FROM FitsStructuredMeta" not in str(query):
+                return side_effect(query, **kwargs)
+            if "ORDER BY obsStart" in str(query):
+                ordered = [r[:-1] + [r[5]] for r in rows]
+                key = lambda r: (metaREST_v0._parseTime(r[-1]), r[0], r[2])
+            else:
+                ordered = rows
+                key = lambda r: (r[-1], r[0], r[2])
+            ordered = sorted(ordered, key=key)
+            selected = [r for r in ordered if "afterKey" not in kwargs or key(r) >
+                        (kwargs["afterKey"], kwargs["afterFileId"], kwargs["afterHdu"])]
+            selected = selected[:kwargs["pageLimit"]]
+            return MockResults(selected, [mysql_desc(c) for c in rows[0]])
+
+        self.mock_engine.execute.side_effect = search
+        url = "/meta/v0/image/L1/raw/search?ra=0&dec=0&radius=1&limit=2" \
+              "&obsStartMin=2014-12-25&expTimeMax=30"
+        json_resp = json.loads(self.client.get(url).data)
+        # in healpixId order, rows outside of the cone are dropped, and the
+        # page filled up
+        self.assertEqual([r["fileId"] for r in json_resp["results"]], [5, 4])
+        self.assertEqual(json_resp["results"][0]["expMidpt"], 57023.0)
+        (query, kwargs) = self.mock_engine.execute.call_args
+        self.assertIn("obsStart >= :obsStartMin", str(query[0]))
+        self.assertIn("expTime <= :expTimeMax", str(query[0]))
+        self.assertEqual(kwargs["obsStartMin"].day, 25)
+        self.assertEqual(kwargs["expTimeMax"], 30.)
+        self.assertEqual(kwargs["pageLimit"], 3)
+        self.assertTrue(str(query[0]).startswith("SELECT STRAIGHT_JOIN"))
+        self.mock_engine.execute.reset_mock()
+        json_resp = json.loads(self.client.get(json_resp["next"]).data)
+        # the page starts after the last result, the page is refilled after
+        # the last row read
+        calls = [c for c in self.mock_engine.execute.call_args_list
+                 if "FROM FitsStructuredMeta" in str(c[0][0])]
+        self.assertIn("healpixId >= :afterKey", str(calls[0][0][0]))
+        self.assertEqual([c[1]["afterKey"] for c in calls], [96, 99])
+        self.assertEqual([r["fileId"] for r in json_resp["results"]], [3, 1])
+        self.assertEqual(json_resp["next"], None)
+        # time filters alone, in obsStart order
+        url = "/meta/v0/image/L1/raw/search?obsStartMax=2015-01-01T12:00:00"
+        json_resp = json.loads(self.client.get(url).data)
+        self.assertEqual(len(json_resp["results"]), len(rows))
+        self.assertNotIn("distance", json_resp["results"][0])
+        self.assertNotIn("healpixId", str(self.mock_engine.execute.call_args[0][0]))
+        self.assertIn("ORDER BY obsStart, fileId, hdu LIMIT",
+                      str(self.mock_engine.execute.call_args[0][0]))
+        url += "&limit=4"
+        json_resp = json.loads(self.client.get(url).data)
+        self.assertEqual([(r["fileId"], r["hdu"]) for r in json_resp["results"]],
+                         [(1, 1), (1, 2), (2, 1), (3, 1)])
+        json_resp = json.loads(self.client.get(json_resp["next"]).data)
+        self.assertEqual(self.mock_engine.execute.call_args[1]["afterKey"],
+                         metaREST_v0._parseTime("2015-01-01 00:00:00"))
+        self.assertEqual([r["fileId"] for r in json_resp["results"]], [4, 5])
+        for args in ("obsStartMin=yesterday", "expTimeMin=x",
+                     "after=" + metaREST_v0._encodeCursor("abc"),
+                     "after=" + metaREST_v0._encodeCursor([1, 2]),
+                     "after=" + metaREST_v0._encodeCursor(["x", 1, 2]),
+                     "ra=0&dec=0&radius=1&after=" +
+                     metaREST_v0._encodeCursor(["2015-01-01", 1, 2])):
+            resp = self.client.get("/meta/v0/image/L1/raw/search?" + args)
+            self.assertEqual(resp.status_code, 400)
+
 
 if __name__ == '__main__':
     unittest.main()